@@ -0,0 +1,242 @@
+"""Async GET handlers of the hot read routes, used under ASGI.
+
+A handler gets the route's DRF view set up as 'APIView.initial' does,
+reads the database with the async ORM interface and returns the same
+content the DRF view would. Other methods, format suffixes, renderers
+other than JSON and any error are passed to the DRF view itself, which
+runs in a thread.
+
+Streaming responses (shopping cart download) are left to the DRF view
+as well: 'foodgram.asgi' iterates them in the request's thread.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, HttpResponse
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.renderers import JSONRenderer
+
+from .authentication import CachedTokenAuthentication, token_cache
+from .caching import (aget_recipe_content_version, aget_user_interactions,
+                      get_recipe_response_cache_key)
+from .db_routing import read_from_primary
+from .recipe_rows import RecipeRowsBuilder
+from .reference_data import prerendered_ingredients, prerendered_tags
+from .search_index import ingredient_search_index
+from .serializers import SubscriptionSerializer
+from .utils import (annotate_followed_authors, get_authors_recipes_queryset,
+                    get_positive_int_param, get_search_terms,
+                    group_recipes_by_author)
+
+User = get_user_model()
+
+# DRF view answers these with its usual error response
+FALLBACK_ERRORS = (APIException, Http404, ObjectDoesNotExist, ValueError)
+
+
+async def authenticate(request):
+    """Return user of 'Token' authorization, None if DRF has to decide."""
+    auth = get_authorization_header(request).split()
+    if not auth:
+        return AnonymousUser()
+    if len(auth) != 2 or auth[0].lower() != b"token":
+        return None
+    key = auth[1].decode()
+    credentials = None
+    if token_cache.shared_cache is None:
+        # local entries are read without blocking the event loop
+        credentials = token_cache.get(key)
+    if credentials is None:
+        credentials = await sync_to_async(
+            CachedTokenAuthentication().authenticate_credentials)(key)
+    return credentials[0]
+
+
+def init_view(callback, request, user, kwargs):
+    """Return DRF view of the route, None if it won't render JSON."""
+    # the same steps as the view function of 'ViewSetMixin.as_view'
+    view = callback.cls(**callback.initkwargs)
+    view.action_map = {"head": callback.actions["get"], **callback.actions}
+    for method, action in view.action_map.items():
+        setattr(view, method, getattr(view, action))
+    view.args, view.kwargs = (), kwargs
+    view.request = view.initialize_request(request)
+    view.request.user = user
+    view.headers = view.default_response_headers
+    view.initial(view.request)
+    renderer = view.request.accepted_renderer
+    if (not isinstance(renderer, JSONRenderer)
+            or view.request.accepted_media_type != renderer.media_type):
+        return None
+    return view
+
+
+def finalize_response(view, response):
+    headers = dict(view.headers)
+    vary = headers.pop("Vary", None)
+    if vary is not None:
+        patch_vary_headers(response, (vary,))
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def render(view, data):
+    request = view.request
+    content = request.accepted_renderer.render(
+        data, request.accepted_media_type, view.get_renderer_context())
+    return HttpResponse(content, content_type=request.accepted_media_type)
+
+
+async def get_response(handler, callback, request, kwargs):
+    user = await authenticate(request)
+    if user is None:
+        return None
+    view = init_view(callback, request, user, kwargs)
+    if view is None:
+        return None
+    response = await handler(view)
+    if response is None:
+        return None
+    return finalize_response(view, response)
+
+
+def async_read_view(handler, callback):
+    """Serve GET requests of a DRF route with an async handler."""
+    async def view(request, *args, **kwargs):
+        if request.method == "GET" and "format" not in kwargs:
+            try:
+                response = await get_response(
+                    handler, callback, request, kwargs)
+            except FALLBACK_ERRORS:
+                response = None
+            if response is not None:
+                return response
+        return await sync_to_async(callback)(request, *args, **kwargs)
+
+    # keeps 'cls', 'actions' and 'csrf_exempt' of the DRF view function
+    # for introspection, the DRF view is '__wrapped__'
+    return functools.update_wrapper(view, callback)
+
+
+async def filter_by_author(view, queryset):
+    # async 'author' filterset of RecipeModelViewSet
+    author = view.request.query_params.get("author")
+    if not author:
+        return queryset
+    if not await User.objects.filter(pk=author).aexists():
+        raise ValidationError({"author": "Unknown author."})
+    return queryset.filter(author_id=author)
+
+
+async def get_cached_recipe_data(view, get_data):
+    # async 'RecipeModelViewSet.get_cached_response'
+    if not view.request.user.is_anonymous:
+        return await get_data(view)
+
+    cache_key = get_recipe_response_cache_key(
+        view.request, await aget_recipe_content_version())
+    data = await cache.aget(cache_key)
+    if data is None:
+        with read_from_primary():
+            data = await get_data(view)
+        await cache.aset(
+            cache_key, data, settings.RECIPE_RESPONSE_CACHE_TIMEOUT)
+    return data
+
+
+async def get_recipe_rows(view):
+    view.interactions = await aget_user_interactions(view.request.user)
+    builder = RecipeRowsBuilder(view.get_serializer_context())
+    queryset = await filter_by_author(view, view.get_queryset())
+    return builder, builder.get_rows(queryset)
+
+
+async def get_recipe_list_data(view):
+    builder, rows = await get_recipe_rows(view)
+    page = await view.paginator.apaginate_queryset(rows, view.request, view)
+    if page is None:
+        return await builder.abuild(rows)
+    return view.paginator.get_paginated_response(
+        await builder.abuild(page)).data
+
+
+async def get_recipe_detail_data(view):
+    builder, rows = await get_recipe_rows(view)
+    row = await rows.aget(pk=view.kwargs["pk"])
+    view.check_object_permissions(view.request, row)
+    return (await builder.abuild([row]))[0]
+
+
+async def recipe_list(view):
+    if not settings.RECIPE_FAST_READ_PATH:
+        return None
+    return render(
+        view, await get_cached_recipe_data(view, get_recipe_list_data))
+
+
+async def recipe_detail(view):
+    if not settings.RECIPE_FAST_READ_PATH:
+        return None
+    return render(
+        view, await get_cached_recipe_data(view, get_recipe_detail_data))
+
+
+async def subscriptions(view):
+    request = view.request
+    queryset = annotate_followed_authors(
+        request.user.users_followed.order_by("pk"))
+    authors = await view.paginator.apaginate_queryset(queryset, request, view)
+    recipes_limit = request.query_params.get("recipes_limit")
+    recipes_limit = int(recipes_limit) if recipes_limit else None
+    recipes = get_authors_recipes_queryset(authors, recipes_limit)
+    serializer = SubscriptionSerializer(authors, many=True, context={
+        "author_recipes": group_recipes_by_author(
+            [recipe async for recipe in recipes]),
+    })
+    return render(
+        view, view.paginator.get_paginated_response(serializer.data).data)
+
+
+async def tag_list(view):
+    return await prerendered_tags.aget_response(view.request)
+
+
+async def ingredient_list(view):
+    request = view.request
+    if view.search_param not in request.query_params:
+        return await prerendered_ingredients.aget_response(request)
+    search_terms = get_search_terms(request, view.search_param)
+    limit = get_positive_int_param(request, "limit")
+    return render(
+        view, await ingredient_search_index.asearch(search_terms, limit))
+
+
+ASYNC_READ_HANDLERS = {
+    "Recipe-list": recipe_list,
+    "Recipe-feed": recipe_list,
+    "Recipe-detail": recipe_detail,
+    "User-subscriptions": subscriptions,
+    "tag-list": tag_list,
+    "ingredient-list": ingredient_list,
+}
+
+
+def get_async_read_urls(urls):
+    """Return router URLs with GET of hot read routes served async."""
+    async_urls = []
+    for url in urls:
+        handler = ASYNC_READ_HANDLERS.get(url.name)
+        if handler is not None:
+            url = URLPattern(url.pattern, async_read_view(
+                handler, url.callback), url.default_args, url.name)
+        async_urls.append(url)
+    return async_urls
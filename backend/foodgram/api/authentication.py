@@ -0,0 +1,114 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+from .checks import PROCESS_LOCAL_CACHES
+
+AUTH_TOKEN_KEY = "auth-token:{key}"
+
+
+class TokenCache:
+    """Cache of authenticated (user, token) pairs by token key.
+
+    Entries live for TOKEN_AUTH_CACHE_TIMEOUT seconds in the Django
+    cache named by TOKEN_AUTH_SHARED_CACHE, the default one unless
+    configured, so invalidation reaches every worker at once. Without
+    a name, or when the cache is local to a process, they live in a
+    per-process LRU of TOKEN_AUTH_CACHE_SIZE entries instead; other
+    workers notice invalidation after the timeout at most then.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def shared_cache(self):
+        alias = settings.TOKEN_AUTH_SHARED_CACHE
+        if (not alias or settings.CACHES[alias]["BACKEND"]
+                in PROCESS_LOCAL_CACHES):
+            return None
+        return caches[alias]
+
+    def get(self, key):
+        if self.shared_cache is not None:
+            entry = self.shared_cache.get(AUTH_TOKEN_KEY.format(key=key))
+        else:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    if entry[0] <= time.monotonic():
+                        del self.entries[key]
+                        return None
+                    self.entries.move_to_end(key)
+                    entry = entry[1:]
+        if entry is None:
+            return None
+        # callers annotate request.user, every request gets own copies
+        user, token = copy.copy(entry[0]), copy.copy(entry[1])
+        token.user = user
+        return user, token
+
+    def set(self, key, user, token):
+        user, token = copy.copy(user), copy.copy(token)
+        timeout = settings.TOKEN_AUTH_CACHE_TIMEOUT
+        if self.shared_cache is not None:
+            self.shared_cache.set(
+                AUTH_TOKEN_KEY.format(key=key), (user, token), timeout)
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, user, token)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_AUTH_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        if self.shared_cache is not None:
+            self.shared_cache.delete_many(
+                [AUTH_TOKEN_KEY.format(key=key) for key in keys])
+            return
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def delete_user(self, user_pk):
+        # a user has a single token, but stale local entries of
+        # a replaced one are dropped too; Token is imported here as
+        # authentication classes are loaded before apps are ready
+        from rest_framework.authtoken.models import Token
+
+        keys = set(Token.objects.filter(
+            user_id=user_pk).values_list("key", flat=True))
+        with self.lock:
+            keys.update(key for key, entry in self.entries.items()
+                        if entry[1].pk == user_pk)
+        self.delete(*keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication skipping the token and user query on hits.
+
+    Only successful authentications are cached. Entries are dropped
+    when the token is deleted (logout) or the password or is_active of
+    its user change, see 'api.signals'. Other changes of the user show
+    up once the entry expires.
+    """
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, *credentials)
+        return credentials
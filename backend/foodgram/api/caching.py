@@ -0,0 +1,143 @@
+import hashlib
+import time
+from typing import NamedTuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+
+USER_INTERACTIONS_KEY = "user-interactions:{user_pk}"
+CATALOGUE_VERSION_KEY = "catalogue-version"
+RECIPE_CONTENT_VERSION_KEY = "recipe-content-version"
+RECIPE_RESPONSE_KEY = "recipe-response:{version}:{digest}"
+
+
+class UserInteractions(NamedTuple):
+    favorite_recipes: frozenset
+    shopping_cart: frozenset
+    users_followed: frozenset
+
+
+EMPTY_INTERACTIONS = UserInteractions(frozenset(), frozenset(), frozenset())
+
+
+# user relations the interaction sets are read from, in field order
+INTERACTION_RELATED_NAMES = (
+    "favorite_recipes", "shopping_cart", "users_followed")
+
+
+def get_related_ids_queryset(user, related_name):
+    field = user._meta.get_field(related_name)
+    through = field.remote_field.through
+    return through.objects.filter(
+        **{field.m2m_field_name(): user.pk}
+    ).values_list(field.m2m_reverse_name(), flat=True)
+
+
+def get_related_ids(user, related_name):
+    return frozenset(get_related_ids_queryset(user, related_name))
+
+
+def get_user_interactions(user):
+    """Return favorite, shopping cart and followed ID sets of the user.
+
+    Sets are loaded with three plain ID queries on the first call and
+    served from cache afterwards, so the recipe queryset doesn't need
+    per-row subqueries to compute interaction flags.
+    """
+    if user.is_anonymous:
+        return EMPTY_INTERACTIONS
+
+    key = USER_INTERACTIONS_KEY.format(user_pk=user.pk)
+    interactions = cache.get(key)
+    if interactions is None:
+        # IDs are read from the through tables' (source, target) unique
+        # indexes, without joining related tables or sorting
+        interactions = UserInteractions(*(
+            get_related_ids(user, related_name)
+            for related_name in INTERACTION_RELATED_NAMES
+        ))
+        cache.set(
+            key, interactions, settings.USER_INTERACTIONS_CACHE_TIMEOUT)
+    return interactions
+
+
+async def aget_user_interactions(user):
+    """Async variant of 'get_user_interactions' sharing its cache."""
+    if user.is_anonymous:
+        return EMPTY_INTERACTIONS
+
+    key = USER_INTERACTIONS_KEY.format(user_pk=user.pk)
+    interactions = await cache.aget(key)
+    if interactions is None:
+        related_ids = []
+        for related_name in INTERACTION_RELATED_NAMES:
+            queryset = get_related_ids_queryset(user, related_name)
+            related_ids.append(frozenset([pk async for pk in queryset]))
+        interactions = UserInteractions(*related_ids)
+        await cache.aset(
+            key, interactions, settings.USER_INTERACTIONS_CACHE_TIMEOUT)
+    return interactions
+
+
+def invalidate_user_interactions(user):
+    cache.delete(USER_INTERACTIONS_KEY.format(user_pk=user.pk))
+
+
+def get_catalogue_version():
+    """Return version of tags, ingredients and measurement units.
+
+    Version is the time of the last catalogue change in nanoseconds.
+    It is kept in the default cache, shared by all processes (see
+    'api.checks'), so workers notice changes made by the others and
+    by management commands.
+    """
+    return cache.get_or_set(CATALOGUE_VERSION_KEY, time.time_ns, None)
+
+
+async def aget_catalogue_version():
+    return await cache.aget_or_set(CATALOGUE_VERSION_KEY, time.time_ns, None)
+
+
+def bump_catalogue_version():
+    cache.set(CATALOGUE_VERSION_KEY, time.time_ns(), None)
+
+
+def get_recipe_content_version():
+    """Return version of everything rendered in anonymous recipe pages.
+
+    Like catalogue version, it is the time of the last change in
+    nanoseconds kept in the cache shared by all processes.
+    """
+    return cache.get_or_set(RECIPE_CONTENT_VERSION_KEY, time.time_ns, None)
+
+
+async def aget_recipe_content_version():
+    return await cache.aget_or_set(
+        RECIPE_CONTENT_VERSION_KEY, time.time_ns, None)
+
+
+def bump_recipe_content_version():
+    cache.set(RECIPE_CONTENT_VERSION_KEY, time.time_ns(), None)
+
+
+def get_recipe_response_cache_key(request, version=None):
+    """Build response cache key from the request URL.
+
+    Query parameters are sorted, so the same page requested with
+    parameters in different order shares a cache entry. Content version
+    is a part of the key: bumping it makes all cached pages unreachable.
+    Async callers pass the version they have read themselves.
+    """
+    if version is None:
+        version = get_recipe_content_version()
+    query = sorted(
+        (param, value)
+        for param, values in request.query_params.lists()
+        for value in values
+    )
+    url = f"{request.build_absolute_uri(request.path)}?{urlencode(query)}"
+    return RECIPE_RESPONSE_KEY.format(
+        version=version,
+        digest=hashlib.md5(url.encode()).hexdigest(),
+    )
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = ("django.core.cache.backends.locmem.LocMemCache",)
+# keep nothing, every value is lost
+NON_STORING_CACHES = ("django.core.cache.backends.dummy.DummyCache",)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Require the default cache to be shared by all processes.
+
+    Catalogue and recipe content versions live there: a version bumped
+    by a management command or another worker has to be seen by every
+    worker, or they keep serving stale cached data.
+    """
+    if settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        "Default cache is local to a process.",
+        hint="Set CACHE_BACKEND to a file, memcached or Redis backend.",
+        id="api.E001",
+    )]
+
+
+@register(Tags.caches, Tags.database)
+def check_replica_pin_cache(app_configs, **kwargs):
+    """Require a shared cache keeping values for read replicas.
+
+    A write pins the user's reads to the primary with a default cache
+    entry, see 'api.db_routing'. A worker that can't see the entry
+    reads from a lagging replica, and the user misses own changes.
+    """
+    backend = settings.CACHES["default"]["BACKEND"]
+    if not settings.DATABASE_REPLICAS or backend not in (
+            PROCESS_LOCAL_CACHES + NON_STORING_CACHES):
+        return []
+    return [Error(
+        "Read replicas need the default cache to keep pins to primary "
+        "for all processes.",
+        hint="Set CACHE_BACKEND to a file backend, or to memcached or "
+             "Redis when running on several machines.",
+        id="api.E002",
+    )]
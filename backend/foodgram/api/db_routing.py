@@ -0,0 +1,110 @@
+"""Routing of API reads to read replicas.
+
+Safe-method requests of views using ReplicaReadMixin read from one of
+DATABASE_REPLICAS, picked once per request. Writes of a user pin their
+reads to the primary for REPLICA_PIN_TIMEOUT seconds, so they see their
+own changes despite replication lag; pins live in the default cache,
+which has to be shared by all processes (see 'api.checks'), and by all
+machines when there are several. Auth tokens are always read from
+the primary: a token is used right after login, before replicas may
+have it.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_PIN_KEY = "replica-pin:{user_pk}"
+PRIMARY_ONLY_MODELS = ("authtoken.Token",)
+
+# set for every request by ReplicaRoutingMiddleware
+current_routing = ContextVar("current_routing", default=None)
+
+
+def pin_to_primary(user):
+    if settings.DATABASE_REPLICAS and user.is_authenticated:
+        cache.set(REPLICA_PIN_KEY.format(user_pk=user.pk), True,
+                  settings.REPLICA_PIN_TIMEOUT)
+
+
+def is_pinned_to_primary(user):
+    return user.is_authenticated and bool(
+        cache.get(REPLICA_PIN_KEY.format(user_pk=user.pk)))
+
+
+class RequestRouting:
+    """Read database of a request.
+
+    It is picked on the first routed read, so under ASGI the pin is
+    looked up in the thread running the query, not in the event loop.
+    """
+
+    def __init__(self):
+        self.user = None
+        self.database = None
+
+    def use_replicas(self, user):
+        self.user = user
+
+    def get_read_database(self):
+        if self.user is None or not settings.DATABASE_REPLICAS:
+            return None
+        if self.database is None:
+            self.database = (
+                DEFAULT_DB_ALIAS if is_pinned_to_primary(self.user)
+                else random.choice(settings.DATABASE_REPLICAS))
+        return self.database
+
+
+@contextmanager
+def read_from_primary():
+    """Send reads of the block to the primary.
+
+    Used where data is cached under a version bumped by a write: data
+    of a lagging replica would stay there until the entry expires.
+    """
+    token = current_routing.set(None)
+    try:
+        yield
+    finally:
+        current_routing.reset(token)
+
+
+class ReplicaRouter:
+    """Database router reading from the replica picked for a request."""
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is None or model._meta.label in PRIMARY_ONLY_MODELS:
+            return None
+        return routing.get_read_database()
+
+    def db_for_write(self, model, **hints):
+        # objects read from a replica are saved to the primary too
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """Read from a replica on safe methods, pin the user on writes."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        routing = current_routing.get()
+        if routing is not None and request.method in SAFE_METHODS:
+            routing.use_replicas(request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # a successful response passed 'initial', the user is known
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
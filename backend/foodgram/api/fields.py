@@ -4,6 +4,8 @@ import os
 from django.core.files.base import ContentFile
 from rest_framework import serializers
 
+from recipes.images import get_image_variant_url  # isort:skip
+
 
 class Base64EncodedImageField(serializers.ImageField):
 
@@ -15,3 +17,27 @@ class Base64EncodedImageField(serializers.ImageField):
             name = os.urandom(8).hex()
             data = ContentFile(img, name=f"{name}." + ext)
         return super().to_internal_value(data)
+
+
+class RecipeImageVariantField(serializers.ImageField):
+    """Read-only image field representing image by its variant URL.
+
+    Variant is taken from 'image_variant' serializer context key,
+    original image URL is used when there is none or the recipe of
+    the image has not got it yet.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        variant = self.context.get("image_variant")
+        if not value or not variant:
+            return super().to_representation(value)
+        url = get_image_variant_url(
+            value, variant, value.instance.image_variants)
+        request = self.context.get("request")
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
@@ -1,40 +1,91 @@
-from django.db.models import Q, Value
-from django.db.models.constants import LOOKUP_SEP
-from rest_framework.filters import SearchFilter
-
-
-class CustomOrderedIngredientSearchFilter(SearchFilter):
-
-    def filter_queryset(self, request, queryset, view):
-        self.search_param = "name"
-        if self.search_param not in request.query_params:
-            return queryset
-
-        search_fields = self.get_search_fields(view, request)
-        search_terms = self.get_search_terms(request)
-
-        queryset = queryset.order_by()
-
-        search_istartswith = []
-        for search_field in search_fields:  # type:ignore
-            orm_lookup = LOOKUP_SEP.join((f"{search_field}", "istartswith"))
-            search_istartswith_intermediate_list = [
-                Q(**{orm_lookup: term}) for term in search_terms]
-            search_istartswith.extend(search_istartswith_intermediate_list)
-
-        query_istartswith = (queryset.filter(*search_istartswith)
-                                     .annotate(order_field=Value(1)))
-
-        search_icontains = []
-        for search_field in search_fields:  # type:ignore
-            orm_lookup = LOOKUP_SEP.join((f"{search_field}", "icontains"))
-            search_icontains_intermediate_list = [
-                Q(**{orm_lookup: term}) for term in search_terms]
-            search_icontains.extend(search_icontains_intermediate_list)
-
-        query_icontains = (queryset.filter(*search_icontains)
-                                   .exclude(*search_istartswith)
-                                   .annotate(order_field=Value(2)))
-        return query_istartswith.union(query_icontains).order_by(
-            "order_field", "name",
-        )
+import re
+
+from django.db import connections
+from django.db.models import (BooleanField, Exists, FloatField, OuterRef, Q,
+                              Value)
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe  # isort:skip
+
+POSTGRESQL_SEARCH_QUERY = "to_tsquery('russian', %s)"
+
+
+def filter_recipes_by_tags(queryset, tag_slugs):
+    """Keep recipes tagged with any of given tag slugs.
+
+    Filtering is done with EXISTS over the recipe-tag table, so recipe
+    rows are neither multiplied by a join nor need DISTINCT afterwards.
+    """
+    if not tag_slugs:
+        return queryset
+    recipe_tags = Recipe.tags.through.objects.filter(
+        recipe=OuterRef("pk"), tag__slug__in=tag_slugs
+    )
+    return queryset.filter(Exists(recipe_tags))
+
+
+def get_postgresql_search_query(terms):
+    """Return to_tsquery() input requiring all terms, None if no words.
+
+    Matches the same as the FTS5 query on SQLite: words of a term follow
+    each other and the last one is a prefix. Only word characters are
+    kept, so tsquery syntax in input is inert.
+    """
+    phrases = []
+    for term in terms:
+        words = [f"'{word}'" for word in re.findall(r"\w+", term)]
+        if words:
+            words[-1] += ":*"
+            phrases.append(" <-> ".join(words))
+    if not phrases:
+        return None
+    return " & ".join(phrases)
+
+
+def search_recipes(queryset, terms):
+    """Keep recipes whose name or text contain all terms, best first.
+
+    Matching goes through the full-text index created by the
+    '0004_recipe_search' migration: a GIN indexed tsvector with
+    ts_rank() on PostgreSQL, FTS5 with bm25() on SQLite, with prefix
+    matching on both. Name matches weigh more than text ones. Other
+    databases have no index, there every term is looked up as a
+    substring and all matches rank the same. Recipes are annotated with
+    'search_rank', higher is better.
+    """
+    if not terms:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == "postgresql":
+        query = get_postgresql_search_query(terms)
+        if query is None:
+            return queryset.none()
+        matches = RawSQL(
+            f"recipes_recipe.search_vector @@ {POSTGRESQL_SEARCH_QUERY}",
+            (query,), output_field=BooleanField())
+        rank = RawSQL(
+            "ts_rank(recipes_recipe.search_vector, "
+            f"{POSTGRESQL_SEARCH_QUERY})",
+            (query,), output_field=FloatField())
+        queryset = queryset.filter(matches)
+    elif vendor == "sqlite":
+        # every term is quoted, so FTS5 query syntax in input is inert
+        query = " ".join(
+            '"{}"*'.format(term.replace('"', '""')) for term in terms)
+        matching_ids = RawSQL(
+            "SELECT rowid FROM recipes_recipe_search "
+            "WHERE recipes_recipe_search MATCH %s", (query,))
+        rank = RawSQL(
+            "(SELECT -bm25(recipes_recipe_search, 10.0, 1.0) "
+            "FROM recipes_recipe_search "
+            "WHERE recipes_recipe_search MATCH %s "
+            "AND rowid = recipes_recipe.id)",
+            (query,), output_field=FloatField())
+        queryset = queryset.filter(pk__in=matching_ids)
+    else:
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) | Q(text__icontains=term))
+        rank = Value(0.0, output_field=FloatField())
+    return queryset.annotate(search_rank=rank).order_by(
+        "-search_rank", "-publication_date", "-id")
@@ -0,0 +1,211 @@
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.authtoken.models import Token
+
+from .run_benchmark import percentile
+
+from recipes.models import Ingredient, Recipe  # isort:skip
+
+User = get_user_model()
+
+SERVERS = {
+    "wsgi": ("foodgram.wsgi:application",),
+    "asgi": ("foodgram.asgi:application",
+             "--worker-class", "uvicorn.workers.UvicornWorker"),
+}
+# Placeholders are filled from the database by 'get_load_paths'.
+LOAD_PATHS = (
+    "/api/recipes/",
+    "/api/recipes/?page=2",
+    "/api/recipes/{recipe}/",
+    "/api/recipes/feed/",
+    "/api/users/subscriptions/?recipes_limit=3",
+    "/api/tags/",
+    "/api/ingredients/?name={ingredient}",
+    "/api/recipes/download_shopping_cart/",
+)
+SLOW_CLIENT_PATH = "/api/recipes/download_shopping_cart/"
+SERVER_START_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the project under gunicorn with sync workers (WSGI) and "
+        "with uvicorn workers (ASGI, async read views) in turn and send "
+        "the same load to both: concurrent clients requesting hot read "
+        "endpoints, optionally next to slow clients that take "
+        "--slow-client-delay seconds to send their request. Reports "
+        "throughput, latency percentiles and errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="Number of requests sent at every concurrency level.",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, nargs="+", default=[8, 32])
+        parser.add_argument(
+            "--slow-clients", type=int, nargs="+", default=[0, 4])
+        parser.add_argument(
+            "--slow-client-delay", type=float, default=1.0)
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--host",
+            default=settings.ALLOWED_HOSTS[0],
+            help="Host header of requests, must be in ALLOWED_HOSTS.",
+        )
+
+    def handle(self, *args, **options):
+        self.host = options["host"]
+        self.port = options["port"]
+        self.token = self.get_token()
+        self.paths = self.get_load_paths()
+        self.stdout.write(
+            f"{'server':<8}{'clients':>8}{'slow':>6}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for server in SERVERS:
+            process = self.start_server(server, options)
+            try:
+                asyncio.run(self.wait_for_server(process))
+                for concurrency, slow_clients in itertools.product(
+                    options["concurrency"], options["slow_clients"]
+                ):
+                    result = asyncio.run(self.run_load(
+                        options, concurrency, slow_clients))
+                    self.report(server, concurrency, slow_clients, result)
+            finally:
+                process.terminate()
+                process.wait(timeout=SERVER_START_TIMEOUT)
+
+    def get_token(self):
+        # the most active user has follows, favorites and a cart to read
+        user = User.objects.annotate(
+            follows=Count("users_followed")).order_by("-follows").first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError(
+                "Database has no users or recipes, populate it with "
+                "'generate_synthetic_data' first.")
+        token, _ = Token.objects.get_or_create(user=user)
+        return token.key
+
+    def get_load_paths(self):
+        recipe = Recipe.objects.order_by("-publication_date").first()
+        ingredient = Ingredient.objects.order_by("pk").first()
+        params = {
+            "recipe": recipe.pk,
+            "ingredient": quote(ingredient.name[:3]) if ingredient else "",
+        }
+        return [path.format(**params) for path in LOAD_PATHS]
+
+    def start_server(self, server, options):
+        app, *server_options = SERVERS[server]
+        env = dict(os.environ)
+        env["ASYNC_READ_VIEWS"] = str(server == "asgi")
+        return subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", app, *server_options,
+                "--bind", f"127.0.0.1:{options['port']}",
+                "--workers", str(options["workers"]),
+                "--log-level", "warning",
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+        )
+
+    async def wait_for_server(self, process):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError("Server exited on start.")
+            try:
+                if await self.send(self.paths[0]) == 200:
+                    return
+            except OSError:
+                pass
+            await asyncio.sleep(0.2)
+        raise CommandError("Server didn't respond in time.")
+
+    async def send(self, path, delay=0.0):
+        """Send GET request and return response status code.
+
+        With delay, the request line is sent first and headers follow
+        after delay seconds, as a client on a slow network would do.
+        """
+        reader, writer = await asyncio.open_connection(
+            "127.0.0.1", self.port)
+        try:
+            writer.write(f"GET {path} HTTP/1.1\r\n".encode())
+            if delay:
+                await writer.drain()
+                await asyncio.sleep(delay)
+            writer.write((
+                f"Host: {self.host}\r\n"
+                f"Authorization: Token {self.token}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode())
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        return int(response[9:12]) if response[:5] == b"HTTP/" else 0
+
+    async def run_load(self, options, concurrency, slow_clients):
+        # clients take paths from one shared iterator
+        paths = itertools.islice(
+            itertools.cycle(self.paths), options["requests"])
+        results = []
+        slow_tasks = [
+            asyncio.create_task(
+                self.run_slow_client(options["slow_client_delay"]))
+            for _ in range(slow_clients)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(self.run_client(paths, results)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        for task in slow_tasks:
+            task.cancel()
+        await asyncio.gather(*slow_tasks, return_exceptions=True)
+        return elapsed, results
+
+    async def run_client(self, paths, results):
+        for path in paths:
+            started = time.perf_counter()
+            try:
+                status = await self.send(path)
+            except OSError:
+                status = 0
+            results.append((status, time.perf_counter() - started))
+
+    async def run_slow_client(self, delay):
+        while True:
+            try:
+                await self.send(SLOW_CLIENT_PATH, delay)
+            except OSError:
+                await asyncio.sleep(delay)
+
+    def report(self, server, concurrency, slow_clients, result):
+        elapsed, results = result
+        latencies = [duration * 1000 for status, duration in results
+                     if status == 200]
+        errors = len(results) - len(latencies)
+        self.stdout.write(
+            f"{server:<8}{concurrency:>8}{slow_clients:>6}"
+            f"{len(latencies) / elapsed:>9.1f}"
+            + "".join(f"{percentile(latencies or [0], percent):>9.1f}"
+                      for percent in (50, 95, 99))
+            + f"{errors:>8}")
@@ -0,0 +1,83 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+
+from .explain_queries import DUMMY_CACHE_BACKEND
+
+User = get_user_model()
+
+RENDERING_URLS = (
+    "/api/recipes/?limit={limit}",
+    "/api/recipes/?limit={limit}&fields=id,name,image,cooking_time",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rendering of recipe list by serializers and by values() "
+        "rows with orjson on existing data. Caches are bypassed, so every "
+        "request renders the response, responses of both paths must be "
+        "equal."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--host", default=settings.ALLOWED_HOSTS[0])
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by("pk").first()
+        if user is None:
+            raise CommandError(
+                "No users found, run generate_synthetic_data first.")
+        token, _ = Token.objects.get_or_create(user=user)
+        clients = {
+            "anonymous": Client(HTTP_HOST=options["host"]),
+            "authenticated": Client(
+                HTTP_HOST=options["host"],
+                HTTP_AUTHORIZATION=f"Token {token.key}"),
+        }
+        # the caches may be shared with running servers, so they are
+        # bypassed rather than cleared
+        dummy_caches = {alias: {"BACKEND": DUMMY_CACHE_BACKEND}
+                        for alias in settings.CACHES}
+        with override_settings(CACHES=dummy_caches):
+            for client_name, client in clients.items():
+                for url in RENDERING_URLS:
+                    url = url.format(limit=options["limit"])
+                    self.compare(
+                        f"{client_name} {url}", client, url, options)
+
+    def compare(self, label, client, url, options):
+        timings = {}
+        contents = {}
+        for fast_read_path in (False, True):
+            with override_settings(RECIPE_FAST_READ_PATH=fast_read_path):
+                timings[fast_read_path], contents[fast_read_path] = (
+                    self.run_requests(client, url, options["repeat"]))
+        if contents[False] != contents[True]:
+            self.stderr.write(f"{label}: responses differ!")
+
+        serializers, rows = (statistics.median(timings[False]),
+                             statistics.median(timings[True]))
+        self.stdout.write(
+            f"{label}: serializers {serializers * 1000:.1f} ms, "
+            f"rows {rows * 1000:.1f} ms "
+            f"(x{serializers / rows:.2f}, median of {options['repeat']})"
+        )
+
+    def run_requests(self, client, url, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(
+                    f"{url} responded with {response.status_code}.")
+        return timings, response.content
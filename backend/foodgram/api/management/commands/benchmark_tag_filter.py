@@ -0,0 +1,104 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from api.filters import filter_recipes_by_tags  # isort:skip
+from recipes.models import Recipe, Tag  # isort:skip
+
+User = get_user_model()
+
+BENCHMARK_TAG_SLUGS = ("bench-breakfast", "bench-lunch", "bench-dinner")
+BENCHMARK_TAG_COLORS = ("#B00001", "#B00002", "#B00003")
+
+
+def filter_recipes_by_tags_with_join(queryset, tag_slugs):
+    q_object = Q()
+    for tag_slug in tag_slugs:
+        q_object |= Q(tags__slug=tag_slug)
+    return queryset.filter(q_object).distinct()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare JOIN + DISTINCT and EXISTS tag filtering of recipe list. "
+        "Recipes are created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=100_000)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--page-size", type=int, default=6)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tags = self.seed(options["recipes"], options["batch_size"])
+            slugs = [tag.slug for tag in tags[:2]]
+            base_query = Recipe.objects.order_by("-publication_date", "-id")
+
+            legacy_ids = self.run_query(
+                "JOIN + DISTINCT",
+                filter_recipes_by_tags_with_join(base_query, slugs),
+                options,
+            )
+            exists_ids = self.run_query(
+                "EXISTS",
+                filter_recipes_by_tags(base_query, slugs),
+                options,
+            )
+            if legacy_ids != exists_ids:
+                self.stderr.write("Filters returned different results!")
+            transaction.set_rollback(True)
+
+    def seed(self, recipe_count, batch_size):
+        self.stdout.write(f"Creating {recipe_count} recipes...")
+        author, _ = User.objects.get_or_create(
+            username="benchmark-author",
+            defaults={"email": "benchmark-author@example.com"},
+        )
+        tags = [
+            Tag.objects.get_or_create(
+                slug=slug, defaults={"name": slug, "color": color})[0]
+            for slug, color in zip(BENCHMARK_TAG_SLUGS, BENCHMARK_TAG_COLORS)
+        ]
+        recipe_tag_model = Recipe.tags.through
+
+        for offset in range(0, recipe_count, batch_size):
+            size = min(batch_size, recipe_count - offset)
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    author=author,
+                    name=f"Benchmark recipe {offset + index}",
+                    image="recipe_images/benchmark.png",
+                    text="Benchmark recipe description",
+                    cooking_time=10,
+                )
+                for index in range(size)
+            )
+            recipe_tags = []
+            for recipe in recipes:
+                for tag in random.sample(tags, random.randint(1, len(tags))):
+                    recipe_tags.append(
+                        recipe_tag_model(recipe_id=recipe.pk, tag_id=tag.pk))
+            recipe_tag_model.objects.bulk_create(recipe_tags)
+        return tags
+
+    def run_query(self, label, queryset, options):
+        timings = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            queryset.count()
+            ids = list(
+                queryset.values_list("pk", flat=True)[:options["page_size"]])
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(
+            f"{label}: median {statistics.median(timings) * 1000:.1f} ms, "
+            f"best {min(timings) * 1000:.1f} ms "
+            f"(count + first page, {options['repeat']} runs)"
+        )
+        return ids
@@ -0,0 +1,217 @@
+import json
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag  # isort:skip
+
+User = get_user_model()
+
+# Placeholders are filled from the database by 'get_url_params'.
+ENDPOINTS = (
+    "/api/recipes/",
+    "/api/recipes/?cursor=",
+    "/api/recipes/?tags={tag}",
+    "/api/recipes/?author={author}",
+    "/api/recipes/?is_favorited=1",
+    "/api/recipes/?is_in_shopping_cart=1",
+    "/api/recipes/?search={word}",
+    "/api/recipes/feed/",
+    "/api/recipes/{recipe}/",
+    "/api/recipes/favorite/",
+    "/api/recipes/download_shopping_cart/",
+    "/api/users/",
+    "/api/users/subscriptions/?recipes_limit=3",
+    "/api/ingredients/?name={ingredient}",
+)
+# Reference tables hold a few rows, scanning them is expected.
+SMALL_TABLES = ("recipes_tag", "recipes_measurementunit")
+
+DUMMY_CACHE_BACKEND = "django.core.cache.backends.dummy.DummyCache"
+
+COST_PATTERN = re.compile(r"\s+\(cost=.*\)$")
+
+
+def explain(cursor, sql):
+    """Return plan lines of a statement on SQLite or PostgreSQL."""
+    if connection.vendor == "sqlite":
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+        return [row[3] for row in cursor.fetchall()]
+    if connection.vendor == "postgresql":
+        cursor.execute(f"EXPLAIN {sql}")
+        return [row[0] for row in cursor.fetchall()]
+    raise CommandError(f"EXPLAIN of {connection.vendor} is not supported.")
+
+
+def find_plan_issues(plan, ignored_tables):
+    """Return full scans and sorts of a plan as normalized lines.
+
+    Costs are stripped, so lines can be compared between databases
+    holding different amounts of data.
+    """
+    issues = []
+    for line in plan:
+        line = COST_PATTERN.sub("", line).strip().lstrip("->").strip()
+        words = line.split()
+        if line.startswith("SCAN ") and "VIRTUAL TABLE INDEX" not in line:
+            # full-text index lookups are reported as virtual table scans
+            table = words[1]
+        elif line.startswith("Seq Scan on "):
+            table = words[3]
+        elif line.startswith(("USE TEMP B-TREE", "Sort Key:")):
+            table = None
+        else:
+            continue
+        if table not in ignored_tables:
+            issues.append(line)
+    return issues
+
+
+class Command(BaseCommand):
+    help = (
+        "Send a request to every API endpoint, run EXPLAIN on the SQL it "
+        "issued and report full table scans and sorts. Run it against a "
+        "database populated with 'generate_synthetic_data', issues are "
+        "compared against a baseline file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host",
+            default=settings.ALLOWED_HOSTS[0],
+            help="Host header of requests, must be in ALLOWED_HOSTS.",
+        )
+        parser.add_argument(
+            "--ignore-table",
+            action="append",
+            default=list(SMALL_TABLES),
+            help="Table whose full scans are not reported.",
+        )
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print SQL and full plan of statements with issues.",
+        )
+        parser.add_argument("--baseline", help="Path to baseline file.")
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write found issues to the baseline file.",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with error when an issue is not in baseline.",
+        )
+
+    def handle(self, *args, **options):
+        client = self.get_client(options["host"])
+        params = self.get_url_params()
+        # responses must not come from cache, the shared cache of
+        # running servers is left alone
+        dummy_caches = {alias: {"BACKEND": DUMMY_CACHE_BACKEND}
+                        for alias in settings.CACHES}
+        with override_settings(CACHES=dummy_caches):
+            # results are keyed by endpoint templates, so baselines don't
+            # depend on IDs of a particular database
+            results = {
+                endpoint: self.explain_endpoint(
+                    client, endpoint.format(**params), options)
+                for endpoint in ENDPOINTS
+            }
+
+        baseline = self.read_baseline(options)
+        regressions = self.report(results, baseline)
+        if options["save_baseline"]:
+            self.write_baseline(options, results)
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(
+                f"{len(regressions)} new plan issues: "
+                + ", ".join(regressions))
+
+    def get_client(self, host):
+        # the most active user has follows, favorites and a cart to query
+        user = User.objects.annotate(
+            follows=Count("users_followed")).order_by("-follows").first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError(
+                "Database has no users or recipes, populate it with "
+                "'generate_synthetic_data' first.")
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(HTTP_HOST=host,
+                      HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def get_url_params(self):
+        recipe = Recipe.objects.order_by("-publication_date").first()
+        tag = Tag.objects.filter(recipe__isnull=False).first()
+        ingredient = Ingredient.objects.order_by("pk").first()
+        return {
+            "recipe": recipe.pk,
+            "author": recipe.author_id,
+            "word": recipe.name.split()[0],
+            "tag": tag.slug if tag else "",
+            "ingredient": ingredient.name[:3] if ingredient else "",
+        }
+
+    def explain_endpoint(self, client, url, options):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(
+                f"{url} responded with {response.status_code}.")
+
+        issues = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query["sql"]
+                if not sql.startswith("SELECT"):
+                    continue
+                plan = explain(cursor, sql)
+                query_issues = find_plan_issues(plan, options["ignore_table"])
+                if query_issues and options["verbose_plans"]:
+                    self.stdout.write(f"{url}\n  {sql}\n    "
+                                      + "\n    ".join(plan))
+                issues.extend(query_issues)
+        return sorted(set(issues))
+
+    def read_baseline(self, options):
+        path = options["baseline"]
+        if not path or options["save_baseline"]:
+            return {}
+        try:
+            return json.loads(Path(path).read_text())
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Can't read baseline: {error!r}")
+
+    def write_baseline(self, options, results):
+        if not options["baseline"]:
+            raise CommandError("--save-baseline requires --baseline path.")
+        Path(options["baseline"]).write_text(
+            json.dumps(results, indent=2, sort_keys=True) + "\n")
+        self.stdout.write(f"Baseline saved to {options['baseline']}.")
+
+    def report(self, results, baseline):
+        regressions = []
+        for endpoint, issues in results.items():
+            self.stdout.write(f"{endpoint}: {len(issues) or 'no'} issues")
+            expected = set(baseline.get(endpoint, ()))
+            for issue in issues:
+                if baseline and issue not in expected:
+                    regressions.append(f"{endpoint} {issue}")
+                    self.stdout.write(self.style.ERROR(f"  {issue} (new)"))
+                else:
+                    self.stdout.write(f"  {issue}")
+        if baseline and not regressions:
+            self.stdout.write(self.style.SUCCESS(
+                "No new plan issues against baseline."))
+        return regressions
@@ -0,0 +1,233 @@
+import json
+import math
+import random
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag  # isort:skip
+
+User = get_user_model()
+
+SCENARIO_WEIGHTS = {
+    "recipes_anonymous": 30,
+    "recipes_authenticated": 30,
+    "subscriptions": 15,
+    "ingredient_search": 20,
+    "download_shopping_cart": 5,
+}
+METRICS = ("p50", "p95", "p99", "queries")
+PAGE_SIZE = 6
+TAGGED_PAGE_COUNT = 5
+
+
+def percentile(values, percent):
+    """Return nearest-rank percentile of values."""
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted mix of recipe list, subscriptions, ingredient "
+        "search and shopping cart download requests through the test "
+        "client. Reports p50/p95/p99 latency and queries per request and "
+        "compares them against a baseline file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--warmup", type=int, default=50)
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=50,
+            help="Number of users authenticated requests are sent by.",
+        )
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument(
+            "--host",
+            default=settings.ALLOWED_HOSTS[0],
+            help="Host header of requests, must be in ALLOWED_HOSTS.",
+        )
+        parser.add_argument("--baseline", help="Path to baseline file.")
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write results to the baseline file.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed relative growth of a metric against baseline.",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with error when a metric exceeds baseline.",
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.host = options["host"]
+        self.load_fixtures(options["users"])
+
+        for _ in range(options["warmup"]):
+            self.send_request(self.choose_scenario())
+        samples = {scenario: [] for scenario in SCENARIO_WEIGHTS}
+        for _ in range(options["requests"]):
+            scenario = self.choose_scenario()
+            samples[scenario].append(self.send_request(scenario))
+
+        results = {
+            scenario: self.summarize(scenario_samples)
+            for scenario, scenario_samples in samples.items()
+            if scenario_samples
+        }
+        baseline = self.read_baseline(options)
+        regressions = self.report(results, baseline, options["tolerance"])
+        if options["save_baseline"]:
+            self.write_baseline(options, results)
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(
+                f"{len(regressions)} metrics regressed: "
+                + ", ".join(regressions))
+
+    def load_fixtures(self, user_count):
+        used_tags = Tag.objects.filter(recipe__isnull=False).distinct()
+        self.tag_slugs = list(used_tags.values_list("slug", flat=True))
+        self.ingredient_names = list(
+            Ingredient.objects.values_list("name", flat=True))
+        recipe_count = Recipe.objects.count()
+        if not recipe_count or not self.ingredient_names:
+            raise CommandError(
+                "Database has no recipes or ingredients, populate it with "
+                "'generate_synthetic_data' first.")
+        self.page_count = math.ceil(recipe_count / PAGE_SIZE)
+
+        user_ids = list(User.objects.filter(is_active=True)
+                        .order_by("pk").values_list("pk", flat=True))
+        user_ids = self.random.sample(user_ids, min(user_count, len(user_ids)))
+        self.clients = [self.get_client(user)
+                        for user in User.objects.filter(pk__in=user_ids)]
+        self.anonymous_client = Client(HTTP_HOST=self.host)
+
+    def get_client(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(HTTP_HOST=self.host,
+                      HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def choose_scenario(self):
+        return self.random.choices(
+            list(SCENARIO_WEIGHTS), weights=SCENARIO_WEIGHTS.values())[0]
+
+    def get_request(self, scenario):
+        if scenario == "recipes_anonymous":
+            return self.anonymous_client, self.get_recipes_path()
+        client = self.random.choice(self.clients)
+        if scenario == "recipes_authenticated":
+            return client, self.get_recipes_path()
+        if scenario == "subscriptions":
+            return client, "/api/users/subscriptions/?recipes_limit=3"
+        if scenario == "ingredient_search":
+            name = self.random.choice(self.ingredient_names)
+            prefix = name[:self.random.randint(1, min(4, len(name)))]
+            return self.anonymous_client, {"path": "/api/ingredients/",
+                                           "data": {"name": prefix}}
+        return client, "/api/recipes/download_shopping_cart/"
+
+    def get_recipes_path(self):
+        # Popular first pages are requested more often than the tail.
+        page = min(int(self.random.paretovariate(1.5)), self.page_count)
+        data = {"page": page, "limit": PAGE_SIZE}
+        if self.tag_slugs and self.random.random() < 0.5:
+            # Tag filter shrinks the list, keep to pages that surely exist.
+            data["page"] = min(page, TAGGED_PAGE_COUNT)
+            data["tags"] = self.random.sample(
+                self.tag_slugs, self.random.randint(1, 2))
+        return {"path": "/api/recipes/", "data": data}
+
+    def send_request(self, scenario):
+        client, request = self.get_request(scenario)
+        if isinstance(request, str):
+            request = {"path": request}
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(**request)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise CommandError(
+                f"{scenario}: {request['path']} responded "
+                f"{response.status_code}.")
+        return elapsed * 1000, len(queries)
+
+    def summarize(self, samples):
+        timings = [elapsed for elapsed, _ in samples]
+        return {
+            "requests": len(samples),
+            "p50": round(percentile(timings, 50), 3),
+            "p95": round(percentile(timings, 95), 3),
+            "p99": round(percentile(timings, 99), 3),
+            "queries": round(
+                statistics.mean(count for _, count in samples), 2),
+        }
+
+    def read_baseline(self, options):
+        path = options["baseline"]
+        if not path or options["save_baseline"]:
+            return {}
+        try:
+            return json.loads(Path(path).read_text())
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Can't read baseline: {error!r}")
+
+    def write_baseline(self, options, results):
+        if not options["baseline"]:
+            raise CommandError("--save-baseline requires --baseline path.")
+        Path(options["baseline"]).write_text(
+            json.dumps(results, indent=2, sort_keys=True) + "\n")
+        self.stdout.write(f"Baseline saved to {options['baseline']}.")
+
+    def report(self, results, baseline, tolerance):
+        regressions = []
+        self.stdout.write(
+            f"{'scenario':<24}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'p99 ms':>10}{'queries':>9}")
+        for scenario, result in results.items():
+            self.stdout.write(
+                f"{scenario:<24}{result['requests']:>9}"
+                + "".join(f"{result[metric]:>10.1f}"
+                          for metric in METRICS[:-1])
+                + f"{result['queries']:>9.1f}")
+            expected = baseline.get(scenario)
+            if not expected:
+                continue
+            for metric in METRICS:
+                change = self.get_change(result[metric], expected[metric])
+                if change > tolerance:
+                    regressions.append(f"{scenario} {metric}")
+                    self.stdout.write(self.style.ERROR(
+                        f"  {metric}: {expected[metric]} -> "
+                        f"{result[metric]} ({change:+.0%})"))
+        if baseline and not regressions:
+            self.stdout.write(self.style.SUCCESS(
+                "No regressions against baseline."))
+        return regressions
+
+    def get_change(self, value, expected):
+        if not expected:
+            return math.inf if value else 0
+        return (value - expected) / expected
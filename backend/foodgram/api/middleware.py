@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .db_routing import RequestRouting, current_routing
+
+current_recorder = ContextVar("current_recorder", default=None)
+
+
+class QueryRecorder:
+    """Execute wrapper counting queries and SQL time of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.repeats = Counter()
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            # Statements are compared before parameters are substituted,
+            # so a query repeated with different values is still caught.
+            self.repeats[sql] += 1
+            self.record_slow(duration, sql)
+
+    def record_slow(self, duration, sql):
+        statement = (duration, sql)
+        if len(self.slowest) < settings.SQL_STATS_SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, statement)
+        else:
+            heapq.heappushpop(self.slowest, statement)
+
+    def get_repeated(self):
+        return {
+            sql: count for sql, count in self.repeats.items()
+            if count >= settings.SQL_STATS_REPEATED_THRESHOLD
+        }
+
+
+class SQLStatistics:
+    """Rolling per-view summary of SQL usage.
+
+    Only the last SQL_STATS_WINDOW requests of every view are kept.
+    Statistics are collected per process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(
+            lambda: deque(maxlen=settings.SQL_STATS_WINDOW))
+
+    def record(self, view_name, recorder, total_duration):
+        entry = (recorder.count, recorder.duration, total_duration,
+                 list(recorder.slowest), recorder.get_repeated())
+        with self.lock:
+            self.requests[view_name].append(entry)
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+
+    def get_summary(self):
+        with self.lock:
+            requests = {view_name: list(entries)
+                        for view_name, entries in self.requests.items()}
+        return {view_name: self.summarize(entries)
+                for view_name, entries in sorted(requests.items())}
+
+    def summarize(self, entries):
+        slowest = heapq.nlargest(
+            settings.SQL_STATS_SLOWEST_STATEMENTS,
+            (statement for entry in entries for statement in entry[3]))
+        repeated = defaultdict(lambda: {"requests": 0, "max_repeats": 0})
+        for entry in entries:
+            for sql, count in entry[4].items():
+                repeated[sql]["requests"] += 1
+                repeated[sql]["max_repeats"] = max(
+                    repeated[sql]["max_repeats"], count)
+        requests = len(entries)
+        return {
+            "requests": requests,
+            "queries_mean": round(
+                sum(entry[0] for entry in entries) / requests, 2),
+            "queries_max": max(entry[0] for entry in entries),
+            "sql_ms_mean": round(
+                sum(entry[1] for entry in entries) / requests * 1000, 3),
+            "total_ms_mean": round(
+                sum(entry[2] for entry in entries) / requests * 1000, 3),
+            "slowest_statements": [
+                {"sql": sql, "ms": round(duration * 1000, 3)}
+                for duration, sql in slowest
+            ],
+            "repeated_statements": [
+                {"sql": sql, **counts}
+                for sql, counts in sorted(
+                    repeated.items(),
+                    key=lambda item: -item[1]["max_repeats"])
+            ],
+        }
+
+
+sql_statistics = SQLStatistics()
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    # Installed once per connection and kept. Under ASGI queries run in
+    # executor threads with their own connections, the recorder of the
+    # request reaches them through the context variable. It goes first,
+    # so 'connection.execute_wrapper()' still pops its own wrapper.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class SQLAccountingMiddleware:
+    """Count queries and SQL time of every request.
+
+    Totals are sent in Server-Timing header and added to the rolling
+    per-view summary. Queries made while a streaming response is
+    consumed are not counted. Works in sync and async request paths.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # the same marker Django's MiddlewareMixin sets
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        for connection in connections.all():
+            install_query_recorder(connection)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            total_duration = time.perf_counter() - started
+        finally:
+            current_recorder.reset(token)
+        return self.process_response(
+            request, response, recorder, total_duration)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            total_duration = time.perf_counter() - started
+        finally:
+            current_recorder.reset(token)
+        return self.process_response(
+            request, response, recorder, total_duration)
+
+    def process_response(self, request, response, recorder, total_duration):
+        match = request.resolver_match
+        view_name = match.view_name if match else "unresolved"
+        sql_statistics.record(view_name, recorder, total_duration)
+        response["Server-Timing"] = (
+            f'sql;dur={recorder.duration * 1000:.3f};'
+            f'desc="{recorder.count} queries", '
+            f"total;dur={total_duration * 1000:.3f}"
+        )
+        return response
+
+
+def reset_routing(**kwargs):
+    current_routing.set(None)
+
+
+# sent when the response is closed, after streamed content is read
+request_finished.connect(reset_routing)
+
+
+class ReplicaRoutingMiddleware:
+    """Give every request its own read routing, see 'api.db_routing'.
+
+    The routing is reset when the response is closed, so content
+    streamed after the middleware is read from the same database.
+    Works in sync and async request paths.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        # under ASGI the coroutine returned is awaited in this context
+        current_routing.set(RequestRouting())
+        return self.get_response(request)
@@ -1,5 +1,165 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPageSizeLimitPaginationClass(PageNumberPagination):
     page_size_query_param = "limit"
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async 'paginate_queryset' for async read views."""
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # count is a cached property, set here it is not queried again
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(
+                page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+        self.page.object_list = [
+            item async for item in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
+
+class RecipeKeysetPaginationClass(CustomPageSizeLimitPaginationClass):
+    """Page number pagination with opt-in keyset (cursor) mode.
+
+    Passing 'cursor' query parameter (empty for the first page) switches
+    to keyset mode ordered by ('-publication_date', '-id'). Keyset pages
+    are fetched with an indexed range condition instead of COUNT(*) and
+    OFFSET, so deep pages cost the same as the first one.
+    '?page=' requests keep page number behaviour. Querysets with their
+    own ordering, such as search results, are rejected in keyset mode.
+    """
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor."
+    # the largest BigAutoField value
+    max_pk = 2 ** 63 - 1
+    ordered_queryset_message = (
+        "Cursor pages follow publication date, they can't be combined "
+        "with other ordering such as search.")
+    keyset_mode = False
+    keyset_only = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (not self.keyset_only
+                and self.cursor_query_param not in request.query_params):
+            return super().paginate_queryset(queryset, request, view)
+        queryset, page_size = self.get_keyset_queryset(queryset, request)
+        return self.get_keyset_page(list(queryset), page_size)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        if (not self.keyset_only
+                and self.cursor_query_param not in request.query_params):
+            return await super().apaginate_queryset(queryset, request, view)
+        queryset, page_size = self.get_keyset_queryset(queryset, request)
+        return self.get_keyset_page(
+            [item async for item in queryset], page_size)
+
+    def get_keyset_queryset(self, queryset, request):
+        """Return queryset of the page and one more row, and page size."""
+        if queryset.query.order_by:
+            raise ValidationError(
+                {self.cursor_query_param: self.ordered_queryset_message})
+        self.keyset_mode = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        if self.reverse:
+            queryset = queryset.order_by("publication_date", "id")
+        else:
+            queryset = queryset.order_by("-publication_date", "-id")
+
+        if self.position is not None:
+            publication_date, pk = self.position
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(publication_date__gt=publication_date)
+                    | Q(publication_date=publication_date, pk__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(publication_date__lt=publication_date)
+                    | Q(publication_date=publication_date, pk__lt=pk)
+                )
+        return queryset[:page_size + 1], page_size  # type:ignore
+
+    def get_keyset_page(self, results, page_size):
+        position, reverse = self.position, self.reverse
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = results[-1]
+            if (has_more and reverse
+                    or position is not None and not reverse):
+                self.previous_position = results[0]
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset_mode:
+            return super().get_paginated_response(data)
+        return Response({
+            "next": self.get_cursor_link(self.next_position, False),
+            "previous": self.get_cursor_link(self.previous_position, True),
+            "results": data,
+        })
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            decoded = urlsafe_b64decode(encoded.encode("ascii"))
+            reverse, publication_date, pk = decoded.decode("ascii").split("|")
+            if reverse not in ("0", "1"):
+                raise ValueError(reverse)
+            pk = int(pk)
+            if not 0 < pk <= self.max_pk:
+                raise ValueError(pk)
+            position = (datetime.fromisoformat(publication_date), pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse == "1"
+
+    def encode_cursor(self, recipe, reverse):
+        cursor = "|".join((
+            str(int(reverse)),
+            recipe.publication_date.isoformat(),
+            str(recipe.pk),
+        ))
+        return urlsafe_b64encode(cursor.encode("ascii")).decode("ascii")
+
+    def get_cursor_link(self, recipe, reverse):
+        if recipe is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(recipe, reverse)
+        )
+
+
+class RecipeFeedPaginationClass(RecipeKeysetPaginationClass):
+    """Keyset pagination only, first page is served without 'cursor'."""
+    keyset_only = True
@@ -0,0 +1,166 @@
+from collections import defaultdict
+from operator import attrgetter
+
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.fields.files import ImageFieldFile
+
+from .fields import RecipeImageVariantField
+from .serializers import RecipeReadSerializer
+
+from recipes.models import Recipe, RecipeIngredient  # isort:skip
+
+User = get_user_model()
+
+RECIPE_ROW_COLUMNS = {
+    "author": ("author_id",),
+    "name": ("name",),
+    "image": ("image", "image_variants"),
+    "text": ("text",),
+    "cooking_time": ("cooking_time",),
+}
+
+
+class RecipeRowsBuilder:
+    """Build recipe representations from values() rows.
+
+    Output equals RecipeReadSerializer output for the same context,
+    including 'recipe_fields' and 'recipe_expand' sparse fieldsets.
+    Recipes, tags, authors and ingredients are fetched as tuples, one
+    query each, and put into plain dicts without instantiating models
+    or serializer fields per row. 'abuild' fetches them with the async
+    ORM interface.
+    """
+
+    def __init__(self, context):
+        self.fields = [name for name in RecipeReadSerializer.Meta.fields
+                       if name in context["recipe_fields"]]
+        self.expand = context["recipe_expand"]
+        self.interactions = context["interactions"]
+        self.image_field = RecipeImageVariantField()
+        self.image_field.bind("image", RecipeReadSerializer(context=context))
+        self.model_image_field = Recipe._meta.get_field("image")
+
+    def get_rows(self, queryset):
+        columns = ["pk", "publication_date"]
+        for name in self.fields:
+            columns.extend(RECIPE_ROW_COLUMNS.get(name, ()))
+        return queryset.values_list(*columns, named=True)
+
+    def build(self, rows):
+        rows = list(rows)
+        related = {name: list(queryset) for name, queryset
+                   in self.get_related_querysets(rows).items()}
+        return self.assemble(rows, related)
+
+    async def abuild(self, rows):
+        """Async 'build', rows may be a queryset or fetched rows."""
+        rows = [row async for row in rows] if isinstance(
+            rows, QuerySet) else list(rows)
+        related = {}
+        for name, queryset in self.get_related_querysets(rows).items():
+            related[name] = [item async for item in queryset]
+        return self.assemble(rows, related)
+
+    def get_related_querysets(self, rows):
+        recipe_ids = [row.pk for row in rows]
+        querysets = {}
+        if "tags" in self.fields:
+            querysets["tags"] = self.get_tags_queryset(recipe_ids)
+        if "ingredients" in self.fields:
+            querysets["ingredients"] = self.get_ingredients_queryset(
+                recipe_ids)
+        if "author" in self.fields and "author" in self.expand:
+            querysets["author"] = self.get_authors_queryset(
+                {row.author_id for row in rows})
+        return querysets
+
+    def assemble(self, rows, related):
+        getters = {
+            "id": attrgetter("pk"),
+            "is_favorited": lambda row: (
+                row.pk in self.interactions.favorite_recipes),
+            "is_in_shopping_cart": lambda row: (
+                row.pk in self.interactions.shopping_cart),
+            "name": attrgetter("name"),
+            "image": self.get_image,
+            "text": attrgetter("text"),
+            "cooking_time": attrgetter("cooking_time"),
+            "author": attrgetter("author_id"),
+        }
+        if "tags" in related:
+            tags = self.get_tags(related["tags"])
+            getters["tags"] = lambda row: tags.get(row.pk, [])
+        if "ingredients" in related:
+            ingredients = self.get_ingredients(related["ingredients"])
+            getters["ingredients"] = lambda row: ingredients.get(row.pk, [])
+        if "author" in related:
+            authors = self.get_authors(related["author"])
+            getters["author"] = lambda row: authors[row.author_id]
+
+        field_getters = [(name, getters[name]) for name in self.fields]
+        return [{name: getter(row) for name, getter in field_getters}
+                for row in rows]
+
+    def get_image(self, row):
+        return self.image_field.to_representation(
+            ImageFieldFile(row, self.model_image_field, row.image))
+
+    def get_tags_queryset(self, recipe_ids):
+        rows = Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids).order_by("tag_id")
+        if "tags" not in self.expand:
+            return rows.values_list("recipe_id", "tag_id")
+        return rows.values_list(
+            "recipe_id", "tag_id", "tag__name", "tag__color", "tag__slug")
+
+    def get_tags(self, rows):
+        recipe_tags = defaultdict(list)
+        if "tags" not in self.expand:
+            for recipe_id, tag_id in rows:
+                recipe_tags[recipe_id].append(tag_id)
+            return recipe_tags
+
+        tags = {}
+        for recipe_id, tag_id, name, color, slug in rows:
+            if tag_id not in tags:
+                tags[tag_id] = {
+                    "id": tag_id, "name": name, "color": color, "slug": slug}
+            recipe_tags[recipe_id].append(tags[tag_id])
+        return recipe_tags
+
+    def get_authors_queryset(self, author_ids):
+        return User.objects.filter(pk__in=author_ids).values_list(
+            "pk", "email", "username", "first_name", "last_name")
+
+    def get_authors(self, rows):
+        users_followed = self.interactions.users_followed
+        return {
+            pk: {
+                "email": email,
+                "id": pk,
+                "username": username,
+                "first_name": first_name,
+                "last_name": last_name,
+                "is_subscribed": pk in users_followed,
+            }
+            for pk, email, username, first_name, last_name in rows
+        }
+
+    def get_ingredients_queryset(self, recipe_ids):
+        return RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by("pk").values_list(
+            "recipe_id", "ingredient_id", "ingredient__name",
+            "ingredient__measurement_unit__name", "amount")
+
+    def get_ingredients(self, rows):
+        recipe_ingredients = defaultdict(list)
+        for recipe_id, ingredient_id, name, unit, amount in rows:
+            recipe_ingredients[recipe_id].append({
+                "id": ingredient_id,
+                "name": name,
+                "measurement_unit": unit,
+                "amount": amount,
+            })
+        return recipe_ingredients
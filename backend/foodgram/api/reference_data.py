@@ -0,0 +1,111 @@
+import gzip
+import threading
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from .caching import aget_catalogue_version, get_catalogue_version
+from .db_routing import read_from_primary
+from .serializers import IngredientSerializer, TagSerializer
+
+from recipes.models import Ingredient, Tag  # isort:skip
+
+
+class RenderedContent(NamedTuple):
+    version: int
+    content: bytes
+    gzipped_content: bytes
+
+
+class PrerenderedReferenceData:
+    """Reference data list kept in memory as rendered JSON bytes.
+
+    Plain and gzipped bytes are regenerated when catalogue version
+    changes. Responses carry ETag and Last-Modified derived from the
+    version, so conditional requests get '304 Not Modified' without
+    touching the database or serializers.
+    """
+
+    def __init__(self, name, get_data):
+        self.name = name
+        self.get_data = get_data
+        self._lock = threading.Lock()
+        self._rendered = None
+
+    def get_rendered(self, version):
+        if self._rendered is None or self._rendered.version != version:
+            with self._lock:
+                if (self._rendered is None
+                        or self._rendered.version != version):
+                    self._rendered = self.render(version)
+        return self._rendered
+
+    def render(self, version):
+        # kept until the next version, a lagging replica won't do
+        with read_from_primary():
+            content = JSONRenderer().render(self.get_data())
+        return RenderedContent(version, content, gzip.compress(content))
+
+    def get_response(self, request):
+        version = get_catalogue_version()
+        response = self.get_conditional_response(request, version)
+        if response.status_code == 200:
+            self.set_content(response, self.get_rendered(version))
+        return response
+
+    async def aget_response(self, request):
+        """Async 'get_response', rendering runs in a thread if stale."""
+        version = await aget_catalogue_version()
+        response = self.get_conditional_response(request, version)
+        if response.status_code == 200:
+            rendered = self._rendered
+            if rendered is None or rendered.version != version:
+                rendered = await sync_to_async(self.get_rendered)(version)
+            self.set_content(response, rendered)
+        return response
+
+    def get_conditional_response(self, request, version):
+        """Return response without content or '304 Not Modified'."""
+        last_modified = version // 10 ** 9
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        use_gzip = bool(re_accepts_gzip.search(accept_encoding))
+        encoding = "gzip" if use_gzip else "identity"
+        etag = f'"{self.name}-{version}-{encoding}"'
+
+        response = HttpResponse(content_type="application/json")
+        response.headers["ETag"] = etag
+        response.headers["Last-Modified"] = http_date(last_modified)
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return get_conditional_response(
+            request, etag=etag, last_modified=last_modified, response=response)
+
+    def set_content(self, response, rendered):
+        if response.has_header("Content-Encoding"):
+            response.content = rendered.gzipped_content
+        else:
+            response.content = rendered.content
+
+
+def get_tags_data():
+    return TagSerializer(Tag.objects.all(), many=True).data
+
+
+def get_ingredients_data():
+    return IngredientSerializer(
+        Ingredient.objects.select_related("measurement_unit").all(),
+        many=True
+    ).data
+
+
+prerendered_tags = PrerenderedReferenceData("tags", get_tags_data)
+prerendered_ingredients = PrerenderedReferenceData(
+    "ingredients", get_ingredients_data)
@@ -0,0 +1,130 @@
+import threading
+from bisect import bisect_left
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+
+from .caching import aget_catalogue_version, get_catalogue_version
+from .db_routing import read_from_primary
+
+from recipes.models import Ingredient  # isort:skip
+
+NGRAM_SIZE = 3
+
+
+class IndexState(NamedTuple):
+    version: int
+    entries: list
+    names: list
+    prefixes: list
+    ngrams: dict
+
+
+def get_ngrams(value):
+    return {value[i:i + NGRAM_SIZE]
+            for i in range(len(value) - NGRAM_SIZE + 1)}
+
+
+class IngredientSearchIndex:
+    """In-process index for ingredient name autocomplete.
+
+    Ingredients are kept as serialized dicts sorted by name. Prefix
+    matches are found with binary search over sorted lowercased names,
+    substring matches with trigram posting sets. The index is built on
+    first use and rebuilt when catalogue version changes, so searching
+    makes no database queries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def get_state(self):
+        version = get_catalogue_version()
+        if self._state is None or self._state.version != version:
+            with self._lock:
+                if self._state is None or self._state.version != version:
+                    self._state = self.build(version)
+        return self._state
+
+    def build(self, version):
+        # kept until the next version, a lagging replica won't do
+        with read_from_primary():
+            ingredients = list(
+                Ingredient.objects.order_by("name", "pk").values_list(
+                    "pk", "name", "measurement_unit__name"))
+        entries = []
+        names = []
+        ngrams = {}
+        for position, (pk, name, unit_name) in enumerate(ingredients):
+            entries.append(
+                {"id": pk, "name": name, "measurement_unit": unit_name})
+            name = name.casefold()
+            names.append(name)
+            for ngram in get_ngrams(name):
+                ngrams.setdefault(ngram, set()).add(position)
+        prefixes = sorted(
+            (name, position) for position, name in enumerate(names))
+        return IndexState(version, entries, names, prefixes, ngrams)
+
+    def search(self, terms, limit=None):
+        """Return ingredients matching all terms.
+
+        Names starting with the terms go first, then names containing
+        them, both groups in alphabetical order.
+        """
+        return self.find(self.get_state(), terms, limit)
+
+    async def asearch(self, terms, limit=None):
+        """Async 'search', the index is rebuilt in a thread if stale."""
+        version = await aget_catalogue_version()
+        state = self._state
+        if state is None or state.version != version:
+            state = await sync_to_async(self.get_state)()
+        return self.find(state, terms, limit)
+
+    def find(self, state, terms, limit):
+        terms = [term.casefold() for term in terms]
+
+        prefix_matches = self.find_prefix_matches(state, terms)
+        if limit is None or len(prefix_matches) < limit:
+            substring_matches = sorted(
+                self.find_substring_matches(state, terms) - prefix_matches)
+        else:
+            substring_matches = []
+
+        positions = sorted(prefix_matches) + substring_matches
+        if limit is not None:
+            positions = positions[:limit]
+        return [state.entries[position] for position in positions]
+
+    def find_prefix_matches(self, state, terms):
+        if not terms:
+            return set(range(len(state.entries)))
+
+        first_term, *other_terms = terms
+        matches = set()
+        start = bisect_left(state.prefixes, (first_term,))
+        for name, position in state.prefixes[start:]:
+            if not name.startswith(first_term):
+                break
+            if all(name.startswith(term) for term in other_terms):
+                matches.add(position)
+        return matches
+
+    def find_substring_matches(self, state, terms):
+        candidates = None
+        for term in terms:
+            if len(term) < NGRAM_SIZE:
+                continue
+            for ngram in get_ngrams(term):
+                postings = state.ngrams.get(ngram, set())
+                candidates = (postings if candidates is None
+                              else candidates & postings)
+        if candidates is None:
+            candidates = range(len(state.entries))
+        return {position for position in candidates
+                if all(term in state.names[position] for term in terms)}
+
+
+ingredient_search_index = IngredientSearchIndex()
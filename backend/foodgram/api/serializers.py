@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import \
     validate_password as validate_user_password  # noqa
@@ -6,9 +7,13 @@ from django.core.validators import MinValueValidator
 from django.db import transaction
 from rest_framework import serializers
 
-from .fields import Base64EncodedImageField  # isort:skip
-from .utils import (add_ingredients_to_recipe,  # isort:skip
-                    get_annotated_recipe_instance)  # isort:skip
+from .fields import (Base64EncodedImageField,  # isort:skip
+                     RecipeImageVariantField)  # isort:skip
+from .utils import (get_annotated_recipe_instance,  # isort:skip
+                    set_prefetched_objects, set_recipe_ingredients,
+                    set_recipe_tags)
+from recipes.images import (get_image_variant_url,  # isort:skip
+                            queue_image_deletion)
 from recipes.models import (Ingredient, Tag, Recipe,  # isort:skip
                             RecipeIngredient)  # isort:skip
 
@@ -37,6 +42,9 @@ class UserListRetrieveSerializer(UserCustomBaseSerializer):
         )  # type:ignore
 
     def get_is_subscribed(self, obj):
+        interactions = self.context.get("interactions")
+        if interactions is not None:
+            return obj.pk in interactions.users_followed
         return obj.is_subscribed
 
 
@@ -147,7 +155,8 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientWriteSerializer(serializers.Serializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    # resolved to ingredients in bulk by RecipeWriteSerializer
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(validators=[MinValueValidator(1), ])
 
 
@@ -158,6 +167,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         source="recipe_ingredients", many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image = RecipeImageVariantField()
 
     class Meta:
         model = Recipe
@@ -174,19 +184,44 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             "cooking_time",
         )
 
+    def get_fields(self):
+        """Apply sparse fieldset from serializer context.
+
+        'recipe_fields' limits fields to the given names. Relations not
+        listed in 'recipe_expand' are represented by primary keys.
+        """
+        fields = super().get_fields()
+        requested_fields = self.context.get("recipe_fields")
+        if requested_fields is not None:
+            fields = {name: field for name, field in fields.items()
+                      if name in requested_fields}
+        expand = self.context.get("recipe_expand")
+        if expand is not None:
+            if "author" in fields and "author" not in expand:
+                fields["author"] = serializers.PrimaryKeyRelatedField(
+                    read_only=True)
+            if "tags" in fields and "tags" not in expand:
+                fields["tags"] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=True)
+        return fields
+
     def get_is_favorited(self, obj):
+        interactions = self.context.get("interactions")
+        if interactions is not None:
+            return obj.pk in interactions.favorite_recipes
         return obj.is_favorited
 
     def get_is_in_shopping_cart(self, obj):
+        interactions = self.context.get("interactions")
+        if interactions is not None:
+            return obj.pk in interactions.shopping_cart
         return obj.is_in_shopping_cart
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     author = serializers.HiddenField(default=serializers.CurrentUserDefault())
     ingredients = RecipeIngredientWriteSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     image = Base64EncodedImageField()
 
     class Meta:
@@ -206,38 +241,68 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             instance, self.context.get("request"))
         return RecipeReadSerializer().to_representation(instance)
 
+    def get_objects_in_bulk(self, queryset, ids):
+        objects = queryset.in_bulk(ids)
+        for pk in ids:
+            if pk not in objects:
+                raise ValidationError(
+                    f'Invalid pk "{pk}" - object does not exist.')
+        return objects
+
+    def validate_tags(self, data):
+        tags = self.get_objects_in_bulk(Tag.objects.all(), data)
+        return [tags[pk] for pk in dict.fromkeys(data)]
+
     def validate_ingredients(self, data):
         ingredient_id_set = set()
         for ingredient in data:
             if ingredient["id"] in ingredient_id_set:
                 raise ValidationError("Duplicated ingredient supplied!")
             ingredient_id_set.add(ingredient["id"])
-        return data
+        ingredients = self.get_objects_in_bulk(
+            Ingredient.objects.select_related("measurement_unit"),
+            list(ingredient_id_set))
+        return [{**ingredient, "id": ingredients[ingredient["id"]]}
+                for ingredient in data]
 
     def create(self, validated_data):
         ingredient_data = validated_data.pop("ingredients")
-        tag_ids = validated_data.pop("tags")
+        tags = validated_data.pop("tags")
 
         with transaction.atomic():
             recipe = Recipe.objects.create(**validated_data)
-            recipe.tags.set(tag_ids)
-            add_ingredients_to_recipe(recipe, ingredient_data)
+            set_prefetched_objects(recipe, "tags", ())
+            set_prefetched_objects(recipe, "recipe_ingredients", ())
+            set_recipe_tags(recipe, tags)
+            set_recipe_ingredients(recipe, ingredient_data)
         return get_annotated_recipe_instance(
             recipe, self.context.get("request"))
 
     def update(self, instance, validated_data):
-        tag_ids = validated_data.pop("tags")
+        tags = validated_data.pop("tags")
         ingredient_data = validated_data.pop("ingredients")
 
+        old_image_name = instance.image.name
+
         with transaction.atomic():
             instance = super().update(instance, validated_data)
-            instance.tags.set(tag_ids, clear=True)
-            instance.recipe_ingredients.all().delete()
-            add_ingredients_to_recipe(instance, ingredient_data)
+            if instance.image.name != old_image_name:
+                queue_image_deletion(old_image_name)
+            set_recipe_tags(instance, tags)
+            set_recipe_ingredients(instance, ingredient_data)
         return get_annotated_recipe_instance(
             instance, self.context.get("request"))
 
 
+class RecipeBatchSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=("add", "remove"))
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_MAX_SIZE,
+    )
+
+
 class FavoriteRecipeSerializer(RecipeReadSerializer):
     image = serializers.SerializerMethodField()
 
@@ -250,12 +315,12 @@ class FavoriteRecipeSerializer(RecipeReadSerializer):
         )
 
     def get_image(self, obj):
-        return obj.image.url
+        return get_image_variant_url(
+            obj.image, "thumbnail", obj.image_variants)
 
 
 class SubscriptionSerializer(UserListRetrieveSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta(UserListRetrieveSerializer.Meta):
         fields = (
@@ -265,12 +330,5 @@ class SubscriptionSerializer(UserListRetrieveSerializer):
         )  # type:ignore
 
     def get_recipes(self, obj):
-        max_recipes = self.context.get("recipes_limit")
-        if max_recipes:
-            return FavoriteRecipeSerializer(
-                obj.recipes.all()[:max_recipes], many=True
-            ).data
-        return FavoriteRecipeSerializer(obj.recipes.all(), many=True).data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        recipes = self.context["author_recipes"].get(obj.pk, [])
+        return FavoriteRecipeSerializer(recipes, many=True).data
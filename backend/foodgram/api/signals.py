@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .caching import bump_catalogue_version, bump_recipe_content_version
+
+from recipes.images import image_variants_generated  # isort:skip
+from recipes.models import (Ingredient, MeasurementUnit,  # isort:skip
+                            Recipe, RecipeIngredient, Tag)
+
+User = get_user_model()
+
+USER_PUBLIC_FIELDS = {"email", "username", "first_name", "last_name"}
+# changes of these fields drop cached tokens of the user: deactivation
+# revokes them, the password is checked against request.user
+USER_CREDENTIAL_FIELDS = ("is_active", "password")
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=MeasurementUnit)
+@receiver(post_delete, sender=MeasurementUnit)
+def catalogue_changed(sender, **kwargs):
+    transaction.on_commit(bump_catalogue_version)
+    transaction.on_commit(bump_recipe_content_version)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_delete, sender=User)
+@receiver(image_variants_generated)
+def recipe_content_changed(sender, **kwargs):
+    transaction.on_commit(bump_recipe_content_version)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(bump_recipe_content_version)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, created, update_fields, **kwargs):
+    if created:
+        return
+    if update_fields and not USER_PUBLIC_FIELDS.intersection(update_fields):
+        return
+    transaction.on_commit(bump_recipe_content_version)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+def get_user_credentials(instance):
+    # deferred fields are absent from __dict__
+    return tuple(instance.__dict__.get(field)
+                 for field in USER_CREDENTIAL_FIELDS)
+
+
+@receiver(post_init, sender=User)
+def remember_user_credentials(sender, instance, **kwargs):
+    instance._loaded_credentials = get_user_credentials(instance)
+
+
+@receiver(post_save, sender=User)
+def user_credentials_changed(sender, instance, created, update_fields,
+                             **kwargs):
+    # saves of last_login and other fields leave tokens alone
+    if created or update_fields is not None and not set(
+            USER_CREDENTIAL_FIELDS).intersection(update_fields):
+        return
+    credentials = get_user_credentials(instance)
+    if credentials == instance._loaded_credentials:
+        return
+    instance._loaded_credentials = credentials
+    # entries are dropped now and after commit, when concurrent
+    # requests could have cached the old row again
+    token_cache.delete_user(instance.pk)
+    transaction.on_commit(lambda: token_cache.delete_user(instance.pk))
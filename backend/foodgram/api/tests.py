@@ -1,8 +1,50 @@
+import base64
+import functools
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from PIL import Image
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
 
+from .async_views import ASYNC_READ_HANDLERS, async_read_view
+from .authentication import token_cache
+from .checks import (NON_STORING_CACHES, PROCESS_LOCAL_CACHES,
+                     check_replica_pin_cache, check_shared_cache)
+from .db_routing import (ReplicaRouter, RequestRouting, current_routing,
+                         is_pinned_to_primary, pin_to_primary,
+                         read_from_primary)
+from .filters import get_postgresql_search_query, search_recipes
+from .management.commands.explain_queries import (ENDPOINTS, SMALL_TABLES,
+                                                  find_plan_issues)
+from .middleware import QueryRecorder, sql_statistics
+
+from foodgram.asgi import StreamingASGIHandler  # isort:skip
+from recipes.counters import change_counters  # isort:skip
+from recipes.images import (generate_image_variants,  # isort:skip
+                            get_variant_name)
+from recipes.models import (Ingredient, MeasurementUnit,  # isort:skip
+                            Recipe, RecipeIngredient, ShoppingListItem, Tag)
+from recipes.shopping_list import get_shopping_list_totals  # isort:skip
+
 User = get_user_model()
 
 
@@ -156,3 +198,1669 @@ class TestUserAPI(APITestCase):
         self.assertEqual(
             auth_response.status_code,  # type:ignore
             status.HTTP_204_NO_CONTENT)
+
+
+class TestRecipeAPI(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(  # type:ignore
+            username="cook",
+            email="cook@example.com",
+            first_name="cook",
+            last_name="cook",
+            password="qwerty1990",
+        )
+        cls.author = User.objects.create_user(  # type:ignore
+            username="author",
+            email="author@example.com",
+            first_name="author",
+            last_name="author",
+            password="qwerty1990",
+        )
+        token_obj, _ = Token.objects.get_or_create(user=cls.user)
+        cls.token = token_obj.key
+        cls.tag = Tag.objects.create(
+            name="breakfast", color="#E26C2D", slug="breakfast")
+        cls.unit = MeasurementUnit.objects.create(name="g")
+        cls.ingredient = Ingredient.objects.create(
+            name="flour", measurement_unit=cls.unit)
+        cls.recipe = cls.create_recipe(cls.author, "pancakes")
+
+    @classmethod
+    def create_recipe(cls, author, name, tags=None):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=name,
+            image="recipe_images/test.png",
+            text=f"{name} description",
+            cooking_time=10,
+        )
+        recipe.tags.set(tags or (cls.tag,))
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=cls.ingredient, amount=100)
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        headers = {"HTTP_AUTHORIZATION": f"Token {TestRecipeAPI.token}"}
+        self.guest_user = APIClient()
+        self.auth_user = APIClient()
+        self.auth_user.credentials(**headers)
+
+    def testRecipeList(self):
+        for client in (self.guest_user, self.auth_user):
+            with self.subTest(client=client):
+                response = client.get("/api/recipes/")
+                self.assertEqual(response.status_code,  # type:ignore
+                                 status.HTTP_200_OK)
+                recipe_data = response.json()["results"][0]  # type:ignore
+                self.assertFalse(recipe_data["is_favorited"])
+                self.assertFalse(recipe_data["is_in_shopping_cart"])
+                self.assertFalse(recipe_data["author"]["is_subscribed"])
+
+    def testInteractionFlagsFollowChanges(self):
+        recipe_url = f"/api/recipes/{self.recipe.pk}/"
+        self.auth_user.get(recipe_url)
+
+        self.auth_user.post(f"{recipe_url}favorite/")
+        self.auth_user.post(f"{recipe_url}shopping_cart/")
+        self.auth_user.post(f"/api/users/{self.author.pk}/subscribe/")
+        recipe_data = self.auth_user.get(recipe_url).json()  # type:ignore
+        self.assertTrue(recipe_data["is_favorited"])
+        self.assertTrue(recipe_data["is_in_shopping_cart"])
+        self.assertTrue(recipe_data["author"]["is_subscribed"])
+
+        self.auth_user.delete(f"{recipe_url}favorite/")
+        self.auth_user.delete(f"{recipe_url}shopping_cart/")
+        self.auth_user.delete(f"/api/users/{self.author.pk}/subscribe/")
+        recipe_data = self.auth_user.get(recipe_url).json()  # type:ignore
+        self.assertFalse(recipe_data["is_favorited"])
+        self.assertFalse(recipe_data["is_in_shopping_cart"])
+        self.assertFalse(recipe_data["author"]["is_subscribed"])
+
+    def testRecipeListInteractionFilters(self):
+        another_recipe = self.create_recipe(self.author, "waffles")
+        self.auth_user.post(f"/api/recipes/{another_recipe.pk}/favorite/")
+        expected_results = {
+            "is_favorited": [another_recipe.pk],
+            "is_in_shopping_cart": [],
+        }
+        for param, expected in expected_results.items():
+            with self.subTest(param=param):
+                response = self.auth_user.get(f"/api/recipes/?{param}=1")
+                self.assertEqual(
+                    [recipe["id"]
+                     for recipe in response.json()["results"]],  # type:ignore
+                    expected)
+
+    def testRecipeListKeysetPagination(self):
+        recipes = [self.create_recipe(self.author, f"recipe {index}")
+                   for index in range(4)]
+        expected = [recipe.pk for recipe in reversed(recipes)]
+        expected.append(self.recipe.pk)
+
+        response = self.guest_user.get("/api/recipes/?cursor=&limit=2")
+        self.assertNotIn("count", response.json())  # type:ignore
+        self.assertIsNone(response.json()["previous"])  # type:ignore
+        received = []
+        while True:
+            page = response.json()  # type:ignore
+            received.extend(recipe["id"] for recipe in page["results"])
+            if page["next"] is None:
+                break
+            response = self.guest_user.get(page["next"])
+        self.assertEqual(received, expected)
+
+        previous_page = self.guest_user.get(page["previous"]).json()
+        self.assertEqual(
+            [recipe["id"] for recipe in previous_page["results"]],
+            expected[2:4])
+
+        cursors = ["broken", "MXx4", "eHwyMDIzLTAxLTAxfDE="]
+        # base64 of "1|x" and "x|2023-01-01|1" above, pks out of range
+        cursors.extend(
+            base64.urlsafe_b64encode(f"0|2023-01-01|{pk}".encode()).decode()
+            for pk in (0, -1, 2 ** 63, 2 ** 64))
+        for cursor in cursors:
+            response = self.guest_user.get(f"/api/recipes/?cursor={cursor}")
+            self.assertEqual(response.status_code,  # type:ignore
+                             status.HTTP_404_NOT_FOUND)
+        response = self.guest_user.get("/api/recipes/?page=2&limit=2")
+        self.assertEqual(response.json()["count"], 5)  # type:ignore
+
+    def testBatchFavoritesAndShoppingCart(self):
+        recipes = [self.create_recipe(self.author, f"batch recipe {index}")
+                   for index in range(20)]
+        self.user.favorite_recipes.add(recipes[0])
+        for url, relation_name, flag in (
+            ("/api/recipes/favorite/batch/", "favorite_recipes",
+             "is_favorited"),
+            ("/api/recipes/shopping_cart/batch/", "shopping_cart",
+             "is_in_shopping_cart"),
+        ):
+            with self.subTest(url=url):
+                # authenticated token is cached by the first request
+                self.auth_user.get("/api/users/me/")
+                query_counts = []
+                for batch in (recipes[:2], recipes):
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.auth_user.post(url, {
+                            "action": "add",
+                            "recipes": [0, *(recipe.pk for recipe in batch)],
+                        }, format="json")
+                    query_counts.append(len(queries))
+                self.assertEqual(response.status_code,  # type:ignore
+                                 status.HTTP_200_OK)
+                results = response.json()["results"]  # type:ignore
+                self.assertEqual(results[0],
+                                 {"id": 0, "status": "not_found"})
+                self.assertEqual(
+                    [result["status"] for result in results[1:]],
+                    ["unchanged"] * 2 + ["added"] * 18)
+                self.assertEqual(
+                    getattr(self.user, relation_name).count(), 20)
+
+                recipe_data = self.auth_user.get(
+                    f"/api/recipes/{recipes[5].pk}/").json()  # type:ignore
+                self.assertTrue(recipe_data[flag])
+
+                response = self.auth_user.post(url, {
+                    "action": "remove",
+                    "recipes": [recipe.pk for recipe in recipes[:10]],
+                }, format="json")
+                self.assertEqual(
+                    {result["status"]
+                     for result in response.json()["results"]},  # type:ignore
+                    {"removed"})
+                self.assertEqual(
+                    getattr(self.user, relation_name).count(), 10)
+                self.assertEqual(query_counts[0], query_counts[1])
+
+        recipes[15].refresh_from_db()
+        self.assertEqual(recipes[15].favorites_count, 1)
+        self.assertEqual(recipes[15].in_carts_count, 1)
+
+        response = self.auth_user.post("/api/recipes/favorite/batch/", {
+            "action": "toggle", "recipes": []}, format="json")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.json()),  # type:ignore
+                         {"action", "recipes"})
+
+    def testRecipeSparseFieldsets(self):
+        with CaptureQueriesContext(connection) as full_queries:
+            full_data = self.auth_user.get(
+                "/api/recipes/").json()["results"][0]  # type:ignore
+        with CaptureQueriesContext(connection) as card_queries:
+            response = self.auth_user.get(
+                "/api/recipes/?fields=id,name,image,cooking_time")
+        card_data = response.json()["results"][0]  # type:ignore
+        self.assertEqual(set(card_data),
+                         {"id", "name", "image", "cooking_time"})
+        self.assertEqual(card_data["image"], full_data["image"])
+        self.assertLess(len(card_queries), len(full_queries))
+        recipe_query = next(query["sql"] for query in card_queries
+                            if 'FROM "recipes_recipe"' in query["sql"]
+                            and "LIMIT" in query["sql"])
+        self.assertNotIn('"recipes_recipe"."text"', recipe_query)
+
+        recipe_url = f"/api/recipes/{self.recipe.pk}/"
+        recipe_data = self.guest_user.get(
+            f"{recipe_url}?fields=author,tags,is_favorited").json()
+        self.assertEqual(recipe_data, {"author": self.author.pk,
+                                       "tags": [self.tag.pk],
+                                       "is_favorited": False})
+        recipe_data = self.guest_user.get(
+            f"{recipe_url}?fields=author,tags&expand=author").json()
+        self.assertEqual(recipe_data["author"]["username"], "author")
+        self.assertEqual(recipe_data["tags"], [self.tag.pk])
+        recipe_data = self.guest_user.get(
+            f"{recipe_url}?fields=ingredients").json()
+        self.assertEqual(recipe_data["ingredients"][0]["measurement_unit"],
+                         "g")
+        self.assertEqual(self.guest_user.get(recipe_url).json(),
+                         self.guest_user.get(
+                             f"{recipe_url}?expand=author,tags").json())
+
+        response = self.guest_user.get(f"{recipe_url}?fields=id,password")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertIn("password", response.json()["fields"])  # type:ignore
+
+    def testRecipeFeed(self):
+        response = self.guest_user.get("/api/recipes/feed/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_401_UNAUTHORIZED)
+
+        authors = [self.author] + [
+            User.objects.create_user(  # type:ignore
+                username=f"feed-author-{index}",
+                email=f"feed-author-{index}@example.com",
+                password="qwerty1990",
+            )
+            for index in range(3)
+        ]
+        recipes = [self.recipe] + [
+            self.create_recipe(author, f"{author.username} recipe")
+            for author in authors for _ in range(2)
+        ]
+        self.create_recipe(self.user, "own recipe")
+
+        def get_feed_queries():
+            # interactions of the user are cached by the first request
+            self.auth_user.get("/api/recipes/feed/?limit=4")
+            with CaptureQueriesContext(connection) as queries:
+                response = self.auth_user.get("/api/recipes/feed/?limit=4")
+            self.assertEqual(response.status_code,  # type:ignore
+                             status.HTTP_200_OK)
+            return len(queries)
+
+        def follow(authors):
+            for author in authors:
+                self.auth_user.post(f"/api/users/{author.pk}/subscribe/")
+
+        follow(authors[:1])
+        one_author_queries = get_feed_queries()
+        follow(authors[1:])
+        self.assertEqual(get_feed_queries(), one_author_queries)
+
+        expected_ids = [recipe.pk for recipe in reversed(recipes)]
+        feed_ids = []
+        url = "/api/recipes/feed/?limit=4&fields=id,author"
+        while url:
+            data = self.auth_user.get(url).json()  # type:ignore
+            self.assertNotIn("count", data)
+            feed_ids.extend(recipe["id"] for recipe in data["results"])
+            url = data["next"]
+        self.assertEqual(feed_ids, expected_ids)
+
+        data = self.auth_user.get(
+            "/api/recipes/feed/?tags=breakfast&limit=1").json()  # type:ignore
+        self.assertEqual(data["results"][0]["id"], expected_ids[0])
+        self.assertTrue(data["results"][0]["author"]["is_subscribed"])
+
+    def testRecipeSearch(self):
+        soup = self.create_recipe(self.author, "Tomato soup")
+        soup.text = "Hot soup with basil"
+        soup.save()
+        salad = self.create_recipe(self.user, "Summer salad")
+        salad.text = "Fresh tomato and basil"
+        salad.save()
+        self.user.favorite_recipes.add(salad)
+
+        def search(query):
+            response = self.auth_user.get(f"/api/recipes/?{query}")
+            self.assertEqual(response.status_code,  # type:ignore
+                             status.HTTP_200_OK)
+            return [recipe["id"] for recipe in  # type:ignore
+                    response.json()["results"]]  # type:ignore
+
+        self.assertEqual(search("search=tomato"), [soup.pk, salad.pk])
+        self.assertEqual(search("search=basil soup"), [soup.pk])
+        self.assertEqual(search("search=tom"), [soup.pk, salad.pk])
+        self.assertEqual(search("search=tomato&is_favorited=1"), [salad.pk])
+        self.assertEqual(search("search=tomato&limit=1&page=2"), [salad.pk])
+        self.assertEqual(search("search=tomato&tags=breakfast"),
+                         [soup.pk, salad.pk])
+        self.assertEqual(search(f"search=tomato&author={self.user.pk}"),
+                         [salad.pk])
+        self.assertEqual(search('search="AND (tomato*'), [salad.pk])
+        self.assertEqual(search('search=tomato ( " *'), [soup.pk, salad.pk])
+        self.assertEqual(search("search=pancakes"), [self.recipe.pk])
+        # keyset pages would drop the rank order
+        for url in ("/api/recipes/?search=tomato&cursor=",
+                    "/api/recipes/feed/?search=tomato"):
+            response = self.auth_user.get(url)
+            self.assertEqual(response.status_code,  # type:ignore
+                             status.HTTP_400_BAD_REQUEST)
+        # databases without full-text index look up substrings, async
+        # views may run queries with connection of another thread
+        with mock.patch.object(
+                type(connections["default"]), "vendor", "mysql"):
+            self.assertEqual(search("search=basil soup"), [soup.pk])
+            self.assertEqual(search("search=mato"), [salad.pk, soup.pk])
+
+        soup.name = "Pumpkin soup"
+        soup.save()
+        self.assertEqual(search("search=tomato"), [salad.pk])
+        salad.delete()
+        self.assertEqual(search("search=tomato"), [])
+
+    def testPostgreSQLSearchQuery(self):
+        # the SQLite index covers the same queries in testRecipeSearch
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            sql, params = search_recipes(
+                Recipe.objects.all(), ["tom"]).query.sql_with_params()
+        self.assertIn(
+            "recipes_recipe.search_vector @@ to_tsquery('russian', %s)", sql)
+        self.assertIn(
+            "ts_rank(recipes_recipe.search_vector, "
+            "to_tsquery('russian', %s))", sql)
+        self.assertEqual(params.count("'tom':*"), 2)
+        self.assertEqual(get_postgresql_search_query(["tom"]), "'tom':*")
+        self.assertEqual(
+            get_postgresql_search_query(['"AND', "(tomato*", "tom-ato"]),
+            "'AND':* & 'tomato':* & 'tom' <-> 'ato':*")
+        self.assertEqual(
+            get_postgresql_search_query(["tomato", "(", "'|!"]),
+            "'tomato':*")
+        self.assertIsNone(get_postgresql_search_query(["(", "&"]))
+
+    def testRecipeFastReadPathMatchesSerializers(self):
+        recipe = self.create_recipe(self.author, "блины \u2028 \U0001f95e")
+        recipe.text = 'tab\t "quote" \\ \x01 \u2029 ünïcode'
+        recipe.save()
+        second_tag = Tag.objects.create(
+            name="lunch", color="#49B64E", slug="lunch")
+        recipe.tags.add(second_tag)
+        self.user.favorite_recipes.add(recipe)
+        self.user.users_followed.add(self.author)
+        urls = (
+            "/api/recipes/",
+            "/api/recipes/?limit=1&page=2",
+            "/api/recipes/?tags=lunch&is_favorited=1",
+            "/api/recipes/?search=description",
+            "/api/recipes/feed/?limit=1",
+            "/api/recipes/?fields=id,name,image,cooking_time",
+            "/api/recipes/?fields=author,tags,ingredients&expand=tags",
+            f"/api/recipes/{recipe.pk}/",
+            f"/api/recipes/{recipe.pk}/?fields=author,is_favorited"
+            "&expand=author",
+            "/api/recipes/0/",
+        )
+        for client in (self.guest_user, self.auth_user):
+            for url in urls:
+                responses = []
+                for fast_read_path in (True, False):
+                    cache.clear()
+                    with self.settings(RECIPE_FAST_READ_PATH=fast_read_path):
+                        responses.append(client.get(url))
+                fast, slow = responses
+                with self.subTest(url=url):
+                    self.assertEqual(fast.status_code,  # type:ignore
+                                     slow.status_code)  # type:ignore
+                    self.assertEqual(fast.content, slow.content)
+
+    def testDownloadShoppingCart(self):
+        sugar = Ingredient.objects.create(
+            name="SUGAR", measurement_unit=self.unit)
+        another_recipe = self.create_recipe(self.author, "waffles")
+        RecipeIngredient.objects.create(
+            recipe=another_recipe, ingredient=sugar, amount=5)
+        for recipe in (self.recipe, another_recipe):
+            self.auth_user.post(f"/api/recipes/{recipe.pk}/shopping_cart/")
+
+        url = "/api/recipes/download_shopping_cart/"
+        expected_content = {
+            "txt": ("Ingredient, amount\n------------------\n"
+                    "Flour (g), 200\nSugar (g), 5\n"),
+            "csv": "ingredient,amount\r\nFlour (g),200\r\nSugar (g),5\r\n",
+            "json": ('[{"ingredient": "Flour (g)", "amount": 200},'
+                     '{"ingredient": "Sugar (g)", "amount": 5}]'),
+        }
+        for file_format, expected in expected_content.items():
+            with self.subTest(file_format=file_format):
+                response = self.auth_user.get(
+                    f"{url}?file_format={file_format}")
+                self.assertEqual(response.status_code,  # type:ignore
+                                 status.HTTP_200_OK)
+                content = b"".join(
+                    response.streaming_content).decode()  # type:ignore
+                self.assertEqual(content, expected)
+
+        response = self.auth_user.get(f"{url}?file_format=pdf")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_400_BAD_REQUEST)
+
+    def testSubscriptionsQueryCount(self):
+        url = "/api/users/subscriptions/?limit=10&recipes_limit=2"
+        self.auth_user.get("/api/users/me/")
+        for index in range(6):
+            author = User.objects.create_user(  # type:ignore
+                username=f"author{index}",
+                email=f"author{index}@example.com",
+                first_name="author",
+                last_name="author",
+                password="qwerty1990",
+            )
+            for recipe_index in range(3):
+                self.create_recipe(author, f"recipe {recipe_index}")
+            self.user.users_followed.add(author)
+            if index == 1:
+                with self.assertNumQueries(3):
+                    self.auth_user.get(url)
+
+        with self.assertNumQueries(3):
+            response = self.auth_user.get(url)
+        authors = response.json()["results"]  # type:ignore
+        self.assertEqual(len(authors), 6)
+        for author in authors:
+            self.assertEqual(author["recipes_count"], 3)
+            self.assertEqual(
+                [recipe["name"] for recipe in author["recipes"]],
+                ["recipe 2", "recipe 1"])
+
+    def testAnonymousRecipeResponseCache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_backends = {
+                "locmem": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                },
+                "filebased": {
+                    "BACKEND":
+                        "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": cache_dir,
+                },
+            }
+            for name, backend in cache_backends.items():
+                with self.subTest(backend=name), self.settings(
+                    CACHES={"default": backend}
+                ):
+                    self.check_recipe_response_cache()
+
+    def check_recipe_response_cache(self):
+        list_url = f"/api/recipes/?limit=1&tags={self.tag.slug}"
+        url = f"/api/recipes/{self.recipe.pk}/"
+        cache.clear()
+        self.guest_user.get(list_url)
+        self.guest_user.get(url)
+        with self.assertNumQueries(0):
+            response = self.guest_user.get(
+                f"/api/recipes/?tags={self.tag.slug}&limit=1")
+            self.guest_user.get(url)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(
+            response.json()["results"][0]["name"],  # type:ignore
+            recipe.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = f"{recipe.name} with jam"
+            recipe.save()
+        response = self.guest_user.get(url)
+        self.assertEqual(response.json()["name"], recipe.name)  # type:ignore
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = f"{self.author.first_name}!"
+            self.author.save()
+        response = self.guest_user.get(list_url)
+        self.assertEqual(
+            response.json()["results"][0]["author"][  # type:ignore
+                "first_name"],
+            self.author.first_name)
+
+    def testRecipeImageVariants(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+            MEDIA_ROOT=media_root
+        ):
+            buffer = io.BytesIO()
+            Image.new("RGB", (1600, 1200), "orange").save(buffer, "PNG")
+            image_name = default_storage.save(
+                "recipe_images/photo.png", ContentFile(buffer.getvalue()))
+            Recipe.objects.filter(pk=self.recipe.pk).update(image=image_name)
+            recipes = self.auth_user.get(
+                "/api/recipes/").json()["results"]  # type:ignore
+            self.assertTrue(recipes[0]["image"].endswith(image_name))
+            generate_image_variants(image_name)
+            self.assertEqual(
+                Recipe.objects.get(pk=self.recipe.pk).image_variants,
+                list(settings.RECIPE_IMAGE_VARIANTS))
+
+            with default_storage.open(
+                get_variant_name(image_name, "thumbnail")
+            ) as thumbnail:
+                self.assertLessEqual(max(Image.open(thumbnail).size), 320)
+
+            self.auth_user.post(
+                f"/api/recipes/{self.recipe.pk}/shopping_cart/")
+            cart = self.auth_user.get(
+                "/api/recipes/show_shopping_cart/").json()  # type:ignore
+            self.assertTrue(cart[0]["image"].endswith("_thumbnail.webp"))
+            recipes = self.auth_user.get(
+                "/api/recipes/").json()["results"]  # type:ignore
+            self.assertTrue(recipes[0]["image"].endswith("_card.webp"))
+            recipe = self.auth_user.get(
+                f"/api/recipes/{self.recipe.pk}/").json()  # type:ignore
+            self.assertTrue(recipe["image"].endswith(image_name))
+
+            # variants are kept until the image changes
+            recipe = Recipe.objects.get(pk=self.recipe.pk)
+            recipe.name = "renamed"
+            recipe.save()
+            self.assertTrue(Recipe.objects.get(
+                pk=self.recipe.pk).image_variants)
+            recipe.image = self.save_test_image("recipe_images/new.png")
+            recipe.save()
+            self.assertEqual(
+                Recipe.objects.get(pk=self.recipe.pk).image_variants, [])
+
+    def testRecipeCreateAndDiffUpdate(self):
+        ingredients = [
+            Ingredient.objects.create(
+                name=f"ingredient {index}", measurement_unit=self.unit)
+            for index in range(10)
+        ]
+        lunch = Tag.objects.create(name="lunch", color="#49B64E", slug="lunch")
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8), "orange").save(buffer, "PNG")
+        image = ("data:image/png;base64,"
+                 + base64.b64encode(buffer.getvalue()).decode())
+
+        def get_payload(amounts, tags):
+            return {
+                "ingredients": [{"id": ingredients[index].pk, "amount": amount}
+                                for index, amount in amounts.items()],
+                "tags": [tag.pk for tag in tags],
+                "image": image,
+                "name": "omelette",
+                "text": "omelette description",
+                "cooking_time": 5,
+            }
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+            MEDIA_ROOT=media_root
+        ):
+            response = self.auth_user.post(
+                "/api/recipes/", get_payload({0: 1, 1: 1, 2: 1}, [self.tag]),
+                format="json")
+            self.assertEqual(response.status_code,  # type:ignore
+                             status.HTTP_201_CREATED)
+            recipe_url = f"/api/recipes/{response.json()['id']}/"
+
+            query_counts = []
+            for amounts, tags in (
+                ({0: 2, 1: 1, 3: 1, 4: 1}, [lunch]),
+                ({1: 3, 3: 3, 4: 3, **dict.fromkeys(range(5, 10), 1)},
+                 [self.tag]),
+                ({1: 3, 3: 3, 4: 3, **dict.fromkeys(range(5, 10), 1)},
+                 [self.tag]),
+            ):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.auth_user.patch(
+                        recipe_url, get_payload(amounts, tags),
+                        format="json")
+                self.assertEqual(response.status_code,  # type:ignore
+                                 status.HTTP_200_OK)
+                query_counts.append(len(queries))
+                recipe_data = response.json()  # type:ignore
+                self.assertEqual(
+                    {(item["id"], item["amount"])
+                     for item in recipe_data["ingredients"]},
+                    {(ingredients[index].pk, amount)
+                     for index, amount in amounts.items()})
+                self.assertEqual(
+                    [tag["id"] for tag in recipe_data["tags"]],
+                    [tag.pk for tag in tags])
+                stored_data = self.auth_user.get(
+                    recipe_url).json()  # type:ignore
+                self.assertEqual(recipe_data["ingredients"],
+                                 stored_data["ingredients"])
+                self.assertEqual(recipe_data["tags"], stored_data["tags"])
+
+        # same kinds of changes cost the same however many rows change,
+        # nothing is written when relations are unchanged
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertLess(query_counts[2], query_counts[1])
+
+        response = self.auth_user.patch(
+            recipe_url, {**get_payload({0: 1}, [self.tag]), "tags": [0]},
+            format="json")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_400_BAD_REQUEST)
+
+    def save_test_image(self, name):
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), "orange").save(buffer, "PNG")
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def testRecipeImageDeletedOnCommit(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+            MEDIA_ROOT=media_root
+        ):
+            image_name = self.save_test_image("recipe_images/photo.png")
+            recipe = self.create_recipe(self.author, "waffles")
+            Recipe.objects.filter(pk=recipe.pk).update(image=image_name)
+
+            with self.captureOnCommitCallbacks() as callbacks:
+                Recipe.objects.get(pk=recipe.pk).delete()
+            self.assertTrue(default_storage.exists(image_name))
+
+            for callback in callbacks:
+                callback()
+            for _ in range(50):
+                if not default_storage.exists(image_name):
+                    break
+                time.sleep(0.1)
+            self.assertFalse(default_storage.exists(image_name))
+
+    def testDeleteOrphanImages(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+            MEDIA_ROOT=media_root
+        ):
+            image_name = self.save_test_image("recipe_images/photo.png")
+            Recipe.objects.filter(pk=self.recipe.pk).update(image=image_name)
+            generate_image_variants(image_name)
+            orphan_names = [
+                self.save_test_image("recipe_images/orphan.png"),
+                get_variant_name("recipe_images/orphan.png", "card"),
+                # same stem as the referenced image
+                get_variant_name("recipe_images/photo.jpg", "card"),
+            ]
+            for name in orphan_names[1:]:
+                default_storage.save(name, ContentFile(b"webp"))
+            fresh_orphan_name = self.save_test_image("recipe_images/new.png")
+            for name in orphan_names:
+                os.utime(default_storage.path(name), (0, 0))
+
+            call_command("delete_orphan_images", stdout=io.StringIO())
+            for name in orphan_names:
+                self.assertFalse(default_storage.exists(name))
+            for name in (image_name, fresh_orphan_name,
+                         get_variant_name(image_name, "thumbnail")):
+                self.assertTrue(default_storage.exists(name))
+
+
+class TestTokenAuthentication(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(  # type:ignore
+                username=f"user{index}", email=f"user{index}@example.com",
+                password="qwerty1990")
+            for index in range(2)
+        ]
+        cls.tokens = [Token.objects.create(user=user) for user in cls.users]
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.clients = []
+        for token in self.tokens:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+            self.clients.append(client)
+
+    def getTokenQueries(self, client, status_code=status.HTTP_200_OK):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/api/users/me/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status_code)
+        return [query["sql"] for query in queries
+                if "authtoken_token" in query["sql"]]
+
+    def testCachedAuthentication(self):
+        client = self.clients[0]
+        self.assertEqual(len(self.getTokenQueries(client)), 1)
+        self.assertEqual(self.getTokenQueries(client), [])
+        user, token = token_cache.get(self.tokens[0].key)
+        self.assertEqual(user, self.users[0])
+        self.assertIs(token.user, user)
+        # 'me' annotates request.user, cached user stays untouched
+        self.assertFalse(hasattr(user, "is_subscribed"))
+
+        # saves not changing credentials keep the entry, without
+        # looking tokens up
+        user = User.objects.get(pk=self.users[0].pk)
+        user.first_name = "renamed"
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertFalse([query for query in queries
+                          if "authtoken_token" in query["sql"]])
+        self.assertEqual(self.getTokenQueries(client), [])
+
+        with self.settings(TOKEN_AUTH_SHARED_CACHE=None):
+            self.assertIsNone(token_cache.shared_cache)
+            self.assertEqual(len(self.getTokenQueries(client)), 1)
+            self.assertEqual(self.getTokenQueries(client), [])
+            token_cache.clear()
+            with self.settings(TOKEN_AUTH_CACHE_TIMEOUT=0):
+                for _ in range(2):
+                    self.assertEqual(len(self.getTokenQueries(client)), 1)
+            with self.settings(TOKEN_AUTH_CACHE_SIZE=1):
+                self.getTokenQueries(self.clients[1])
+                self.assertEqual(len(self.getTokenQueries(client)), 1)
+        with self.settings(CACHES={"default": {
+            "BACKEND": PROCESS_LOCAL_CACHES[0],
+        }}):
+            self.assertIsNone(token_cache.shared_cache)
+
+        bad_client = APIClient()
+        bad_client.credentials(HTTP_AUTHORIZATION="Token invalid")
+        for _ in range(2):
+            self.assertEqual(len(self.getTokenQueries(
+                bad_client, status.HTTP_401_UNAUTHORIZED)), 1)
+
+    def testInvalidation(self):
+        first, second = self.clients
+        self.getTokenQueries(first)
+        response = first.post("/api/users/set_password/", {
+            "current_password": "qwerty1990",
+            "new_password": "1990qwerty1990",
+        })
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(token_cache.get(self.tokens[0].key))
+        self.getTokenQueries(first)
+
+        response = first.post("/api/auth/token/logout/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_204_NO_CONTENT)
+        self.getTokenQueries(first, status.HTTP_401_UNAUTHORIZED)
+
+        self.getTokenQueries(second)
+        user = User.objects.get(pk=self.users[1].pk)
+        user.is_active = False
+        user.save()
+        self.getTokenQueries(second, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestIngredientAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        unit = MeasurementUnit.objects.create(name="г")
+        for name in ("соль", "ванильный сахар", "сахарная пудра", "Сахар"):
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_user = APIClient()
+
+    def testIngredientSearchOrdering(self):
+        url = "/api/ingredients/?name=сах"
+        response = self.guest_user.get(url)
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_200_OK)
+        self.assertEqual(
+            [ingredient["name"]
+             for ingredient in response.json()],  # type:ignore
+            ["Сахар", "сахарная пудра", "ванильный сахар"])
+        self.assertEqual(response.json()[0]["measurement_unit"],  # type:ignore
+                         "г")
+
+        with self.assertNumQueries(0):
+            response = self.guest_user.get(f"{url}&limit=2")
+        self.assertEqual(len(response.json()), 2)  # type:ignore
+
+    def testIngredientSearchShortTerm(self):
+        response = self.guest_user.get("/api/ingredients/?name=ль")
+        self.assertEqual(
+            [ingredient["name"]
+             for ingredient in response.json()],  # type:ignore
+            ["ванильный сахар", "соль"])
+        response = self.guest_user.get("/api/ingredients/?name=сах&limit=0")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_400_BAD_REQUEST)
+
+
+class TestReferenceDataAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(
+            name="breakfast", color="#E26C2D", slug="breakfast")
+        unit = MeasurementUnit.objects.create(name="g")
+        Ingredient.objects.create(name="flour", measurement_unit=unit)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_user = APIClient()
+
+    def testConditionalRequests(self):
+        for url in ("/api/tags/", "/api/ingredients/"):
+            with self.subTest(url=url):
+                response = self.guest_user.get(url)
+                self.assertEqual(response.status_code,  # type:ignore
+                                 status.HTTP_200_OK)
+                self.assertEqual(len(response.json()), 1)  # type:ignore
+                etag = response.headers["ETag"]  # type:ignore
+                last_modified = response.headers[  # type:ignore
+                    "Last-Modified"]
+
+                with self.assertNumQueries(0):
+                    not_modified_responses = (
+                        self.guest_user.get(url, HTTP_IF_NONE_MATCH=etag),
+                        self.guest_user.get(
+                            url, HTTP_IF_MODIFIED_SINCE=last_modified),
+                    )
+                    response = self.guest_user.get(url)
+                for not_modified_response in not_modified_responses:
+                    self.assertEqual(
+                        not_modified_response.status_code,  # type:ignore
+                        status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(len(response.json()), 1)  # type:ignore
+
+    def testGzippedContent(self):
+        response = self.guest_user.get(
+            "/api/tags/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response.headers["Content-Encoding"],  # type:ignore
+                         "gzip")
+        self.assertEqual(
+            gzip.decompress(response.content).decode(),  # type:ignore
+            self.guest_user.get("/api/tags/").content.decode())  # type:ignore
+
+    def testCatalogueChange(self):
+        etag = self.guest_user.get(
+            "/api/tags/").headers["ETag"]  # type:ignore
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = "early breakfast"
+            self.tag.save()
+        response = self.guest_user.get(
+            "/api/tags/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]["name"],  # type:ignore
+                         "early breakfast")
+
+    def testSharedCacheIsRequired(self):
+        # tests clear the cache, it must not be the one of servers
+        self.assertIn("foodgram-test-cache-",
+                      settings.CACHES["default"]["LOCATION"])
+        self.assertEqual(check_shared_cache(None), [])
+        with self.settings(CACHES={
+            "default": {"BACKEND": PROCESS_LOCAL_CACHES[0]},
+        }):
+            self.assertEqual([error.id for error in check_shared_cache(None)],
+                             ["api.E001"])
+
+    def testReplicaPinsRequireSharedCache(self):
+        self.assertEqual(check_replica_pin_cache(None), [])
+        for backend in (*PROCESS_LOCAL_CACHES, *NON_STORING_CACHES):
+            with self.settings(CACHES={"default": {"BACKEND": backend}}):
+                self.assertEqual(check_replica_pin_cache(None), [])
+                with self.settings(DATABASE_REPLICAS=["replica1"]):
+                    self.assertEqual(
+                        [error.id for error in check_replica_pin_cache(None)],
+                        ["api.E002"])
+
+
+class TestSQLAccounting(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(  # type:ignore
+            username="user", email="user@example.com", password="qwerty1990")
+        cls.staff = User.objects.create_user(  # type:ignore
+            username="staff", email="staff@example.com",
+            password="qwerty1990", is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        sql_statistics.reset()
+        self.guest_user = APIClient()
+
+    def testServerTimingHeader(self):
+        response = self.guest_user.get("/api/recipes/")
+        server_timing = response.headers["Server-Timing"]  # type:ignore
+        self.assertRegex(server_timing,
+                         r'^sql;dur=[\d.]+;desc="[1-9]\d* queries", '
+                         r"total;dur=[\d.]+$")
+
+    def testStatisticsEndpoint(self):
+        self.assertEqual(
+            self.guest_user.get(
+                "/api/sql-stats/").status_code,  # type:ignore
+            status.HTTP_401_UNAUTHORIZED)
+        self.guest_user.force_authenticate(self.user)
+        self.assertEqual(
+            self.guest_user.get(
+                "/api/sql-stats/").status_code,  # type:ignore
+            status.HTTP_403_FORBIDDEN)
+
+        self.guest_user.force_authenticate(self.staff)
+        for _ in range(2):
+            self.guest_user.get("/api/recipes/")
+        summary = self.guest_user.get(
+            "/api/sql-stats/").json()  # type:ignore
+        self.assertEqual(summary["api:Recipe-list"]["requests"], 2)
+        self.assertGreater(summary["api:Recipe-list"]["queries_mean"], 0)
+        self.assertTrue(summary["api:Recipe-list"]["slowest_statements"])
+
+        response = self.guest_user.delete("/api/sql-stats/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_204_NO_CONTENT)
+        self.assertNotIn("api:Recipe-list", sql_statistics.get_summary())
+
+    def testRepeatedStatements(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for user in User.objects.order_by("pk"):
+                list(user.recipes.all())
+            for _ in range(5):
+                User.objects.filter(pk=self.user.pk).exists()
+        self.assertEqual(recorder.count, 8)
+        sql_statistics.record("view", recorder, recorder.duration)
+        repeated = sql_statistics.get_summary()["view"]["repeated_statements"]
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0]["max_repeats"], 5)
+
+
+class TestCounters(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(  # type:ignore
+                username=f"user{index}", email=f"user{index}@example.com",
+                password="qwerty1990")
+            for index in range(3)
+        ]
+        cls.author = User.objects.create_user(  # type:ignore
+            username="author", email="author@example.com",
+            password="qwerty1990")
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name="recipe", text="description",
+            image="recipe_images/test.png", cooking_time=10)
+
+    def setUp(self):
+        cache.clear()
+        self.auth_user = APIClient()
+        self.auth_user.force_authenticate(self.users[0])
+
+    def assertCounters(self, obj, **counters):
+        obj.refresh_from_db()
+        for counter_field, value in counters.items():
+            self.assertEqual(getattr(obj, counter_field), value,
+                             counter_field)
+
+    def testApiActions(self):
+        recipe_url = f"/api/recipes/{self.recipe.pk}/"
+        for _ in range(2):
+            self.auth_user.post(f"{recipe_url}favorite/")
+            self.auth_user.post(f"{recipe_url}shopping_cart/")
+            self.auth_user.post(f"/api/users/{self.author.pk}/subscribe/")
+        self.assertCounters(self.recipe, favorites_count=1, in_carts_count=1)
+        self.assertCounters(self.author, followers_count=1, recipes_count=1)
+
+        for _ in range(2):
+            self.auth_user.delete(f"{recipe_url}favorite/")
+            self.auth_user.delete(f"{recipe_url}shopping_cart/")
+            self.auth_user.delete(f"/api/users/{self.author.pk}/subscribe/")
+        self.assertCounters(self.recipe, favorites_count=0, in_carts_count=0)
+        self.assertCounters(self.author, followers_count=0)
+
+    def testRelatedManagers(self):
+        self.recipe.following_users.add(*self.users)
+        self.users[0].favorite_recipes.add(self.recipe)
+        self.assertCounters(self.recipe, favorites_count=3)
+        self.recipe.following_users.remove(self.users[0])
+        self.users[1].favorite_recipes.remove(self.recipe, self.recipe)
+        self.users[1].favorite_recipes.remove(self.recipe)
+        self.assertCounters(self.recipe, favorites_count=1)
+        self.recipe.following_users.clear()
+        self.assertCounters(self.recipe, favorites_count=0)
+
+        self.recipe.shopping_carts.set(self.users[:2])
+        self.assertCounters(self.recipe, in_carts_count=2)
+        self.users[0].shopping_cart.clear()
+        self.assertCounters(self.recipe, in_carts_count=1)
+
+    def testRecipeAndUserDeletion(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name="second recipe", text="description",
+            image="recipe_images/test.png", cooking_time=10)
+        self.assertCounters(self.author, recipes_count=2)
+        recipe.delete()
+        self.assertCounters(self.author, recipes_count=1)
+
+        user = self.users[2]
+        user.favorite_recipes.add(self.recipe)
+        user.shopping_cart.add(self.recipe)
+        user.users_followed.add(self.author)
+        user.delete()
+        self.assertCounters(self.recipe, favorites_count=0, in_carts_count=0)
+        self.assertCounters(self.author, followers_count=0)
+
+    def testCountersStopAtZero(self):
+        Recipe.objects.update(favorites_count=1)
+        change_counters(Recipe, "favorites_count", {self.recipe.pk: -3})
+        self.assertCounters(self.recipe, favorites_count=0)
+
+    def testSaveKeepsCounters(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        self.users[0].favorite_recipes.add(recipe)
+        self.users[0].users_followed.add(author)
+        recipe.name = "renamed recipe"
+        recipe.save()
+        author.first_name = "renamed"
+        author.save()
+        self.assertCounters(recipe, favorites_count=1, name="renamed recipe")
+        self.assertCounters(author, followers_count=1, first_name="renamed")
+
+    def testReconcileCounters(self):
+        self.users[0].favorite_recipes.add(self.recipe)
+        Recipe.objects.update(favorites_count=5, in_carts_count=2)
+        User.objects.update(recipes_count=7)
+        output = io.StringIO()
+        call_command("reconcile_counters", chunk_size=2, stdout=output)
+        self.assertCounters(self.recipe, favorites_count=1, in_carts_count=0)
+        self.assertCounters(self.author, recipes_count=1)
+        self.assertCounters(self.users[0], recipes_count=0)
+        self.assertIn("users.User.recipes_count: 4 rows fixed",
+                      output.getvalue())
+
+
+class TestShoppingList(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(  # type:ignore
+                username=f"user{index}", email=f"user{index}@example.com",
+                password="qwerty1990")
+            for index in range(3)
+        ]
+        cls.unit = MeasurementUnit.objects.create(name="g")
+        cls.flour, cls.sugar, cls.eggs = (
+            Ingredient.objects.create(name=name, measurement_unit=cls.unit)
+            for name in ("flour", "sugar", "eggs")
+        )
+        cls.tag = Tag.objects.create(
+            name="breakfast", color="#E26C2D", slug="breakfast")
+        cls.pancakes = cls.create_recipe(
+            "pancakes", {cls.flour: 100, cls.sugar: 10})
+        cls.waffles = cls.create_recipe(
+            "waffles", {cls.flour: 200, cls.eggs: 2})
+
+    @classmethod
+    def create_recipe(cls, name, amounts):
+        recipe = Recipe.objects.create(
+            author=cls.users[0], name=name, text=f"{name} description",
+            image="recipe_images/test.png", cooking_time=10)
+        recipe.tags.add(cls.tag)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        self.auth_user = APIClient()
+        self.auth_user.force_authenticate(self.users[0])
+
+    def assertShoppingList(self, user, amounts):
+        shopping_list = dict(ShoppingListItem.objects.filter(
+            user=user).values_list("ingredient", "total_amount"))
+        self.assertEqual(shopping_list, {
+            ingredient.pk: amount for ingredient, amount in amounts.items()})
+        self.assertEqual(shopping_list, {
+            ingredient_id: amount for (_, ingredient_id), amount
+            in get_shopping_list_totals((user.pk,)).items()})
+
+    def testApiActions(self):
+        user = self.users[0]
+        self.auth_user.post(f"/api/recipes/{self.pancakes.pk}/shopping_cart/")
+        self.assertShoppingList(user, {self.flour: 100, self.sugar: 10})
+        self.auth_user.post("/api/recipes/shopping_cart/batch/", {
+            "action": "add", "recipes": [self.pancakes.pk, self.waffles.pk],
+        }, format="json")
+        self.assertShoppingList(
+            user, {self.flour: 300, self.sugar: 10, self.eggs: 2})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.auth_user.get(
+                "/api/recipes/download_shopping_cart/")
+            content = b"".join(
+                response.streaming_content).decode()  # type:ignore
+        self.assertEqual(content.splitlines()[2:],
+                         ["Eggs (g), 2", "Flour (g), 300", "Sugar (g), 10"])
+        shopping_list_queries = [query["sql"] for query in queries
+                                 if "recipes_recipeingredient" in query["sql"]]
+        self.assertEqual(shopping_list_queries, [])
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8), "orange").save(buffer, "PNG")
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+            MEDIA_ROOT=media_root
+        ):
+            self.auth_user.patch(f"/api/recipes/{self.waffles.pk}/", {
+                "ingredients": [{"id": self.flour.pk, "amount": 150},
+                                {"id": self.sugar.pk, "amount": 5}],
+                "tags": [self.tag.pk],
+                "image": ("data:image/png;base64,"
+                          + base64.b64encode(buffer.getvalue()).decode()),
+                "name": "waffles",
+                "text": "waffles description",
+                "cooking_time": 10,
+            }, format="json")
+        self.assertShoppingList(user, {self.flour: 250, self.sugar: 15})
+
+        self.auth_user.delete(
+            f"/api/recipes/{self.pancakes.pk}/shopping_cart/")
+        self.assertShoppingList(user, {self.flour: 150, self.sugar: 5})
+        self.auth_user.post("/api/recipes/shopping_cart/batch/", {
+            "action": "remove", "recipes": [self.waffles.pk],
+        }, format="json")
+        self.assertShoppingList(user, {})
+
+    def testRelatedManagersAndDeletion(self):
+        first, second, third = self.users
+        self.pancakes.shopping_carts.add(first, second)
+        self.waffles.shopping_carts.add(second, third)
+        self.assertShoppingList(first, {self.flour: 100, self.sugar: 10})
+        self.assertShoppingList(
+            second, {self.flour: 300, self.sugar: 10, self.eggs: 2})
+        self.assertShoppingList(third, {self.flour: 200, self.eggs: 2})
+
+        self.waffles.shopping_carts.clear()
+        self.assertShoppingList(second, {self.flour: 100, self.sugar: 10})
+        self.assertShoppingList(third, {})
+        first.shopping_cart.clear()
+        self.assertShoppingList(first, {})
+
+        third.shopping_cart.set((self.pancakes, self.waffles))
+        self.pancakes.delete()
+        self.assertShoppingList(second, {})
+        self.assertShoppingList(third, {self.flour: 200, self.eggs: 2})
+        self.eggs.delete()
+        self.assertShoppingList(third, {self.flour: 200})
+
+    def testRebuildShoppingLists(self):
+        first, second, _ = self.users
+        User.shopping_cart.through.objects.bulk_create((
+            User.shopping_cart.through(user=first, recipe=self.pancakes),
+            User.shopping_cart.through(user=first, recipe=self.waffles),
+        ))
+        ShoppingListItem.objects.create(
+            user=second, ingredient=self.flour, total_amount=1)
+        output = io.StringIO()
+        call_command("rebuild_shopping_lists", chunk_size=1, stdout=output)
+        self.assertShoppingList(
+            first, {self.flour: 300, self.sugar: 10, self.eggs: 2})
+        self.assertShoppingList(second, {})
+        self.assertIn("of 1 users rebuilt", output.getvalue())
+
+
+class TestAsyncReadViews(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(  # type:ignore
+                username=f"user{index}", email=f"user{index}@example.com",
+                password="qwerty1990")
+            for index in range(3)
+        ]
+        cls.token = Token.objects.create(user=cls.users[0])
+        unit = MeasurementUnit.objects.create(name="g")
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name in ("flour", "sugar", "salt")
+        ]
+        tags = [
+            Tag.objects.create(name=slug, color=color, slug=slug)
+            for slug, color in (("breakfast", "#E26C2D"),
+                                ("dinner", "#49B64E"))
+        ]
+        cls.recipes = []
+        for index in range(8):
+            recipe = Recipe.objects.create(
+                author=cls.users[1 + index % 2], name=f"recipe {index}",
+                text=f"recipe {index} description",
+                image="recipe_images/test.png", cooking_time=10 + index)
+            recipe.tags.add(tags[index % 2])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=index + 1)
+                for ingredient in ingredients[:1 + index % 3]
+            )
+            cls.recipes.append(recipe)
+        cls.users[0].users_followed.add(cls.users[1], cls.users[2])
+        cls.users[0].favorite_recipes.add(*cls.recipes[:3])
+        cls.users[0].shopping_cart.add(*cls.recipes[2:5])
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.factory = AsyncRequestFactory()
+
+    def resolveDRFView(self, path):
+        # async views are routed when ASYNC_READ_VIEWS is on
+        match = resolve(path.partition("?")[0])
+        return getattr(match.func, "__wrapped__", match.func), match
+
+    def getDRFResponse(self, path, **headers):
+        cache.clear()
+        drf_view, match = self.resolveDRFView(path)
+        response = drf_view(
+            RequestFactory().get(path, **headers), **match.kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        content = (b"".join(response.streaming_content)
+                   if response.streaming else response.content)
+        return response, content
+
+    def getAsyncResponse(self, path, **headers):
+        """Return response of async view and whether DRF view answered."""
+        cache.clear()
+        drf_view, match = self.resolveDRFView(path)
+        fallbacks = []
+
+        @functools.wraps(drf_view)
+        def callback(*args, **kwargs):
+            fallbacks.append(path)
+            return drf_view(*args, **kwargs)
+
+        view = async_read_view(ASYNC_READ_HANDLERS[match.url_name], callback)
+        # async factory takes header names, not WSGI environ keys
+        request = self.factory.get(path, **{
+            name[5:].replace("_", "-"): value
+            for name, value in headers.items()
+        })
+        response = async_to_sync(view)(request, **match.kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response, bool(fallbacks)
+
+    def testResponsesMatchDRFViews(self):
+        recipe = self.recipes[0]
+        paths = (
+            "/api/recipes/",
+            "/api/recipes/?page=2&limit=3",
+            "/api/recipes/?page=100",
+            "/api/recipes/?cursor=&limit=3",
+            "/api/recipes/?tags=breakfast&is_favorited=1",
+            "/api/recipes/?is_in_shopping_cart=1&fields=id,name,tags",
+            f"/api/recipes/?author={self.users[1].pk}&expand=tags",
+            "/api/recipes/?author=100000",
+            "/api/recipes/?search=recipe&fields=id,author&expand=author",
+            "/api/recipes/?fields=unknown",
+            "/api/recipes/feed/?limit=5",
+            f"/api/recipes/{recipe.pk}/",
+            f"/api/recipes/{recipe.pk}/?fields=id,ingredients",
+            "/api/recipes/100000/",
+            "/api/users/subscriptions/?recipes_limit=2",
+            "/api/users/subscriptions/?limit=1&page=2",
+            "/api/tags/",
+            "/api/ingredients/",
+            "/api/ingredients/?name=s&limit=1",
+        )
+        for headers in ({}, {
+            "HTTP_AUTHORIZATION": f"Token {self.token.key}"
+        }):
+            for path in paths:
+                with self.subTest(path=path, headers=headers):
+                    expected, content = self.getDRFResponse(path, **headers)
+                    response, fell_back = self.getAsyncResponse(
+                        path, **headers)
+                    # errors are left to DRF views
+                    self.assertEqual(fell_back, expected.status_code
+                                     != status.HTTP_200_OK)  # type:ignore
+                    self.assertEqual(
+                        response.status_code,
+                        expected.status_code)  # type:ignore
+                    self.assertEqual(response.content, content)
+                    for header in ("Content-Type", "Content-Disposition",
+                                   "Allow"):
+                        self.assertEqual(
+                            response.headers.get(header),
+                            expected.headers.get(header))  # type:ignore
+
+    def testQueries(self):
+        headers = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        for path in ("/api/recipes/", "/api/users/subscriptions/"):
+            with self.subTest(path=path):
+                token_cache.clear()
+                with CaptureQueriesContext(connection) as expected:
+                    self.getDRFResponse(path, **headers)
+                token_cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    self.getAsyncResponse(path, **headers)
+                self.assertEqual(len(queries), len(expected))
+
+    def testInvalidToken(self):
+        response, _ = self.getAsyncResponse(
+            "/api/recipes/", HTTP_AUTHORIZATION="Token invalid")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_401_UNAUTHORIZED)
+
+    def testSQLAccountingUnderASGI(self):
+        response = async_to_sync(self.async_client.get)("/api/recipes/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_200_OK)
+        self.assertRegex(response.headers["Server-Timing"],  # type:ignore
+                         r'desc="[1-9]\d* queries"')
+
+    def testStreamingUnderASGI(self):
+        path = "/api/recipes/download_shopping_cart/"
+        headers = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        _, expected = self.getDRFResponse(f"{path}?file_format=csv",
+                                          **headers)
+        messages = []
+
+        async def receive():
+            return {"type": "http.request"}
+
+        async def send(message):
+            messages.append(message)
+
+        # 'handle' runs sync code in this thread, which has the test
+        # transaction, '__call__' would start a thread for the request
+        async_to_sync(StreamingASGIHandler().handle)({
+            "type": "http", "method": "GET", "path": path,
+            "query_string": b"file_format=csv",
+            "headers": [(b"host", b"testserver"), (
+                b"authorization", f"Token {self.token.key}".encode())],
+        }, receive, send)
+        self.assertEqual(messages[0]["status"], status.HTTP_200_OK)
+        self.assertEqual(messages[-1], {"type": "http.response.body"})
+        self.assertEqual(
+            b"".join(message.get("body", b"") for message in messages[1:]),
+            expected)
+        self.assertIn(b"Flour (g)", expected)
+
+
+class TestPopulateDB(APITestCase):
+
+    def testLoadCatalogueAndRecipes(self):
+        recipes = [
+            {
+                "author": {"username": f"author{index % 2}",
+                           "email": f"author{index % 2}@example.com",
+                           "first_name": "author",
+                           "last_name": "author"},
+                "name": f"recipe {index}",
+                "text": "description",
+                "image": "recipe_images/test.png",
+                "cooking_time": 10,
+                "tags": ["breakfast"],
+                "ingredients": [
+                    {"name": "flour", "measurement_unit": "g", "amount": 2},
+                    {"name": "salt", "measurement_unit": "g", "amount": 1},
+                    {"name": "flour", "measurement_unit": "g", "amount": 3},
+                ],
+            }
+            for index in range(5)
+        ]
+        with tempfile.TemporaryDirectory() as data_dir:
+            tags_path = os.path.join(data_dir, "tags.csv")
+            with open(tags_path, "w") as tags_file:
+                tags_file.write("name,color,slug\n")
+                tags_file.write("breakfast,#E26C2D,breakfast\n")
+            ingredients_path = os.path.join(data_dir, "ingredients.json")
+            with open(ingredients_path, "w") as ingredients_file:
+                json.dump([{"name": "flour", "measurement_unit": "g"},
+                           {"name": "sugar", "measurement_unit": "kg"}],
+                          ingredients_file)
+            recipes_path = os.path.join(data_dir, "recipes.ndjson")
+            with open(recipes_path, "w") as recipes_file:
+                for recipe in recipes:
+                    recipes_file.write(f"{json.dumps(recipe)}\n")
+
+            for _ in range(2):
+                call_command(
+                    "populate_db",
+                    tags=tags_path,
+                    ingredients=ingredients_path,
+                    batch_size=2,
+                    stdout=io.StringIO(),
+                )
+            for _ in range(2):
+                call_command("populate_db", recipes=recipes_path,
+                             batch_size=2, stdout=io.StringIO())
+
+        self.assertEqual(Tag.objects.count(), 1)
+        self.assertEqual(MeasurementUnit.objects.count(), 2)
+        self.assertEqual(Ingredient.objects.count(), 3)
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(Recipe.objects.count(), 5)
+        self.assertEqual(Recipe.tags.through.objects.count(), 5)
+        self.assertEqual(RecipeIngredient.objects.filter(
+            ingredient__name="salt", amount=1).count(), 5)
+        self.assertEqual(RecipeIngredient.objects.filter(
+            ingredient__name="flour", amount=5).count(), 5)
+        self.assertEqual(
+            User.objects.get(username="author0").recipes_count, 3)
+
+    def testRejectUnknownAuthors(self):
+        User.objects.create(username="author", email="author@example.com")
+        cases = (
+            # new author without email
+            [{"username": "anonymous"}],
+            # email of another user
+            [{"username": "other", "email": "author@example.com"}],
+            [{"username": "first", "email": "same@example.com"},
+             {"username": "second", "email": "same@example.com"}],
+        )
+        with tempfile.TemporaryDirectory() as data_dir:
+            recipes_path = os.path.join(data_dir, "recipes.ndjson")
+            for authors in cases:
+                with open(recipes_path, "w") as recipes_file:
+                    for index, author in enumerate(
+                            [{"username": "author"}, *authors]):
+                        recipes_file.write(json.dumps({
+                            "author": author,
+                            "name": f"recipe {index}",
+                            "cooking_time": 10,
+                        }) + "\n")
+                with self.assertRaises(CommandError):
+                    call_command("populate_db", recipes=recipes_path,
+                                 stdout=io.StringIO())
+        self.assertEqual(User.objects.count(), 1)
+        self.assertFalse(Recipe.objects.exists())
+
+    def testExplainQueries(self):
+        self.assertEqual(find_plan_issues([
+            "Limit  (cost=0.28..1.02 rows=7 width=88)",
+            "  ->  Sort  (cost=10.5..11.2 rows=300 width=88)",
+            "        Sort Key: recipes_recipe.publication_date DESC",
+            "        ->  Seq Scan on recipes_recipe  (cost=0.00..9.00)",
+            "              ->  Seq Scan on recipes_tag  (cost=0.00..1.01)",
+        ], SMALL_TABLES), [
+            "Sort Key: recipes_recipe.publication_date DESC",
+            "Seq Scan on recipes_recipe",
+        ])
+
+        call_command("generate_synthetic_data", users=20, recipes=50, tags=3,
+                     follows_per_user=5, favorites_per_user=5, cart_size=3,
+                     seed=1, stdout=io.StringIO())
+        cache.set("server-entry", 1)
+        with tempfile.TemporaryDirectory() as data_dir:
+            baseline_path = os.path.join(data_dir, "baseline.json")
+            call_command("explain_queries", baseline=baseline_path,
+                         save_baseline=True, stdout=io.StringIO())
+            # the cache is shared with running servers
+            self.assertEqual(cache.get("server-entry"), 1)
+            with open(baseline_path) as baseline_file:
+                baseline = json.load(baseline_file)
+            self.assertEqual(set(baseline), set(ENDPOINTS))
+            self.assertNotIn("SCAN recipes_recipe",
+                             baseline["/api/recipes/?cursor="])
+            call_command("explain_queries", baseline=baseline_path,
+                         fail_on_regression=True, stdout=io.StringIO())
+
+            for issues in baseline.values():
+                issues.clear()
+            with open(baseline_path, "w") as baseline_file:
+                json.dump(baseline, baseline_file)
+            with self.assertRaises(CommandError):
+                call_command("explain_queries", baseline=baseline_path,
+                             fail_on_regression=True, stdout=io.StringIO())
+
+    def testGenerateSyntheticDataAndRunBenchmark(self):
+        call_command("generate_synthetic_data", users=20, recipes=50, tags=3,
+                     follows_per_user=5, favorites_per_user=5, cart_size=3,
+                     seed=1, stdout=io.StringIO())
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Recipe.objects.count(), 50)
+        self.assertTrue(User.users_followed.through.objects.exists())
+        self.assertTrue(User.favorite_recipes.through.objects.exists())
+        self.assertTrue(User.shopping_cart.through.objects.exists())
+        self.assertEqual(
+            sum(Recipe.objects.values_list("favorites_count", flat=True)),
+            User.favorite_recipes.through.objects.count())
+
+        cache.set("server-entry", 1)
+        stderr = io.StringIO()
+        call_command("benchmark_recipe_rendering", limit=5, repeat=2,
+                     stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(stderr.getvalue(), "")
+        self.assertEqual(cache.get("server-entry"), 1)
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            baseline_path = os.path.join(data_dir, "baseline.json")
+            call_command("run_benchmark", requests=40, warmup=5, users=5,
+                         seed=1, baseline=baseline_path, save_baseline=True,
+                         stdout=io.StringIO())
+            with open(baseline_path) as baseline_file:
+                baseline = json.load(baseline_file)
+            for result in baseline.values():
+                self.assertEqual(
+                    set(result), {"requests", "p50", "p95", "p99", "queries"})
+
+            for result in baseline.values():
+                result["queries"] = 0.1
+            with open(baseline_path, "w") as baseline_file:
+                json.dump(baseline, baseline_file)
+            with self.assertRaises(CommandError):
+                call_command("run_benchmark", requests=40, warmup=5,
+                             users=5, seed=1, baseline=baseline_path,
+                             fail_on_regression=True, stdout=io.StringIO())
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+class TestReplicaRouter(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(  # type:ignore
+            username="reader", email="reader@example.com",
+            password="qwerty1990")
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name="recipe", text="description",
+            image="recipe_images/test.png", cooking_time=10)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+
+    def getReadDatabase(self, user, model=Recipe):
+        routing = RequestRouting()
+        if user is not None:
+            routing.use_replicas(user)
+        token = current_routing.set(routing)
+        try:
+            return ReplicaRouter().db_for_read(model)
+        finally:
+            current_routing.reset(token)
+
+    def testSafeReadsGoToReplica(self):
+        self.assertIsNone(self.getReadDatabase(None))
+        self.assertIn(self.getReadDatabase(self.user),
+                      settings.DATABASE_REPLICAS)
+        self.assertIn(self.getReadDatabase(AnonymousUser()),
+                      settings.DATABASE_REPLICAS)
+        self.assertIsNone(self.getReadDatabase(self.user, Token))
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertIsNone(self.getReadDatabase(self.user))
+
+        routing = RequestRouting()
+        routing.use_replicas(self.user)
+        token = current_routing.set(routing)
+        try:
+            database = ReplicaRouter().db_for_read(Recipe)
+            self.assertEqual(ReplicaRouter().db_for_read(Tag), database)
+            with read_from_primary():
+                self.assertIsNone(ReplicaRouter().db_for_read(Recipe))
+        finally:
+            current_routing.reset(token)
+        self.assertEqual(ReplicaRouter().db_for_write(Recipe), "default")
+
+    def testWritesPinUserToPrimary(self):
+        pin_to_primary(AnonymousUser())
+        pin_to_primary(self.user)
+        self.assertEqual(self.getReadDatabase(self.user), "default")
+        self.assertIn(self.getReadDatabase(AnonymousUser()),
+                      settings.DATABASE_REPLICAS)
+
+        cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token}")
+        response = self.client.post(f"/api/recipes/{self.recipe.pk}/favorite/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_201_CREATED)
+        self.assertTrue(is_pinned_to_primary(self.user))
+
+        cache.clear()
+        response = self.client.post(f"/api/recipes/{self.recipe.pk}/favorite/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(is_pinned_to_primary(self.user))
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "DB_REPLICAS is not set")
+class TestReplicaReads(APITestCase):
+    """Reads with a real replica, which never receives test data."""
+
+    databases = {"default", *settings.DATABASE_REPLICAS}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader = [
+            User.objects.create_user(  # type:ignore
+                username=name, email=f"{name}@example.com",
+                password="qwerty1990")
+            for name in ("author", "reader")
+        ]
+        cls.author_token = Token.objects.create(user=cls.author)
+        cls.reader_token = Token.objects.create(user=cls.reader)
+        Tag.objects.create(name="breakfast", color="#E26C2D",
+                           slug="breakfast")
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name="recipe", text="description",
+            image="recipe_images/test.png", cooking_time=10)
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, amount=5,
+            ingredient=Ingredient.objects.create(
+                name="flour",
+                measurement_unit=MeasurementUnit.objects.create(name="g")))
+        cls.reader.shopping_cart.add(cls.recipe)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.author_client = APIClient()
+        self.author_client.credentials(
+            HTTP_AUTHORIZATION=f"Token {self.author_token}")
+        self.reader_client = APIClient()
+        self.reader_client.credentials(
+            HTTP_AUTHORIZATION=f"Token {self.reader_token}")
+
+    def getCount(self, client, path):
+        response = client.get(path)
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_200_OK)
+        data = response.json()  # type:ignore
+        return len(data["results"] if "results" in data else data)
+
+    def testReadsGoToReplicaUntilUserWrites(self):
+        self.assertEqual(self.getCount(self.reader_client, "/api/recipes/"), 0)
+        self.assertEqual(self.getCount(self.reader_client, "/api/users/"), 0)
+
+        response = self.author_client.post(
+            f"/api/recipes/{self.recipe.pk}/shopping_cart/")
+        self.assertEqual(response.status_code,  # type:ignore
+                         status.HTTP_201_CREATED)
+        self.assertEqual(self.getCount(self.author_client, "/api/recipes/"), 1)
+        self.assertEqual(self.getCount(self.reader_client, "/api/recipes/"), 0)
+
+        # streamed after the middleware, from the same database
+        for client, expected in ((self.author_client, True),
+                                 (self.reader_client, False)):
+            response = client.get("/api/recipes/download_shopping_cart/")
+            self.assertEqual(b"Flour (g), 5" in b"".join(
+                response.streaming_content), expected)  # type:ignore
+
+        cache.clear()
+        self.assertEqual(self.getCount(self.author_client, "/api/recipes/"), 0)
+
+    def testCachedDataIsReadFromPrimary(self):
+        self.assertEqual(self.getCount(self.client, "/api/recipes/"), 1)
+        self.assertEqual(self.getCount(self.client, "/api/tags/"), 1)
+        self.assertEqual(self.getCount(self.client, "/api/users/"), 0)
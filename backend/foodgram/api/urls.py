@@ -1,9 +1,11 @@
+from django.conf import settings
 from django.urls import include, path
 from djoser import views as djoser_views
 from rest_framework import routers
 
+from .async_views import get_async_read_urls
 from .views import (CustomTokenCreateView, IngredientReadOnlyViewSet,
-                    RecipeModelViewSet, TagReadOnlyViewSet,
+                    RecipeModelViewSet, SQLStatisticsView, TagReadOnlyViewSet,
                     UserCreateListRetrieveViewSet)
 
 router = routers.DefaultRouter()
@@ -12,6 +14,10 @@ router.register(r"tags", TagReadOnlyViewSet)
 router.register(r"ingredients", IngredientReadOnlyViewSet)
 router.register(r"recipes", RecipeModelViewSet, basename="Recipe")
 
+router_urls = router.urls
+if settings.ASYNC_READ_VIEWS:
+    router_urls = get_async_read_urls(router_urls)
+
 
 app_name = "api"
 
@@ -26,5 +32,6 @@ urlpatterns = [
         djoser_views.TokenDestroyView.as_view(),
         name="logout"
     ),
-    path("", include(router.urls)),
+    path("sql-stats/", SQLStatisticsView.as_view(), name="sql-stats"),
+    path("", include(router_urls)),
 ]
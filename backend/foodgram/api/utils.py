@@ -1,43 +1,246 @@
+import csv
+import json
+from collections import defaultdict
+from operator import attrgetter
+
+from django.db import transaction
+from django.db.models import CharField, Exists, F, OuterRef, Value, Window
+from django.db.models.functions import Concat, Lower, RowNumber, Substr, Upper
 from django.shortcuts import get_object_or_404
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from recipes.models import Recipe, RecipeIngredient  # isort:skip
+from .caching import get_user_interactions, invalidate_user_interactions
+
+from recipes.models import (Recipe, RecipeIngredient,  # isort:skip
+                            ShoppingListItem)
+from recipes.shopping_list import refresh_recipe_shopping_lists  # isort:skip
+
+
+def set_prefetched_objects(instance, related_name, objects):
+    """Fill prefetch cache of the relation as prefetch_related() does."""
+    prefetched = instance.__dict__.setdefault("_prefetched_objects_cache", {})
+    prefetched.pop(related_name, None)
+    queryset = getattr(instance, related_name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    prefetched[related_name] = queryset
+
+
+def set_recipe_tags(recipe, tags):
+    """Make recipe tags match given ones, touching changed rows only.
 
+    Rows of the through table are written directly, cache of recipe
+    content is invalidated by saving the recipe itself.
+    """
+    current_ids = {tag.pk for tag in recipe.tags.all()}
+    new_tags = {tag.pk: tag for tag in tags}
+    recipe_tag_model = Recipe.tags.through
 
-def add_ingredients_to_recipe(recipe, ingredient_data):
-    recipe_ingredients = []
+    removed_ids = current_ids - new_tags.keys()
+    if removed_ids:
+        recipe_tag_model.objects.filter(
+            recipe=recipe, tag_id__in=removed_ids).delete()
+    added_ids = new_tags.keys() - current_ids
+    if added_ids:
+        recipe_tag_model.objects.bulk_create(
+            recipe_tag_model(recipe_id=recipe.pk, tag_id=tag_id)
+            for tag_id in added_ids
+        )
+    set_prefetched_objects(
+        recipe, "tags", sorted(new_tags.values(), key=attrgetter("pk")))
+
+
+def set_recipe_ingredients(recipe, ingredient_data):
+    """Make recipe ingredients match given ones, touching changed rows only.
+
+    Every kind of change costs a single query however many rows it has.
+    """
+    current = {
+        recipe_ingredient.ingredient_id: recipe_ingredient
+        for recipe_ingredient in recipe.recipe_ingredients.all()
+    }
+    kept, changed, created = [], [], []
     for ingredient_dict in ingredient_data:
         ingredient = ingredient_dict["id"]
         amount = ingredient_dict["amount"]
-        recipe_ingredient = RecipeIngredient(
-            recipe=recipe, ingredient=ingredient, amount=amount
-        )
-        recipe_ingredients.append(recipe_ingredient)
-    RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        recipe_ingredient = current.pop(ingredient.pk, None)
+        if recipe_ingredient is None:
+            created.append(RecipeIngredient(
+                recipe=recipe, ingredient=ingredient, amount=amount))
+            continue
+        recipe_ingredient.ingredient = ingredient
+        if recipe_ingredient.amount != amount:
+            recipe_ingredient.amount = amount
+            changed.append(recipe_ingredient)
+        kept.append(recipe_ingredient)
+
+    if current:
+        RecipeIngredient.objects.filter(
+            pk__in=[row.pk for row in current.values()]).delete()
+    if changed:
+        RecipeIngredient.objects.bulk_update(changed, ("amount",))
+    if created:
+        RecipeIngredient.objects.bulk_create(created)
+    # bulk operations send no signals, carts holding the recipe
+    # are refreshed for touched ingredients explicitly
+    refresh_recipe_shopping_lists(recipe.pk, {
+        row.ingredient_id for row in (*current.values(), *changed, *created)
+    })
+    set_prefetched_objects(
+        recipe, "recipe_ingredients",
+        sorted(kept + created, key=attrgetter("pk")))
 
 
 def get_annotated_recipe_instance(instance, request):
-    instance.author.is_subscribed = request.user.users_followed.filter(
-        pk=instance.author.pk).exists()
-    instance.is_favorited = request.user.favorite_recipes.filter(
-        pk=instance.pk).exists()
-    instance.is_in_shopping_cart = request.user.shopping_cart.filter(
-        pk=instance.pk).exists()
+    interactions = get_user_interactions(request.user)
+    instance.author.is_subscribed = (
+        instance.author.pk in interactions.users_followed)
+    instance.is_favorited = instance.pk in interactions.favorite_recipes
+    instance.is_in_shopping_cart = instance.pk in interactions.shopping_cart
     return instance
 
 
-def get_shopping_cart_ingredient_list_string(ingredients):
-    strings = []
-    strings.append("Ingredient, amount")
-    strings.append("------------------")
+def annotate_followed_authors(queryset):
+    # all users in queryset are followed,
+    # no need to annotate with explicit query
+    return queryset.annotate(is_subscribed=Value(True))
+
+
+def get_authors_recipes_queryset(authors, recipes_limit=None):
+    """Return recipes of given authors, latest first.
+
+    Recipes of all authors are fetched in a single query. When
+    recipes_limit is set, only the latest recipes of every author are
+    selected with ROW_NUMBER() OVER (PARTITION BY author).
+    """
+    recipes = Recipe.objects.filter(
+        author__in=[author.pk for author in authors]
+    ).only("author", "name", "image", "image_variants", "cooking_time",
+           "publication_date")
+
+    if recipes_limit:
+        recipes = recipes.annotate(recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=F("author"),
+            order_by=(F("publication_date").desc(), F("pk").desc()),
+        ))
+        sql, params = recipes.query.sql_with_params()
+        return Recipe.objects.raw(
+            f"SELECT * FROM ({sql}) ranked_recipes "
+            "WHERE ranked_recipes.recipe_rank <= %s "
+            "ORDER BY ranked_recipes.publication_date DESC, "
+            "ranked_recipes.id DESC",
+            (*params, recipes_limit)
+        )
+    return recipes
+
+
+def group_recipes_by_author(recipes):
+    author_recipes = defaultdict(list)
+    for recipe in recipes:
+        author_recipes[recipe.author_id].append(recipe)
+    return author_recipes
+
+
+def get_authors_recipes(authors, recipes_limit=None):
+    """Return recipes of given authors as {author pk: [recipes]}."""
+    return group_recipes_by_author(
+        get_authors_recipes_queryset(authors, recipes_limit))
+
+
+def get_shopping_cart_ingredients(user):
+    """Return (name, total amount) rows of ingredients in shopping cart.
 
-    for ingredient in ingredients:
-        name = ingredient.get("ingredient_name")
-        amount = ingredient.get("total_amount")
-        line = f"{name.capitalize()}, {amount}"  # type:ignore
-        strings.append(line)
-    return "\n".join(strings)
+    Amounts are read from the user's maintained shopping list, names
+    are formatted as 'Name (unit)' by the database, rows come ordered
+    by name.
+    """
+    ingredient_name = Concat(
+        Upper(Substr("ingredient__name", 1, 1)),
+        Lower(Substr("ingredient__name", 2)),
+        Value(" ("),
+        Lower("ingredient__measurement_unit__name"),
+        Value(")"),
+        output_field=CharField(),
+    )
+    return (
+        ShoppingListItem.objects
+                        .filter(user=user)
+                        .annotate(ingredient_name=ingredient_name)
+                        .order_by("ingredient_name")
+                        .values_list("ingredient_name", "total_amount")
+    )
+
+
+def write_shopping_cart_txt(ingredients):
+    yield "Ingredient, amount\n"
+    yield "------------------\n"
+    for name, amount in ingredients:
+        yield f"{name}, {amount}\n"
+
+
+class EchoBuffer:
+    def write(self, value):
+        return value
+
+
+def write_shopping_cart_csv(ingredients):
+    writer = csv.writer(EchoBuffer())
+    yield writer.writerow(("ingredient", "amount"))
+    for row in ingredients:
+        yield writer.writerow(row)
+
+
+def write_shopping_cart_json(ingredients):
+    separator = ""
+    yield "["
+    for name, amount in ingredients:
+        item = json.dumps({"ingredient": name, "amount": amount},
+                          ensure_ascii=False)
+        yield f"{separator}{item}"
+        separator = ","
+    yield "]"
+
+
+SHOPPING_CART_FILE_FORMATS = {
+    "txt": ("text/plain", write_shopping_cart_txt),
+    "csv": ("text/csv", write_shopping_cart_csv),
+    "json": ("application/json", write_shopping_cart_json),
+}
+
+
+def get_search_terms(request, search_param):
+    params = request.query_params.get(search_param, "")
+    params = params.replace("\x00", "").replace(",", " ")
+    return params.split()
+
+
+def get_field_names_param(request, param, allowed_names):
+    """Return set of comma separated field names or None when not given."""
+    if param not in request.query_params:
+        return None
+    names = set(get_search_terms(request, param))
+    unknown_names = names.difference(allowed_names)
+    if unknown_names:
+        raise ValidationError({
+            param: f"Unknown fields: {', '.join(sorted(unknown_names))}."
+        })
+    return names
+
+
+def get_positive_int_param(request, param):
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise ValidationError({param: "Positive integer expected."})
+    return value
 
 
 def process_recipe_for_shopping_cart(pk, request, serializer_class):
@@ -47,6 +250,7 @@ def process_recipe_for_shopping_cart(pk, request, serializer_class):
     if request.method == "POST":
         if not request.user.shopping_cart.filter(pk=recipe.pk).exists():
             request.user.shopping_cart.add(recipe)
+            invalidate_user_interactions(request.user)
             serializer = serializer_class(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         err_msg.update({"errors": "Recipe already in shopping_cart."})
@@ -54,6 +258,7 @@ def process_recipe_for_shopping_cart(pk, request, serializer_class):
     if request.method == "DELETE":
         if request.user.shopping_cart.filter(pk=recipe.pk).exists():
             request.user.shopping_cart.remove(recipe)
+            invalidate_user_interactions(request.user)
             return Response(status=status.HTTP_204_NO_CONTENT)
         err_msg.update({"errors": "No such recipe in shopping cart."})
 
@@ -67,6 +272,7 @@ def process_recipe_for_favorite(pk, request, serializer_class):
     if request.method == "POST":
         if not request.user.favorite_recipes.filter(pk=recipe.pk).exists():
             request.user.favorite_recipes.add(recipe)
+            invalidate_user_interactions(request.user)
             serializer = serializer_class(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         err_msg.update({"errors": "Recipe already in favorites."})
@@ -74,7 +280,52 @@ def process_recipe_for_favorite(pk, request, serializer_class):
     if request.method == "DELETE":
         if request.user.favorite_recipes.filter(pk=recipe.pk).exists():
             request.user.favorite_recipes.remove(recipe)
+            invalidate_user_interactions(request.user)
             return Response(status=status.HTTP_204_NO_CONTENT)
         err_msg.update({"errors": "No such recipe in favorites."})
 
     return Response(err_msg, status=status.HTTP_400_BAD_REQUEST)
+
+
+def process_recipe_batch(request, relation_name, serializer_class):
+    """Add or remove listed recipes to user's favorites or shopping cart.
+
+    Existence and membership of all recipes are fetched with one query,
+    changes are applied with one bulk insert or delete of the related
+    manager, so query count doesn't depend on number of recipes.
+    """
+    serializer = serializer_class(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    action = serializer.validated_data["action"]
+    recipe_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+    manager = getattr(request.user, relation_name)
+
+    linked = Exists(manager.through.objects.filter(
+        user=request.user, recipe=OuterRef("pk")))
+    with transaction.atomic():
+        is_linked = dict(
+            Recipe.objects.filter(pk__in=recipe_ids)
+                          .order_by()
+                          .annotate(linked=linked)
+                          .values_list("pk", "linked")
+        )
+        if action == "add":
+            changed_ids = {pk for pk, value in is_linked.items() if not value}
+            manager.add(*changed_ids)
+        else:
+            changed_ids = {pk for pk, value in is_linked.items() if value}
+            manager.remove(*changed_ids)
+    if changed_ids:
+        invalidate_user_interactions(request.user)
+
+    changed_status = "added" if action == "add" else "removed"
+    results = []
+    for pk in recipe_ids:
+        if pk not in is_linked:
+            result_status = "not_found"
+        elif pk in changed_ids:
+            result_status = changed_status
+        else:
+            result_status = "unchanged"
+        results.append({"id": pk, "status": result_status})
+    return Response({"results": results}, status=status.HTTP_200_OK)
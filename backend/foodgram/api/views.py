@@ -1,24 +1,41 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Exists, F, OuterRef, Prefetch, Q, Sum, Value
-from django.db.models.functions import Concat
-from django.http.response import HttpResponse
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Prefetch, Q, Value
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import TokenCreateView
-from rest_framework import mixins, status, viewsets
+from rest_framework import generics, mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
-
-from .filters import CustomOrderedIngredientSearchFilter
-from .pagination_classes import CustomPageSizeLimitPaginationClass
+from rest_framework.views import APIView
+
+from .caching import (get_recipe_response_cache_key, get_user_interactions,
+                      invalidate_user_interactions)
+from .db_routing import ReplicaReadMixin, read_from_primary
+from .filters import filter_recipes_by_tags, search_recipes
+from .middleware import sql_statistics
+from .pagination_classes import (CustomPageSizeLimitPaginationClass,
+                                 RecipeFeedPaginationClass,
+                                 RecipeKeysetPaginationClass)
 from .permissions import RecipeOwnerPermission
+from .recipe_rows import RecipeRowsBuilder
+from .reference_data import prerendered_ingredients, prerendered_tags
+from .renderers import FastJSONRenderer
+from .search_index import ingredient_search_index
 from .serializers import (FavoriteRecipeSerializer, IngredientSerializer,
-                          PasswordChangeSerializer, RecipeReadSerializer,
-                          RecipeWriteSerializer, SubscriptionSerializer,
-                          TagSerializer, UserCreationSerializer,
-                          UserListRetrieveSerializer)
-from .utils import (get_shopping_cart_ingredient_list_string,
+                          PasswordChangeSerializer, RecipeBatchSerializer,
+                          RecipeReadSerializer, RecipeWriteSerializer,
+                          SubscriptionSerializer, TagSerializer,
+                          UserCreationSerializer, UserListRetrieveSerializer)
+from .utils import (SHOPPING_CART_FILE_FORMATS, annotate_followed_authors,
+                    get_authors_recipes, get_field_names_param,
+                    get_positive_int_param, get_search_terms,
+                    get_shopping_cart_ingredients, process_recipe_batch,
                     process_recipe_for_favorite,
                     process_recipe_for_shopping_cart)
 from recipes.models import (Ingredient, Recipe, RecipeIngredient,  # isort:skip
@@ -26,8 +43,20 @@ from recipes.models import (Ingredient, Recipe, RecipeIngredient,  # isort:skip
 
 User = get_user_model()
 
+RECIPE_COLUMNS = ("author", "name", "image", "text", "cooking_time")
+EXPANDABLE_RECIPE_FIELDS = ("author", "tags")
+
+
+def get_recipe_ingredients_prefetch():
+    return Prefetch(
+        "recipe_ingredients",
+        queryset=RecipeIngredient.objects.select_related(
+            "ingredient__measurement_unit").all()
+    )
+
 
-class UserCreateListRetrieveViewSet(mixins.CreateModelMixin,
+class UserCreateListRetrieveViewSet(ReplicaReadMixin,
+                                    mixins.CreateModelMixin,
                                     mixins.ListModelMixin,
                                     mixins.RetrieveModelMixin,
                                     viewsets.GenericViewSet):
@@ -82,23 +111,22 @@ class UserCreateListRetrieveViewSet(mixins.CreateModelMixin,
 
     @action(detail=False, methods=["get"])
     def subscriptions(self, request):
-        queryset = request.user.users_followed.all()
-        # all users in queryset are followed,
-        # no need to annotate with explicit query
-        queryset = queryset.annotate(is_subscribed=Value(True))
+        queryset = annotate_followed_authors(
+            request.user.users_followed.order_by("pk"))
         paginated_queryset = self.paginate_queryset(queryset)
-
-        recipes_limit = self.request.query_params.get(  # type:ignore
-            "recipes_limit")
-        context = {}
-        if recipes_limit:
-            context.update({"recipes_limit": int(recipes_limit)})
-
         serializer = SubscriptionSerializer(
-            paginated_queryset, many=True, context=context
+            paginated_queryset,
+            many=True,
+            context=self.get_subscription_context(paginated_queryset)
         )
         return self.get_paginated_response(serializer.data)
 
+    def get_subscription_context(self, authors):
+        recipes_limit = self.request.query_params.get(  # type:ignore
+            "recipes_limit")
+        recipes_limit = int(recipes_limit) if recipes_limit else None
+        return {"author_recipes": get_authors_recipes(authors, recipes_limit)}
+
     @action(detail=True, methods=["post"])
     def subscribe(self, request, pk):
         user_to_subscribe = get_object_or_404(User, pk=pk)
@@ -116,15 +144,13 @@ class UserCreateListRetrieveViewSet(mixins.CreateModelMixin,
             return Response(err_msg, status=status.HTTP_400_BAD_REQUEST)
 
         request.user.users_followed.add(user_to_subscribe)
-        # need to refresh annotated field through calling 'self.get_queryset()'
-        user_to_subscribe = self.get_object()
-
-        recipes_limit = self.request.query_params.get(  # type:ignore
-            "recipes_limit")
-        context = {}
-        if recipes_limit:
-            context.update({"recipes_limit": int(recipes_limit)})
-        serializer = SubscriptionSerializer(user_to_subscribe, context=context)
+        invalidate_user_interactions(request.user)
+        user_to_subscribe = annotate_followed_authors(
+            User.objects.filter(pk=user_to_subscribe.pk)).get()
+        serializer = SubscriptionSerializer(
+            user_to_subscribe,
+            context=self.get_subscription_context((user_to_subscribe,))
+        )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
@@ -142,6 +168,7 @@ class UserCreateListRetrieveViewSet(mixins.CreateModelMixin,
             return Response(err_msg, status=status.HTTP_400_BAD_REQUEST)
 
         request.user.users_followed.remove(user_to_unsubscribe)
+        invalidate_user_interactions(request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -153,82 +180,84 @@ class CustomTokenCreateView(TokenCreateView):
         return response
 
 
-class TagReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+class SQLStatisticsView(APIView):
+    """Rolling per-view SQL summary collected by SQLAccountingMiddleware."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(sql_statistics.get_summary())
+
+    def delete(self, request):
+        sql_statistics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TagReadOnlyViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = (AllowAny,)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return prerendered_tags.get_response(request)
+
 
-class IngredientReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientReadOnlyViewSet(ReplicaReadMixin,
+                                viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.select_related("measurement_unit").all()
     permission_classes = (AllowAny,)
     pagination_class = None
-    filter_backends = (CustomOrderedIngredientSearchFilter,)
-    search_fields = ("name",)
+    search_param = "name"
+
+    def list(self, request, *args, **kwargs):
+        if self.search_param not in request.query_params:
+            return prerendered_ingredients.get_response(request)
+        search_terms = get_search_terms(request, self.search_param)
+        limit = get_positive_int_param(request, "limit")
+        return Response(
+            ingredient_search_index.search(search_terms, limit),
+            status=status.HTTP_200_OK
+        )
 
 
-class RecipeModelViewSet(viewsets.ModelViewSet):
+class RecipeModelViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', ]
-    pagination_class = CustomPageSizeLimitPaginationClass
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+    pagination_class = RecipeKeysetPaginationClass
     filter_backends = (DjangoFilterBackend, )
     filterset_fields = ("author",)
+    interactions = None
 
     def get_queryset(self):
-        prefetch_ingredients = Prefetch(
-            "recipe_ingredients",
-            queryset=RecipeIngredient.objects.select_related(
-                "ingredient__measurement_unit").all()
-        )
-
-        if self.request.user.is_anonymous:
-            authors = User.objects.annotate(is_subscribed=Value(False))
+        if self.action in ("list", "retrieve", "feed"):
+            if settings.RECIPE_FAST_READ_PATH:
+                # related rows are fetched by RecipeRowsBuilder
+                query = Recipe.objects.all()
+            else:
+                query = self.get_sparse_queryset()
         else:
-            authors = User.objects.annotate(
-                is_subscribed=Exists(
-                    self.request.user.users_followed.filter(  # type:ignore
-                        pk=OuterRef("pk")
-                    )
-                ))
-        prefetch_authors = Prefetch("author", queryset=authors)
-        query = (
-            Recipe.objects
-                  .prefetch_related("tags")
-                  .prefetch_related(prefetch_authors)
-                  .prefetch_related(prefetch_ingredients)
-        )
+            query = Recipe.objects.prefetch_related(
+                "tags", "author", get_recipe_ingredients_prefetch())
 
-        if self.request.user.is_anonymous:
-            query = query.annotate(is_favorited=Value(False))
-        else:
-            query = query.annotate(
-                is_favorited=Exists(
-                    self.request.user.favorite_recipes.filter(  # type:ignore
-                        pk=OuterRef("pk")
-                    ))
-            )
-
-        if self.request.user.is_anonymous:
-            query = query.annotate(is_in_shopping_cart=Value(False))
-        else:
-            query = query.annotate(
-                is_in_shopping_cart=Exists(
-                    self.request.user.shopping_cart.filter(  # type:ignore
-                        pk=OuterRef("pk")
-                    ))
-            )
+        if self.action == "feed":
+            followed_authors = User.users_followed.through.objects.filter(
+                from_user=self.request.user).values("to_user")
+            query = query.filter(author__in=followed_authors)
 
         tag_slugs = self.request.query_params.getlist("tags")  # type:ignore
+        query = filter_recipes_by_tags(query, tag_slugs)
+        query = search_recipes(
+            query, get_search_terms(self.request, "search"))
+
         q_object = Q()
-        for tag_slug in tag_slugs:
-            q_object |= Q(tags__slug=tag_slug)
+        interactions = self.get_interactions()
 
         is_favorited_param = self.request.query_params.get(  # type:ignore
             "is_favorited", 0)
         is_favorited_param = bool(int(is_favorited_param))
         if is_favorited_param:
-            q_object &= Q(is_favorited=is_favorited_param)
+            q_object &= Q(pk__in=interactions.favorite_recipes)
 
         is_in_shopping_cart_param = (
             self.request.query_params.get(  # type:ignore
@@ -236,9 +265,105 @@ class RecipeModelViewSet(viewsets.ModelViewSet):
         )
         is_in_shopping_cart_param = bool(int(is_in_shopping_cart_param))
         if is_in_shopping_cart_param:
-            q_object &= Q(is_in_shopping_cart=is_in_shopping_cart_param)
+            q_object &= Q(pk__in=interactions.shopping_cart)
+
+        return query.filter(q_object)
+
+    def get_interactions(self):
+        # read once per request, async views set it beforehand
+        if self.interactions is None:
+            self.interactions = get_user_interactions(self.request.user)
+        return self.interactions
+
+    def get_fieldset(self):
+        """Return (fields, expand) sets requested by query params.
+
+        Without 'fields' the full representation is returned. With it,
+        relations not listed in 'expand' are represented by pks.
+        """
+        fields = get_field_names_param(
+            self.request, "fields", RecipeReadSerializer.Meta.fields)
+        expand = get_field_names_param(
+            self.request, "expand", EXPANDABLE_RECIPE_FIELDS)
+        if fields is None:
+            fields = set(RecipeReadSerializer.Meta.fields)
+            expand = set(EXPANDABLE_RECIPE_FIELDS)
+        return fields, expand or set()
+
+    def get_sparse_queryset(self):
+        # only columns and relations shown in response are fetched,
+        # interaction flags come from cached per-user ID sets,
+        # see 'get_serializer_context'
+        fields, expand = self.get_fieldset()
+        columns = {"id", "publication_date"}
+        columns.update(fields.intersection(RECIPE_COLUMNS))
+        if "image" in fields:
+            columns.add("image_variants")
+        prefetches = []
+        if "tags" in fields:
+            prefetches.append("tags" if "tags" in expand else Prefetch(
+                "tags", queryset=Tag.objects.only("id")))
+        if "author" in fields and "author" in expand:
+            prefetches.append("author")
+        if "ingredients" in fields:
+            prefetches.append(get_recipe_ingredients_prefetch())
+        return Recipe.objects.only(*columns).prefetch_related(*prefetches)
+
+    def list(self, request, *args, **kwargs):
+        handler = super().list
+        if settings.RECIPE_FAST_READ_PATH:
+            handler = self.list_rows
+        return self.get_cached_response(handler, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = super().retrieve
+        if settings.RECIPE_FAST_READ_PATH:
+            handler = self.retrieve_row
+        return self.get_cached_response(handler, request, *args, **kwargs)
+
+    def list_rows(self, request, *args, **kwargs):
+        builder = RecipeRowsBuilder(self.get_serializer_context())
+        rows = builder.get_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(builder.build(rows))
+        return self.get_paginated_response(builder.build(page))
+
+    def retrieve_row(self, request, *args, **kwargs):
+        builder = RecipeRowsBuilder(self.get_serializer_context())
+        rows = builder.get_rows(self.filter_queryset(self.get_queryset()))
+        row = generics.get_object_or_404(rows, pk=self.kwargs["pk"])
+        self.check_object_permissions(request, row)
+        return Response(builder.build([row])[0])
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        # anonymous responses are the same for everyone,
+        # so they are cached until recipe content changes
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+
+        cache_key = get_recipe_response_cache_key(request)
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data, status=status.HTTP_200_OK)
+
+        # a lagging replica would be cached under the current version
+        with read_from_primary():
+            response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, response.data,
+                      settings.RECIPE_RESPONSE_CACHE_TIMEOUT)
+        return response
 
-        return query.filter(q_object).distinct()
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["interactions"] = self.get_interactions()
+        if self.action in ("list", "feed"):
+            context["image_variant"] = "card"
+        if self.action in ("list", "retrieve", "feed"):
+            context["recipe_fields"], context["recipe_expand"] = (
+                self.get_fieldset())
+        return context
 
     def get_permissions(self):
         action_list = ("list", "retrieve",)
@@ -249,7 +374,7 @@ class RecipeModelViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permissions]
 
     def get_serializer_class(self):
-        read_actions = ("list", "retrieve",)
+        read_actions = ("list", "retrieve", "feed",)
         write_actions = ("create", "partial_update",)
         if self.action in read_actions:
             return RecipeReadSerializer
@@ -257,9 +382,23 @@ class RecipeModelViewSet(viewsets.ModelViewSet):
             return RecipeWriteSerializer
         return super().get_serializer_class()
 
+    def update(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # unlike UpdateModelMixin, prefetch caches are kept:
+        # serializer refills them with rows it has written
+        self.perform_update(serializer)
+        return Response(serializer.data)
+
     def partial_update(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
 
+    @action(detail=False, methods=["get"],
+            pagination_class=RecipeFeedPaginationClass)
+    def feed(self, request):
+        return self.list(request)
+
     @action(detail=False, methods=["get"], url_path="favorite")
     def favorite_list(self, request):
         author = request.query_params.get("author")
@@ -281,6 +420,18 @@ class RecipeModelViewSet(viewsets.ModelViewSet):
             pk, request, FavoriteRecipeSerializer
         )
 
+    @action(detail=False, methods=["post"], url_path="favorite/batch")
+    def favorite_batch(self, request):
+        return process_recipe_batch(
+            request, "favorite_recipes", RecipeBatchSerializer
+        )
+
+    @action(detail=False, methods=["post"], url_path="shopping_cart/batch")
+    def shopping_cart_batch(self, request):
+        return process_recipe_batch(
+            request, "shopping_cart", RecipeBatchSerializer
+        )
+
     @action(detail=False, methods=["get"], url_path="show_shopping_cart")
     def show_shopping_cart(self, request):
         queryset = request.user.shopping_cart.all()
@@ -289,25 +440,21 @@ class RecipeModelViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["get"], url_path="download_shopping_cart")
     def download_shopping_cart(self, request):
-        recipes = request.user.shopping_cart.all()
-        ingredients = (
-            RecipeIngredient.objects
-                            .filter(recipe__in=recipes)
-                            .select_related(
-                                "ingredient", "ingredient__measurement_unit"
-                            ).all())
-        ingredients = ingredients.values("ingredient").annotate(
-            total_amount=Sum("amount")).annotate(
-                ingredient_name=Concat(
-                    F("ingredient__name"),
-                    Value(" ("),
-                    F("ingredient__measurement_unit__name"),
-                    Value(")")
-                )).all()
-
-        content = get_shopping_cart_ingredient_list_string(ingredients)
-        filename = "shopping_cart.txt"
-        response = HttpResponse(content, content_type="text/plain")
+        file_format = request.query_params.get("file_format", "txt")
+        if file_format not in SHOPPING_CART_FILE_FORMATS:
+            raise ValidationError({
+                "file_format": (
+                    "Supported formats: "
+                    f"{', '.join(SHOPPING_CART_FILE_FORMATS)}."
+                )
+            })
+        content_type, writer = SHOPPING_CART_FILE_FORMATS[file_format]
+        ingredients = get_shopping_cart_ingredients(request.user).iterator(
+            chunk_size=settings.SHOPPING_CART_DOWNLOAD_CHUNK_SIZE)
+
+        filename = f"shopping_cart.{file_format}"
+        response = StreamingHttpResponse(
+            writer(ingredients), content_type=content_type)
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
@@ -1,7 +1,69 @@
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+# parts of a streaming response pulled from its iterator at once
+STREAMING_BATCH_SIZE = 500
+
+
+def read_parts(parts):
+    batch = []
+    for part in parts:
+        batch.append(part)
+        if len(batch) == STREAMING_BATCH_SIZE:
+            break
+    return batch
+
+
+def get_response_headers(response):
+    # the same as headers of 'ASGIHandler.send_response'
+    headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode("ascii")
+        if isinstance(value, str):
+            value = value.encode("latin1")
+        headers.append((bytes(header), bytes(value)))
+    for cookie in response.cookies.values():
+        headers.append(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip()))
+    return headers
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGI handler iterating streaming responses off the event loop.
+
+    Django 4.1 iterates them in the event loop, where a body read from
+    the database raises SynchronousOnlyOperation. Here parts are pulled
+    in batches by the thread running sync code of the request, so the
+    body is sent as it is produced, using the request's connection.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": get_response_headers(response),
+        })
+        parts = iter(response)
+        while True:
+            batch = await sync_to_async(read_parts)(parts)
+            for chunk, _ in self.chunk_bytes(b"".join(batch)):
+                if chunk:
+                    await send({"type": "http.response.body",
+                                "body": chunk, "more_body": True})
+            if len(batch) < STREAMING_BATCH_SIZE:
+                break
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close)()
+
+
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
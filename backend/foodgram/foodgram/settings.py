@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -25,7 +26,6 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
-    "debug_toolbar",
     "rest_framework",
     "corsheaders",
     "rest_framework.authtoken",
@@ -38,6 +38,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.SQLAccountingMiddleware",
+    "api.middleware.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -46,9 +48,12 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
@@ -84,6 +89,50 @@ DATABASES = {
     }
 }
 
+# Read replicas, comma-separated: "host" or "host:port" of PostgreSQL
+# replicas sharing credentials of the primary, database files for SQLite.
+# Safe-method reads of API views go to them, see 'api.db_routing'.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(
+        filter(None, os.getenv("DB_REPLICAS", "").split(",")), start=1):
+    replica = replica.strip()
+    if DATABASES["default"]["ENGINE"].endswith("sqlite3"):
+        replica_settings = {"NAME": replica}
+    else:
+        host, _, port = replica.partition(":")
+        replica_settings = {
+            "HOST": host, "PORT": port or DATABASES["default"]["PORT"]}
+    DATABASES[f"replica{number}"] = {
+        **DATABASES["default"], **replica_settings}
+    DATABASE_REPLICAS.append(f"replica{number}")
+
+DATABASE_ROUTERS = ["api.db_routing.ReplicaRouter"]
+
+# Reads of a user stay on the primary this many seconds after their write
+REPLICA_PIN_TIMEOUT = 10
+
+# Data versions are kept in the default cache, so it has to be shared
+# by all processes, see 'api.checks'. Files are shared by processes of
+# one host, several hosts need memcached or Redis.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache"
+        ),
+        "LOCATION": os.getenv(
+            "CACHE_LOCATION",
+            os.path.join(tempfile.gettempdir(), "foodgram-cache")
+        ),
+    }
+}
+if CACHES["default"]["BACKEND"].endswith(".FileBasedCache"):
+    # culling drops random entries, keep it rare
+    CACHES["default"]["OPTIONS"] = {"MAX_ENTRIES": 10000}
+
+# Tests run with a cache of their own, see 'foodgram.test_runner'
+TEST_RUNNER = "foodgram.test_runner.TestRunner"
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -121,19 +170,21 @@ LOGGING = {
             "class": "logging.StreamHandler",
         },
     },
-    "loggers": {
-        "django.db.backends": {
-            "level": "DEBUG",
-            "handlers": ["console"],
-        }
-    }
+    "root": {
+        "handlers": ["console"],
+        "level": "WARNING",
+    },
 }
 
+SQL_STATS_WINDOW = 100
+SQL_STATS_SLOWEST_STATEMENTS = 5
+SQL_STATS_REPEATED_THRESHOLD = 5
+
 AUTH_USER_MODEL = "users.User"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -179,3 +230,38 @@ CSRF_TRUSTED_ORIGINS = [
     "http://uperenko.ddns.net",
     "https://uperenko.ddns.net",
 ]
+
+USER_INTERACTIONS_CACHE_TIMEOUT = 60 * 5
+
+SHOPPING_CART_DOWNLOAD_CHUNK_SIZE = 2000
+
+RECIPE_BATCH_MAX_SIZE = 100
+
+# Render recipe list and detail from values() rows instead of serializers
+RECIPE_FAST_READ_PATH = True
+
+RECIPE_RESPONSE_CACHE_TIMEOUT = 60 * 10
+
+# Serve GET of hot read routes with async views, see 'api.async_views';
+# meant for ASGI servers, under WSGI every request would start an event loop
+ASYNC_READ_VIEWS = os.getenv("ASYNC_READ_VIEWS", "False") == "True"
+
+# Authenticated tokens are cached for TOKEN_AUTH_CACHE_TIMEOUT seconds in
+# the named Django cache shared by all workers; an empty name or a cache
+# local to a process selects a per-process LRU, where a deactivation
+# reaches other workers only when their entries expire
+TOKEN_AUTH_CACHE_SIZE = 1000
+TOKEN_AUTH_CACHE_TIMEOUT = 60
+TOKEN_AUTH_SHARED_CACHE = os.getenv(
+    "TOKEN_AUTH_SHARED_CACHE", "default") or None
+
+RECIPE_IMAGE_VARIANTS = {
+    "thumbnail": (320, 320),
+    "card": (800, 800),
+}
+
+RECIPE_IMAGE_WEBP_QUALITY = 80
+
+RECIPE_IMAGE_WORKERS = 2
+
+MEDIA_DELETION_BATCH_SIZE = 100
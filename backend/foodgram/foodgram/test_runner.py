@@ -0,0 +1,30 @@
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+FILE_BASED_CACHE = "django.core.cache.backends.filebased.FileBasedCache"
+
+
+class TestRunner(DiscoverRunner):
+    """Run tests with a cache of their own.
+
+    The default cache is shared with servers of the host, and tests
+    clear it. They get a file based cache in a temporary directory
+    instead, which is shared by processes as 'api.checks' require.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.TemporaryDirectory(
+            prefix="foodgram-test-cache-")
+        self.cache_settings = override_settings(CACHES={"default": {
+            "BACKEND": FILE_BASED_CACHE,
+            "LOCATION": self.cache_dir.name,
+        }})
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        self.cache_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
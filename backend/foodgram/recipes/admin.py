@@ -1,6 +1,12 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
 
+from .counters import change_counters
 from .models import Ingredient, MeasurementUnit, Recipe, Tag
+from .shopping_list import (get_recipe_ingredient_ids,
+                            refresh_recipe_shopping_lists)
+
+User = get_user_model()
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -65,11 +71,25 @@ class RecipeAdmin(admin.ModelAdmin):
         "tags__slug",
     )
     readonly_fields = (
-        "favorite_count",
+        "favorites_count",
+        "in_carts_count",
     )
 
-    def favorite_count(self, obj):
-        return obj.following_users.count()
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and "author" in form.changed_data:
+            change_counters(User, "recipes_count", {
+                form.initial["author"]: -1, obj.author_id: 1})
+
+    def save_related(self, request, form, formsets, change):
+        recipe = form.instance
+        ingredient_ids = set()
+        if change:
+            ingredient_ids = get_recipe_ingredient_ids((recipe.pk,))
+        super().save_related(request, form, formsets, change)
+        if change:
+            ingredient_ids |= get_recipe_ingredient_ids((recipe.pk,))
+            refresh_recipe_shopping_lists(recipe.pk, ingredient_ids)
 
 
 admin.site.register(Tag, TagAdmin)
@@ -0,0 +1,107 @@
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Recipe
+
+User = get_user_model()
+
+# (model, counter field, related model, related field): counter of a model
+# instance holds the number of related rows pointing to it.
+COUNTERS = (
+    (Recipe, "favorites_count", User.favorite_recipes.through, "recipe"),
+    (Recipe, "in_carts_count", User.shopping_cart.through, "recipe"),
+    (User, "recipes_count", Recipe, "author"),
+    (User, "followers_count", User.users_followed.through, "to_user"),
+)
+
+# {through model: (source field, target field, counter field of target)}
+M2M_COUNTERS = {
+    User.favorite_recipes.through: ("user", "recipe", "favorites_count"),
+    User.shopping_cart.through: ("user", "recipe", "in_carts_count"),
+    User.users_followed.through: ("from_user", "to_user", "followers_count"),
+}
+
+
+def change_counters(model, counter_field, deltas):
+    """Add {pk: delta} deltas to counter field with F() expressions.
+
+    Rows sharing a delta are updated with a single query. Counters are
+    clamped at zero: a drifted counter must not fail the update of an
+    unsigned column.
+    """
+    pks_by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            pks_by_delta[delta].append(pk)
+    for delta, pks in pks_by_delta.items():
+        model.objects.filter(pk__in=pks).update(
+            **{counter_field: Greatest(F(counter_field) + delta, 0)})
+
+
+def update_m2m_counter(through, source_field, target_field, counter_field,
+                       instance, action, reverse, pk_set):
+    """Keep counter of m2m target in sync from m2m_changed signal.
+
+    Added pks are exact after insert. Removed rows are counted before
+    delete, as pk_set of remove holds every passed pk, linked or not.
+    """
+    counter_model = through._meta.get_field(target_field).related_model
+    if action == "post_add":
+        if reverse:
+            deltas = {instance.pk: len(pk_set)}
+        else:
+            deltas = dict.fromkeys(pk_set, 1)
+    elif action in ("pre_remove", "pre_clear"):
+        instance_field, other_field = source_field, target_field
+        if reverse:
+            instance_field, other_field = target_field, source_field
+        rows = through.objects.filter(**{instance_field: instance.pk})
+        if pk_set is not None:
+            rows = rows.filter(**{f"{other_field}__in": pk_set})
+        removed = Counter(rows.values_list(target_field, flat=True))
+        deltas = {pk: -count for pk, count in removed.items()}
+    else:
+        return
+    change_counters(counter_model, counter_field, deltas)
+
+
+def count_related(related_model, related_field):
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{related_field: OuterRef("pk")})
+            .order_by()
+            .values(related_field)
+            .annotate(count=Count("pk"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+def reconcile_counter(model, counter_field, related_model, related_field,
+                      chunk_size=1000):
+    """Recompute counter chunk by chunk, return number of fixed rows.
+
+    Drift is applied as F() delta, so updates made by concurrent
+    requests between read and write are kept.
+    """
+    queryset = model.objects.order_by("pk").annotate(
+        actual_count=count_related(related_model, related_field))
+    fixed = 0
+    last_pk = 0
+    while True:
+        chunk = queryset.filter(pk__gt=last_pk).values_list(
+            "pk", counter_field, "actual_count")[:chunk_size]
+        rows = list(chunk)
+        if not rows:
+            return fixed
+        last_pk = rows[-1][0]
+        deltas = {pk: actual - stored
+                  for pk, stored, actual in rows if actual != stored}
+        with transaction.atomic():
+            change_counters(model, counter_field, deltas)
+        fixed += len(deltas)
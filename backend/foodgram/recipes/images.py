@@ -0,0 +1,133 @@
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = "recipe_images/derivatives"
+
+image_variants_generated = Signal()
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix="recipe-images",
+)
+
+deletion_queue = queue.SimpleQueue()
+
+
+def get_variant_name(image_name, variant):
+    # the whole name is kept, so images differing only by directory or
+    # extension don't share variants
+    return f"{DERIVATIVES_DIR}/{image_name}_{variant}.webp"
+
+
+def get_variant_names(image_name):
+    return [get_variant_name(image_name, variant)
+            for variant in settings.RECIPE_IMAGE_VARIANTS]
+
+
+def get_image_variant_url(image, variant, image_variants):
+    """Return URL of image variant, falling back to the original image.
+
+    Variants are generated in background, so a freshly uploaded image
+    may have none yet. 'image_variants' are the variants recorded on
+    the recipe, storage is not asked.
+    """
+    if variant in image_variants:
+        return image.storage.url(get_variant_name(image.name, variant))
+    return image.url
+
+
+def generate_image_variants(image_name, storage=default_storage):
+    """Save downscaled WebP copies of the image for every variant."""
+    with storage.open(image_name) as source:
+        image = Image.open(source)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        variant_image = image.copy()
+        variant_image.thumbnail(size, Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        variant_image.save(
+            buffer, "WEBP", quality=settings.RECIPE_IMAGE_WEBP_QUALITY)
+        variant_name = get_variant_name(image_name, variant)
+        if storage.exists(variant_name):
+            storage.delete(variant_name)
+        storage.save(variant_name, ContentFile(buffer.getvalue()))
+    record_image_variants(image_name)
+
+
+def record_image_variants(image_name):
+    """Mark variants of the image as generated on its recipes."""
+    Recipe.objects.filter(image=image_name).update(
+        image_variants=list(settings.RECIPE_IMAGE_VARIANTS))
+    image_variants_generated.send(sender=None, image_name=image_name)
+
+
+def delete_image_variants(image_name, storage=default_storage):
+    for variant_name in get_variant_names(image_name):
+        storage.delete(variant_name)
+
+
+def _generate_image_variants_safely(image_name):
+    try:
+        generate_image_variants(image_name)
+    except Exception:
+        logger.exception("Failed to generate variants of %s", image_name)
+
+
+def schedule_image_variants(image_name):
+    """Generate image variants in a worker thread after commit."""
+    transaction.on_commit(
+        lambda: executor.submit(_generate_image_variants_safely, image_name)
+    )
+
+
+def queue_image_deletion(image_name):
+    """Delete the image and its variants after commit.
+
+    Names are put to the deletion queue only when the transaction
+    commits, so rolled back deletes keep their files. The queue is
+    drained in batches by a worker thread.
+    """
+    if image_name:
+        transaction.on_commit(lambda: _enqueue_image_deletion(image_name))
+
+
+def _enqueue_image_deletion(image_name):
+    deletion_queue.put(image_name)
+    executor.submit(process_deletion_queue)
+
+
+def process_deletion_queue(storage=default_storage):
+    """Delete queued images batch by batch until the queue is empty."""
+    while True:
+        batch = []
+        while len(batch) < settings.MEDIA_DELETION_BATCH_SIZE:
+            try:
+                batch.append(deletion_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        for image_name in batch:
+            try:
+                delete_image_variants(image_name, storage)
+                storage.delete(image_name)
+            except OSError:
+                logger.exception("Failed to delete %s", image_name)
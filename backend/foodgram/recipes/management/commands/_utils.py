@@ -1,49 +1,299 @@
 import csv
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+from pathlib import Path
 
-from recipes.models import Ingredient, MeasurementUnit, Tag
-
-
-def process_tags(path_to_file):
-    tags = []
-    with open(path_to_file) as source:
-        header = None
-        reader = csv.reader(source)
-        for row in reader:
-            if not header:
-                header = row
-                continue
-            tag = Tag(**dict(zip(header, row)))
-            tags.append(tag)
-    Tag.objects.bulk_create(tags, ignore_conflicts=True)
-
-
-def process_ingredients(path_to_file):
-    measurement_unit_names = set()
-    raw_ingredients = []
-    ingredients = []
-
-    with open(path_to_file) as source:
-        reader = csv.reader(source)
-        for row in reader:
-            measurement_unit_name = row[-1]
-            measurement_unit_names.add(
-                measurement_unit_name
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from recipes.counters import change_counters
+from recipes.models import (Ingredient, MeasurementUnit, Recipe,
+                            RecipeIngredient, Tag)
+
+User = get_user_model()
+
+TAG_FIELDS = ("name", "color", "slug")
+INGREDIENT_FIELDS = ("name", "measurement_unit")
+FILE_FORMATS = ("csv", "json", "ndjson")
+JSON_READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_file_format(path, file_format=None):
+    if file_format:
+        return file_format
+    suffix = Path(path).suffix.lstrip(".").lower()
+    if suffix == "jsonl":
+        return "ndjson"
+    if suffix not in FILE_FORMATS:
+        raise ValueError(f"Can't detect format of {path}.")
+    return suffix
+
+
+def read_csv_records(source, fieldnames):
+    reader = csv.reader(source)
+    for row in reader:
+        if tuple(row) == fieldnames:
+            continue
+        yield dict(zip(fieldnames, row))
+
+
+def read_ndjson_records(source):
+    for line in source:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_json_records(source):
+    """Yield items of a top level JSON array without loading whole file."""
+    decoder = json.JSONDecoder()
+    buffer = source.read(JSON_READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("JSON array expected.")
+    position = 1
+
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if buffer[position:position + 1] == "]":
+            return
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = source.read(JSON_READ_CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield record
+
+
+def read_records(path, fieldnames, file_format=None):
+    """Stream records of CSV, JSON array or NDJSON file as dicts.
+
+    CSV files are read with given fieldnames, header row is skipped
+    when it matches them.
+    """
+    file_format = get_file_format(path, file_format)
+    with open(path, encoding="utf-8", newline="") as source:
+        if file_format == "csv":
+            yield from read_csv_records(source, fieldnames)
+        elif file_format == "ndjson":
+            yield from read_ndjson_records(source)
+        else:
+            yield from read_json_records(source)
+
+
+def batched(records, batch_size):
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        yield batch
+
+
+class BulkLoader:
+    """Load catalogue and recipes in batches.
+
+    Foreign keys are resolved through in-memory maps filled once and
+    extended with the rows created by the loader, so a batch costs a
+    fixed number of queries however many rows it has. Catalogue rows
+    and recipe authors are upserted by their natural keys, recipes
+    already present for the author under the same name are skipped.
+    Progress is reported to 'on_progress' callable after every batch.
+    """
+
+    def __init__(self, batch_size=1000, on_progress=None):
+        self.batch_size = batch_size
+        self.on_progress = on_progress or (lambda label, count: None)
+        self.unit_ids = None
+        self.ingredient_ids = None
+        self.tag_ids = None
+        self.user_ids = {}
+
+    def load_tags(self, records):
+        count = 0
+        for batch in batched(records, self.batch_size):
+            Tag.objects.bulk_create(
+                [Tag(name=record["name"], color=record["color"],
+                     slug=record["slug"]) for record in batch],
+                update_conflicts=True,
+                unique_fields=("slug",),
+                update_fields=("name", "color"),
             )
+            count += len(batch)
+            self.on_progress("tags", count)
+        self.tag_ids = None
+        return count
 
-            raw_ingredients.append(row)
+    def load_ingredients(self, records):
+        count = 0
+        for batch in batched(records, self.batch_size):
+            with transaction.atomic():
+                self.get_ingredient_ids(
+                    (record["name"], record["measurement_unit"])
+                    for record in batch
+                )
+            count += len(batch)
+            self.on_progress("ingredients", count)
+        return count
 
-        measurement_units = [MeasurementUnit(
-            name=unit_name) for unit_name in measurement_unit_names]
+    def load_recipes(self, records):
+        count = 0
+        for batch in batched(records, self.batch_size):
+            try:
+                with transaction.atomic():
+                    self.create_recipes(batch)
+            except IntegrityError as error:
+                raise CommandError(
+                    f"Can't load recipes {count + 1}-{count + len(batch)}: "
+                    f"{error}")
+            count += len(batch)
+            self.on_progress("recipes", count)
+        return count
 
-        MeasurementUnit.objects.bulk_create(
-            measurement_units, ignore_conflicts=True)
+    def get_unit_ids(self, unit_names):
+        if self.unit_ids is None:
+            self.unit_ids = dict(
+                MeasurementUnit.objects.values_list("name", "pk"))
+        missing = set(unit_names) - self.unit_ids.keys()
+        if missing:
+            MeasurementUnit.objects.bulk_create(
+                [MeasurementUnit(name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            self.unit_ids.update(
+                MeasurementUnit.objects.filter(name__in=missing)
+                                       .values_list("name", "pk"))
+        return self.unit_ids
 
-        unit_query = MeasurementUnit.objects.all()
+    def get_ingredient_ids(self, keys):
+        """Return {(name, unit name): pk} map covering given keys."""
+        if self.ingredient_ids is None:
+            self.ingredient_ids = {
+                (name, unit_name): pk
+                for pk, name, unit_name in Ingredient.objects.values_list(
+                    "pk", "name", "measurement_unit__name")
+            }
+        missing = set(keys) - self.ingredient_ids.keys()
+        if missing:
+            unit_ids = self.get_unit_ids(
+                unit_name for _, unit_name in missing)
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit_id=unit_ids[unit])
+                 for name, unit in missing],
+                ignore_conflicts=True,
+            )
+            created = Ingredient.objects.filter(
+                name__in={name for name, _ in missing}
+            ).values_list("pk", "name", "measurement_unit__name")
+            self.ingredient_ids.update(
+                ((name, unit_name), pk) for pk, name, unit_name in created)
+        return self.ingredient_ids
 
-        for raw_ingredient in raw_ingredients:
-            measurement_unit_name = raw_ingredient[-1]
-            measurement_unit = unit_query.get(name=measurement_unit_name)
-            ingredients.append(Ingredient(
-                name=raw_ingredient[0], measurement_unit=measurement_unit))
+    def get_tag_ids(self):
+        if self.tag_ids is None:
+            self.tag_ids = dict(Tag.objects.values_list("slug", "pk"))
+        return self.tag_ids
 
-        Ingredient.objects.bulk_create(ingredients, ignore_conflicts=True)
+    def get_user_ids(self, authors):
+        """Return {username: pk} map covering given authors.
+
+        Authors with email are upserted, ones given by username only
+        must already exist.
+        """
+        missing = {
+            author["username"]: author for author in authors
+            if author["username"] not in self.user_ids
+        }
+        if not missing:
+            return self.user_ids
+        upserted = [author for author in missing.values()
+                    if author.get("email")]
+        if upserted:
+            try:
+                User.objects.bulk_create(
+                    [User(username=author["username"],
+                          email=author["email"],
+                          first_name=author.get("first_name", ""),
+                          last_name=author.get("last_name", ""),
+                          password=make_password(None))
+                     for author in upserted],
+                    update_conflicts=True,
+                    unique_fields=("username",),
+                    update_fields=("email", "first_name", "last_name"),
+                )
+            except IntegrityError as error:
+                # email taken by another username
+                raise CommandError(f"Can't load authors: {error}")
+        self.user_ids.update(
+            User.objects.filter(username__in=missing)
+                        .values_list("username", "pk"))
+        unknown = missing.keys() - self.user_ids.keys()
+        if unknown:
+            raise CommandError(
+                f"Authors without email don't exist: "
+                f"{', '.join(sorted(unknown))}.")
+        return self.user_ids
+
+    def get_new_records(self, batch, user_ids):
+        """Drop records of recipes the author already has."""
+        existing = set(Recipe.objects.filter(
+            author_id__in={user_ids[record["author"]["username"]]
+                           for record in batch},
+            name__in={record["name"] for record in batch},
+        ).values_list("author_id", "name"))
+        records = []
+        for record in batch:
+            key = (user_ids[record["author"]["username"]], record["name"])
+            if key not in existing:
+                existing.add(key)
+                records.append(record)
+        return records
+
+    def create_recipes(self, batch):
+        user_ids = self.get_user_ids(record["author"] for record in batch)
+        batch = self.get_new_records(batch, user_ids)
+        tag_ids = self.get_tag_ids()
+        ingredient_ids = self.get_ingredient_ids(
+            (ingredient["name"], ingredient["measurement_unit"])
+            for record in batch
+            for ingredient in record.get("ingredients", ())
+        )
+
+        recipes = []
+        for record in batch:
+            recipe = Recipe(
+                author_id=user_ids[record["author"]["username"]],
+                name=record["name"],
+                text=record.get("text", ""),
+                image=record.get("image", ""),
+                cooking_time=record["cooking_time"],
+            )
+            if record.get("publication_date"):
+                recipe.publication_date = record["publication_date"]
+            recipes.append(recipe)
+        Recipe.objects.bulk_create(recipes)
+        change_counters(User, "recipes_count",
+                        Counter(recipe.author_id for recipe in recipes))
+
+        recipe_tag_model = Recipe.tags.through
+        recipe_tags = []
+        recipe_ingredients = []
+        for recipe, record in zip(recipes, batch):
+            for slug in set(record.get("tags", ())):
+                recipe_tags.append(recipe_tag_model(
+                    recipe_id=recipe.pk, tag_id=tag_ids[slug]))
+            amounts = defaultdict(int)
+            for ingredient in record.get("ingredients", ()):
+                amounts[ingredient_ids[
+                    (ingredient["name"], ingredient["measurement_unit"])
+                ]] += ingredient["amount"]
+            recipe_ingredients.extend(
+                RecipeIngredient(recipe_id=recipe.pk,
+                                 ingredient_id=ingredient_id, amount=amount)
+                for ingredient_id, amount in amounts.items()
+            )
+        recipe_tag_model.objects.bulk_create(recipe_tags)
+        RecipeIngredient.objects.bulk_create(recipe_ingredients)
@@ -0,0 +1,81 @@
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from recipes.images import DERIVATIVES_DIR
+from recipes.models import Recipe
+
+RECIPE_IMAGES_DIR = "recipe_images"
+
+
+def scan_files(path):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete files under MEDIA_ROOT/recipe_images that are referenced "
+        "neither by Recipe.image nor as a variant of a referenced image."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list orphaned files.",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=60 * 60,
+            help=("Skip files modified less than given number of seconds "
+                  "ago, they may belong to uncommitted uploads."),
+        )
+
+    def handle(self, *args, **options):
+        media_root = Path(settings.MEDIA_ROOT)
+        images_dir = media_root / RECIPE_IMAGES_DIR
+        if not images_dir.is_dir():
+            self.stdout.write(f"{images_dir} doesn't exist.")
+            return
+
+        image_names = set(
+            Recipe.objects.values_list("image", flat=True).iterator())
+
+        modified_before = time.time() - options["min_age"]
+        scanned = orphaned = 0
+        for entry in scan_files(images_dir):
+            scanned += 1
+            name = Path(entry.path).relative_to(media_root).as_posix()
+            if self.is_referenced(name, image_names):
+                continue
+            if entry.stat().st_mtime > modified_before:
+                continue
+            orphaned += 1
+            if options["dry_run"]:
+                self.stdout.write(name)
+            else:
+                os.remove(entry.path)
+
+        action = "found" if options["dry_run"] else "deleted"
+        self.stdout.write(
+            f"Scanned {scanned} files, {orphaned} orphaned files {action}.")
+
+    def is_referenced(self, name, image_names):
+        if name in image_names:
+            return True
+        # variant names are built by 'get_variant_name'
+        prefix, suffix = f"{DERIVATIVES_DIR}/", ".webp"
+        if not (name.startswith(prefix) and name.endswith(suffix)):
+            return False
+        image_name, _, variant = (
+            name[len(prefix):-len(suffix)].rpartition("_"))
+        return (variant in settings.RECIPE_IMAGE_VARIANTS
+                and image_name in image_names)
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from recipes.images import (generate_image_variants, get_variant_names,
+                            record_image_variants)
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Generate missing thumbnails and WebP variants of recipe images."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Regenerate variants that already exist.",
+        )
+
+    def handle(self, *args, **options):
+        images = (
+            Recipe.objects.exclude(image="")
+                          .values_list("image", "image_variants")
+                          .iterator()
+        )
+        variants = set(settings.RECIPE_IMAGE_VARIANTS)
+        generated = failed = 0
+        for image_name, image_variants in images:
+            if not options["force"]:
+                if variants.issubset(image_variants):
+                    continue
+                # variants generated before they were recorded
+                if all(default_storage.exists(name)
+                       for name in get_variant_names(image_name)):
+                    record_image_variants(image_name)
+                    continue
+            try:
+                generate_image_variants(image_name)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f"{image_name}: {error}")
+                continue
+            generated += 1
+        self.stdout.write(
+            f"Variants generated for {generated} images, {failed} failed.")
@@ -0,0 +1,166 @@
+import random
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from recipes.models import Ingredient, MeasurementUnit, Recipe
+
+from ._utils import BulkLoader, batched
+
+from api.caching import (bump_catalogue_version,  # isort:skip
+                         bump_recipe_content_version)
+
+User = get_user_model()
+
+SYNTHETIC_USERNAME = "synthetic-user-{index}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic dataset: users, follow graph, tags, recipes, "
+        "favorites with power-law recipe popularity and shopping carts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--recipes", type=int, default=10_000)
+        parser.add_argument("--tags", type=int, default=10)
+        parser.add_argument("--ingredients-per-recipe", type=int, default=8)
+        parser.add_argument("--follows-per-user", type=int, default=20)
+        parser.add_argument("--favorites-per-user", type=int, default=30)
+        parser.add_argument("--cart-size", type=int, default=5)
+        parser.add_argument(
+            "--popularity-exponent",
+            type=float,
+            default=1.1,
+            help="Exponent of Zipf-like recipe popularity distribution.",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        loader = BulkLoader(self.batch_size, self.report_progress)
+
+        loader.load_tags(self.generate_tags(options["tags"]))
+        for authors in batched(self.generate_authors(options["users"]),
+                               self.batch_size):
+            loader.get_user_ids(authors)
+            self.report_progress("users", len(loader.user_ids))
+        ingredient_keys = self.get_ingredient_keys(loader)
+        loader.load_recipes(self.generate_recipes(options, ingredient_keys))
+
+        user_ids = list(loader.user_ids.values())
+        recipe_ids = list(Recipe.objects.filter(
+            author__in=user_ids).values_list("pk", flat=True))
+
+        self.create_follows(user_ids, options["follows_per_user"])
+        popularity = self.get_popularity_weights(
+            recipe_ids, options["popularity_exponent"])
+        self.create_user_recipes(
+            "favorite_recipes", user_ids, recipe_ids, popularity,
+            options["favorites_per_user"])
+        self.create_user_recipes(
+            "shopping_cart", user_ids, recipe_ids, popularity,
+            options["cart_size"])
+        # Relations above are bulk inserted without m2m_changed signals.
+        call_command("reconcile_counters", stdout=self.stdout)
+        call_command("rebuild_shopping_lists", stdout=self.stdout)
+
+        bump_catalogue_version()
+        bump_recipe_content_version()
+        self.stdout.write("Synthetic data generated!")
+
+    def report_progress(self, label, count):
+        self.stdout.write(f"  {label}: {count} records loaded")
+
+    def generate_tags(self, count):
+        for index in range(count):
+            yield {
+                "name": f"synthetic tag {index}",
+                "color": f"#{index:06X}",
+                "slug": f"synthetic-tag-{index}",
+            }
+
+    def get_ingredient_keys(self, loader):
+        if not Ingredient.objects.exists():
+            unit, _ = MeasurementUnit.objects.get_or_create(name="g")
+            Ingredient.objects.bulk_create(
+                Ingredient(name=f"synthetic ingredient {index}",
+                           measurement_unit=unit)
+                for index in range(500)
+            )
+        return list(loader.get_ingredient_ids(()))
+
+    def generate_authors(self, count):
+        for index in range(count):
+            username = SYNTHETIC_USERNAME.format(index=index)
+            yield {
+                "username": username,
+                "email": f"{username}@example.com",
+                "first_name": "Synthetic",
+                "last_name": f"User {index}",
+            }
+
+    def generate_recipes(self, options, ingredient_keys):
+        tag_slugs = [f"synthetic-tag-{index}"
+                     for index in range(options["tags"])]
+        ingredients_per_recipe = min(
+            options["ingredients_per_recipe"], len(ingredient_keys))
+        for index in range(options["recipes"]):
+            author_index = self.random.randrange(options["users"])
+            username = SYNTHETIC_USERNAME.format(index=author_index)
+            ingredients = self.random.sample(
+                ingredient_keys, ingredients_per_recipe)
+            yield {
+                "author": {"username": username},
+                "name": f"Synthetic recipe {index}",
+                "text": "Synthetic recipe description. " * 20,
+                "image": "recipe_images/synthetic.png",
+                "cooking_time": self.random.randint(5, 180),
+                "tags": self.random.sample(
+                    tag_slugs, self.random.randint(1, min(3, len(tag_slugs)))),
+                "ingredients": [
+                    {"name": name, "measurement_unit": unit,
+                     "amount": self.random.randint(1, 500)}
+                    for name, unit in ingredients
+                ],
+            }
+
+    def get_popularity_weights(self, recipe_ids, exponent):
+        ranks = list(range(1, len(recipe_ids) + 1))
+        self.random.shuffle(ranks)
+        return list(accumulate(1 / rank ** exponent for rank in ranks))
+
+    def create_follows(self, user_ids, follows_per_user):
+        follow_model = User.users_followed.through
+        follows = (
+            follow_model(from_user_id=user_id, to_user_id=followed_id)
+            for user_id in user_ids
+            for followed_id in self.random.sample(
+                user_ids, min(follows_per_user, len(user_ids)))
+            if followed_id != user_id
+        )
+        self.bulk_create(follow_model, follows, "follows")
+
+    def create_user_recipes(self, field_name, user_ids, recipe_ids,
+                            cumulative_weights, per_user):
+        if not recipe_ids:
+            return
+        through_model = getattr(User, field_name).through
+        rows = (
+            through_model(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in set(self.random.choices(
+                recipe_ids, cum_weights=cumulative_weights, k=per_user))
+        )
+        self.bulk_create(through_model, rows, field_name)
+
+    def bulk_create(self, model, rows, label):
+        count = 0
+        for batch in batched(rows, self.batch_size):
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            count += len(batch)
+            self.report_progress(label, count)
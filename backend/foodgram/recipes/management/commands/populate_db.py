@@ -1,7 +1,11 @@
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from ._utils import process_ingredients, process_tags
+from ._utils import (FILE_FORMATS, INGREDIENT_FIELDS, TAG_FIELDS, BulkLoader,
+                     read_records)
+
+from api.caching import (bump_catalogue_version,  # isort:skip
+                         bump_recipe_content_version)
 
 PATH_TO_TAG_CSV_FILE = settings.BASE_DIR.parent.parent / "data" / "tags.csv"
 PATH_TO_INGREDIENT_CSV_FILE = (
@@ -9,17 +13,70 @@ PATH_TO_INGREDIENT_CSV_FILE = (
 
 
 class Command(BaseCommand):
-    help = "Populate db with initial data."
+    help = (
+        "Populate db with initial data. Without arguments loads default "
+        "tags and ingredients. Files may be CSV, JSON arrays or NDJSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tags", help="Path to tags file.")
+        parser.add_argument("--ingredients", help="Path to ingredients file.")
+        parser.add_argument(
+            "--recipes",
+            help=("Path to recipes file. Every record holds 'author' "
+                  "(username, email, first_name, last_name; email may be "
+                  "omitted for existing users), 'name', 'text', 'image', "
+                  "'cooking_time', optional 'publication_date', 'tags' "
+                  "(slugs) and 'ingredients' (name, measurement_unit, "
+                  "amount). Recipes the author already has under the "
+                  "same name are skipped."),
+        )
+        parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=FILE_FORMATS,
+            help="Format of files, detected by extension by default.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
 
     def handle(self, *args, **options):
+        tags_path = options["tags"]
+        ingredients_path = options["ingredients"]
+        recipes_path = options["recipes"]
+        if not any((tags_path, ingredients_path, recipes_path)):
+            tags_path = PATH_TO_TAG_CSV_FILE
+            ingredients_path = PATH_TO_INGREDIENT_CSV_FILE
+
+        loader = BulkLoader(options["batch_size"], self.report_progress)
+        file_format = options["file_format"]
         self.stdout.write("Commence populate DB with initial data...")
-        self.stdout.write("Populating DB with tags...")
-        process_tags(PATH_TO_TAG_CSV_FILE)
-        self.stdout.write("Tags processed!")
+        try:
+            if tags_path:
+                self.stdout.write("Populating DB with tags...")
+                loader.load_tags(
+                    read_records(tags_path, TAG_FIELDS, file_format))
+                self.stdout.write("Tags processed!")
 
-        self.stdout.write(
-            "Populating DB with measurement units and ingredients...")
-        process_ingredients(PATH_TO_INGREDIENT_CSV_FILE)
-        self.stdout.write("Measurement units and ingredients processed!")
+            if ingredients_path:
+                self.stdout.write(
+                    "Populating DB with measurement units and ingredients...")
+                loader.load_ingredients(read_records(
+                    ingredients_path, INGREDIENT_FIELDS, file_format))
+                self.stdout.write(
+                    "Measurement units and ingredients processed!")
+
+            if recipes_path:
+                self.stdout.write("Populating DB with recipes...")
+                loader.load_recipes(
+                    read_records(recipes_path, (), file_format))
+                self.stdout.write("Recipes processed!")
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f"Can't populate DB: {error!r}")
+        finally:
+            bump_catalogue_version()
+            bump_recipe_content_version()
 
         self.stdout.write("DB successfully populated!")
+
+    def report_progress(self, label, count):
+        self.stdout.write(f"  {label}: {count} records loaded")
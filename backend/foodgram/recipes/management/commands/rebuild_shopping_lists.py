@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from recipes.shopping_list import rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute shopping lists of all users from their shopping carts "
+        "in chunks, after carts were changed bypassing signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_shopping_lists(options["chunk_size"])
+        self.stdout.write(f"Shopping lists of {rebuilt} users rebuilt")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from recipes.counters import COUNTERS, reconcile_counter
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute denormalized favorites, cart, recipes and followers "
+        "counters in chunks and fix the drifted ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model, counter_field, related_model, related_field in COUNTERS:
+            fixed = reconcile_counter(model, counter_field, related_model,
+                                      related_field, options["chunk_size"])
+            self.stdout.write(
+                f"{model._meta.label}.{counter_field}: {fixed} rows fixed")
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-publication_date'], name='recipe_author_published_idx'),
+        ),
+    ]
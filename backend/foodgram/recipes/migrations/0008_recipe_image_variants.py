@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:37
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# SQLite may rebuild recipes_recipe to add or remove the column, dropping
+# the full-text search triggers of 0004.
+recipe_search = import_module("recipes.migrations.0004_recipe_search")
+
+
+def recreate_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    # the FTS5 table itself is kept
+    statements = (recipe_search.SQLITE_BACKWARD[:3]
+                  + recipe_search.SQLITE_FORWARD[1:])
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            migrations.RunPython.noop, recreate_search_triggers),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='Generated variants of the image', verbose_name='Image variants'),
+        ),
+        migrations.RunPython(
+            recreate_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def reset_image_variants(apps, schema_editor):
+    # variant file names now include the directory and extension of the
+    # image, recorded variants are regenerated by generate_image_variants
+    Recipe = apps.get_model("recipes", "Recipe")
+    Recipe.objects.update(image_variants=[])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            reset_image_variants, migrations.RunPython.noop),
+    ]
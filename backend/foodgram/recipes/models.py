@@ -4,6 +4,31 @@ from django.db import models
 from django.utils import timezone
 
 
+class CounterFieldsMixin:
+    """Leave counter columns out of UPDATE made by save().
+
+    Counters are changed with F() expressions only, writing back a stale
+    in-memory value would lose concurrent changes. The same holds for
+    'background_fields' written by background jobs with update().
+    """
+    counter_fields = ()
+    background_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args
+                and not kwargs.get("force_insert")
+                and kwargs.get("update_fields") is None):
+            deferred_fields = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.name not in self.background_fields
+                and field.attname not in deferred_fields
+            ]
+        super().save(*args, **kwargs)
+
+
 class Tag(models.Model):
     name = models.CharField(
         verbose_name="name",
@@ -79,7 +104,7 @@ class Ingredient(models.Model):
         return f"{self.name} ({self.measurement_unit})"
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     tags = models.ManyToManyField(
         to=Tag,
         verbose_name="tags",
@@ -122,11 +147,43 @@ class Recipe(models.Model):
         help_text="Date of publication",
         default=timezone.now,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="Favorites count",
+        help_text="Number of users who added recipe to favorites",
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name="In carts count",
+        help_text="Number of users who added recipe to shopping cart",
+        default=0,
+        editable=False,
+    )
+    image_variants = models.JSONField(
+        verbose_name="Image variants",
+        help_text="Generated variants of the image",
+        default=list,
+        blank=True,
+        editable=False,
+    )
+
+    counter_fields = ("favorites_count", "in_carts_count")
+    background_fields = ("image_variants",)
 
     class Meta:
         verbose_name = "Recipe"
         verbose_name_plural = "Recipes"
         ordering = ("-publication_date",)
+        indexes = (
+            models.Index(
+                fields=("-publication_date", "-id"),
+                name="recipe_published_idx",
+            ),
+            models.Index(
+                fields=("author", "-publication_date"),
+                name="recipe_author_published_idx",
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -166,3 +223,43 @@ class RecipeIngredient(models.Model):
 
     def __str__(self):
         return f"{self.recipe}-({self.ingredient} - {self.amount})"
+
+
+class ShoppingListItem(models.Model):
+    """Total amount of an ingredient over recipes in user's shopping cart.
+
+    Rows are maintained by 'recipes.shopping_list' whenever a cart or
+    ingredients of a recipe in some cart change.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+        verbose_name="user",
+        help_text="Owner of the shopping list",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+        verbose_name="ingredient",
+        help_text="Ingredient to buy",
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name="total amount",
+        help_text="Amount summed over recipes in shopping cart",
+    )
+
+    class Meta:
+        verbose_name = "ShoppingListItem"
+        verbose_name_plural = "ShoppingListItems"
+        ordering = ("pk",)
+        constraints = (
+            models.UniqueConstraint(
+                fields=("user", "ingredient"),
+                name="unique_ingredient_in_shopping_list",
+            ),
+        )
+
+    def __str__(self):
+        return f"{self.user}-({self.ingredient} - {self.total_amount})"
@@ -0,0 +1,126 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import RecipeIngredient, ShoppingListItem
+
+User = get_user_model()
+
+CartItem = User.shopping_cart.through
+
+
+def get_shopping_list_totals(user_ids, ingredient_ids=None):
+    """Return {(user pk, ingredient pk): amount} summed over carts."""
+    rows = RecipeIngredient.objects.filter(recipe__shopping_carts__in=user_ids)
+    if ingredient_ids is not None:
+        rows = rows.filter(ingredient_id__in=ingredient_ids)
+    totals = (
+        rows.values_list("recipe__shopping_carts", "ingredient_id")
+            .annotate(total_amount=Sum("amount"))
+            .order_by()
+    )
+    return {(user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in totals}
+
+
+def refresh_shopping_lists(user_ids, ingredient_ids=None):
+    """Recompute shopping list rows of given users and ingredients.
+
+    Only rows of the touched (user, ingredient) pairs are read and
+    written, None ingredient_ids stands for all ingredients of users.
+    Refreshes of a user are serialized by locking the user row, so
+    totals are read after a concurrent refresh has committed and are
+    never written back over a newer result.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids or ingredient_ids is not None and not ingredient_ids:
+        return
+    with transaction.atomic():
+        # sorted, so concurrent refreshes lock users in the same order
+        list(User.objects.select_for_update(no_key=True).filter(
+            pk__in=user_ids).order_by("pk").values_list("pk", flat=True))
+        write_shopping_lists(
+            user_ids, ingredient_ids,
+            get_shopping_list_totals(user_ids, ingredient_ids))
+
+
+def write_shopping_lists(user_ids, ingredient_ids, totals):
+    """Make stored rows of the users equal totals, writing only changes."""
+    items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+    if ingredient_ids is not None:
+        items = items.filter(ingredient_id__in=ingredient_ids)
+
+    deleted, changed = [], []
+    for item in items:
+        total_amount = totals.pop((item.user_id, item.ingredient_id), None)
+        if total_amount is None:
+            deleted.append(item.pk)
+        elif item.total_amount != total_amount:
+            item.total_amount = total_amount
+            changed.append(item)
+    if deleted:
+        ShoppingListItem.objects.filter(pk__in=deleted).delete()
+    if changed:
+        ShoppingListItem.objects.bulk_update(changed, ("total_amount",))
+    if totals:
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             total_amount=total_amount)
+            for (user_id, ingredient_id), total_amount in totals.items()
+        )
+
+
+def get_recipe_ingredient_ids(recipe_ids):
+    return set(RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids).values_list("ingredient_id", flat=True))
+
+
+def get_cart_user_ids(recipe_id):
+    return list(CartItem.objects.filter(
+        recipe_id=recipe_id).values_list("user_id", flat=True))
+
+
+def refresh_recipe_shopping_lists(recipe_id, ingredient_ids):
+    """Recompute lists of users having the recipe in shopping cart."""
+    if ingredient_ids:
+        refresh_shopping_lists(get_cart_user_ids(recipe_id), ingredient_ids)
+
+
+def update_shopping_lists(instance, action, reverse, pk_set):
+    """Keep shopping lists in sync from m2m_changed signal of carts.
+
+    Users of a recipe removed from all carts by clear() are collected
+    before the rows are gone.
+    """
+    if action in ("post_add", "post_remove"):
+        if reverse:
+            refresh_shopping_lists(
+                pk_set, get_recipe_ingredient_ids((instance.pk,)))
+        else:
+            refresh_shopping_lists(
+                (instance.pk,), get_recipe_ingredient_ids(pk_set))
+    elif action == "pre_clear" and reverse:
+        instance._cart_user_ids = get_cart_user_ids(instance.pk)
+    elif action == "post_clear":
+        if reverse:
+            refresh_shopping_lists(
+                instance.__dict__.pop("_cart_user_ids", ()),
+                get_recipe_ingredient_ids((instance.pk,)))
+        else:
+            refresh_shopping_lists((instance.pk,))
+
+
+def rebuild_shopping_lists(chunk_size=1000):
+    """Recompute lists of all users with carts, return number of users."""
+    user_ids = CartItem.objects.order_by("user_id").values_list(
+        "user_id", flat=True).distinct()
+    ShoppingListItem.objects.exclude(user_id__in=user_ids).delete()
+    rebuilt = 0
+    last_user_id = 0
+    while True:
+        chunk = list(user_ids.filter(user_id__gt=last_user_id)[:chunk_size])
+        if not chunk:
+            return rebuilt
+        last_user_id = chunk[-1]
+        refresh_shopping_lists(chunk)
+        rebuilt += len(chunk)
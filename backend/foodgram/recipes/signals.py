@@ -1,9 +1,89 @@
-from django.db.models.signals import pre_delete
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save, pre_delete)
 from django.dispatch import receiver
 
+from .counters import M2M_COUNTERS, change_counters, update_m2m_counter
+from .images import queue_image_deletion, schedule_image_variants
 from .models import Recipe
+from .shopping_list import (get_cart_user_ids, get_recipe_ingredient_ids,
+                            refresh_shopping_lists, update_shopping_lists)
+
+User = get_user_model()
 
 
 @receiver(pre_delete, sender=Recipe)
 def delete_recipe_image(sender, instance, **kwargs):
-    instance.image.delete()
+    queue_image_deletion(instance.image.name)
+
+
+@receiver(post_init, sender=Recipe)
+def remember_recipe_image(sender, instance, **kwargs):
+    # image is absent from __dict__ when deferred
+    image = instance.__dict__.get("image")
+    instance._loaded_image_name = getattr(image, "name", image)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_image_variants(sender, instance, created, update_fields,
+                                 **kwargs):
+    if update_fields is not None and "image" not in update_fields:
+        return
+    image = instance.image
+    if not created and image.name == instance._loaded_image_name:
+        return
+    instance._loaded_image_name = image.name
+    if not created:
+        # variants of the previous image
+        Recipe.objects.filter(pk=instance.pk).update(image_variants=[])
+        instance.image_variants = []
+    if image and image.storage.exists(image.name):
+        schedule_image_variants(image.name)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        change_counters(User, "recipes_count", {instance.author_id: 1})
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    change_counters(User, "recipes_count", {instance.author_id: -1})
+
+
+@receiver(m2m_changed, sender=User.favorite_recipes.through)
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+@receiver(m2m_changed, sender=User.users_followed.through)
+def m2m_counter_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    source_field, target_field, counter_field = M2M_COUNTERS[sender]
+    update_m2m_counter(sender, source_field, target_field, counter_field,
+                       instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Cascade delete of m2m rows sends no m2m_changed signals.
+    for through, fields in M2M_COUNTERS.items():
+        source_field, target_field, counter_field = fields
+        update_m2m_counter(through, source_field, target_field,
+                           counter_field, instance, "pre_clear", False, None)
+
+
+@receiver(m2m_changed, sender=User.shopping_cart.through)
+def shopping_cart_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    update_shopping_lists(instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=Recipe)
+def collect_recipe_shopping_lists(sender, instance, **kwargs):
+    # Cascade delete of cart rows sends no m2m_changed signals.
+    instance._cart_user_ids = get_cart_user_ids(instance.pk)
+    instance._ingredient_ids = get_recipe_ingredient_ids((instance.pk,))
+
+
+@receiver(post_delete, sender=Recipe)
+def refresh_deleted_recipe_shopping_lists(sender, instance, **kwargs):
+    refresh_shopping_lists(instance.__dict__.pop("_cart_user_ids", ()),
+                           instance.__dict__.pop("_ingredient_ids", None))
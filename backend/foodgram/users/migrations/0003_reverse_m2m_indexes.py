@@ -0,0 +1,29 @@
+from django.db import migrations
+
+# Auto-created through tables only have (source, target) unique indexes
+# and single column ones. Reverse direction lookups, e.g. users that
+# favorited a recipe or followers of an author, are served by covering
+# (target, source) indexes.
+REVERSE_INDEXES = (
+    ("favorite_recipes_recipe_user_idx", "users_user_favorite_recipes",
+     "recipe_id, user_id"),
+    ("shopping_cart_recipe_user_idx", "users_user_shopping_cart",
+     "recipe_id, user_id"),
+    ("users_followed_to_from_idx", "users_user_users_followed",
+     "to_user_id, from_user_id"),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_counters"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f"CREATE INDEX {name} ON {table} ({columns})",
+            f"DROP INDEX {name}",
+        )
+        for name, table, columns in REVERSE_INDEXES
+    ]
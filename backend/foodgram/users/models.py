@@ -1,10 +1,10 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
-from recipes.models import Recipe  # isort:skip
+from recipes.models import CounterFieldsMixin, Recipe  # isort:skip
 
 
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     email = models.EmailField(
         verbose_name="email",
         help_text="User's email",
@@ -26,6 +26,20 @@ class User(AbstractUser):
         verbose_name="shopping_cart",
         help_text="Recipes to be shopped",
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="recipes_count",
+        help_text="Number of recipes authored by user",
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name="followers_count",
+        help_text="Number of users following user",
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ("recipes_count", "followers_count")
 
     class Meta(AbstractUser.Meta):
         ordering = ("pk",)